@@ -5,32 +5,38 @@
 # - Riwayat: status PENDING/APPROVED/REJECTED
 # - Sidebar baru (collapsed), tombol Refresh, Reset Database disembunyikan
 # Prasyarat: tabel per brand (inventory_*, pending_*, history_*), users_gulavit
-# Secrets: SUPABASE_URL, SUPABASE_KEY
+#             fungsi SQL apply_stock_deltas (sql/apply_stock_deltas.sql) untuk update stok atomik
+#             kolom history_*.idem_key + unique index (sql/history_idem_key.sql) untuk insert history idempoten
+#             kolom pending_*.claimed_by/claimed_at (sql/pending_claim.sql) untuk klaim approve/reject
+#             (opsional) stock_checkpoints_* (sql/stock_checkpoints.sql) untuk saldo per tanggal
+# Secrets: SUPABASE_URL, SUPABASE_KEY (lihat inventory_core)
 
 import os
-import base64
-from io import BytesIO
+import time
 from datetime import datetime
+from contextlib import nullcontext as _nullctx
 
+import numpy as np
 import pandas as pd
 import streamlit as st
-from supabase import create_client, Client
+
+# Data & engine (tanpa UI) ada di inventory_core; app.py hanya halaman Streamlit
+from inventory_core import (
+    ATTACHMENTS, BRANDS, HIST_ACTIONS, HIST_COLS, MASTER_COLS, PAGE_ROWS, TABLES, TRANS_TYPES, UPLOAD_SPECS,
+    approve_requests, brand_rollups, consolidated_frames, consolidated_kpis, errors_text, event_catalog,
+    export_formats, global_search, history_add, history_date_bounds, history_date_filters, history_query,
+    import_master_rows, inv_code_for, inv_insert_raw, invalidate_cache, iter_pages, iter_upload_chunks,
+    journal_flush, load_all_brands, load_brand_data, load_checkpoints, load_users, make_in_template_bytes,
+    make_master_template_bytes, make_out_template_bytes, make_return_template_bytes, normalize_out_record,
+    normalize_return_record, out_events_by_code, pending_add_many, pending_groups, pending_page, pending_rows,
+    prepared_history_stats, rebuild_checkpoints, reconcile_stock, reject_requests, reorder_all_brands,
+    reorder_insight, replay_spool, spooled_batches, stage_upload, start_prefetcher, stock_as_of,
+    stock_card_frame, ts_text, validate_master_sheet, write_report,
+)
 
 # -------------------- CONFIG --------------------
 BANNER_URL = "https://media.licdn.com/dms/image/v2/D563DAQFDri8xlKNIvg/image-scale_191_1128/image-scale_191_1128/0/1678337293506/pesona_inti_rasa_cover?e=2147483647&v=beta&t=vHi0xtyAZsT9clHb0yBYPE8M9IaO2dNY6Cb_Vs3Ddlo"
 ICON_URL   = "https://i.ibb.co/7C96T9y/favicon.png"
-UPLOADS_DIR = "uploads"
-os.makedirs(UPLOADS_DIR, exist_ok=True)
-
-BRANDS = ["gulavit","takokak"]
-TABLES = {
-    "gulavit": {"inv":"inventory_gulavit","pend":"pending_gulavit","hist":"history_gulavit"},
-    "takokak": {"inv":"inventory_takokak","pend":"pending_takokak","hist":"history_takokak"},
-}
-USERS_TABLE = "users_gulavit"
-
-TRANS_TYPES = ["Support", "Penjualan"]
-STD_REQ_COLS = ["date","code","item","qty","unit","event","trans_type","do_number","attachment","user","timestamp"]
 
 st.set_page_config(page_title="Inventory System", page_icon=ICON_URL, layout="wide")
 
@@ -67,225 +73,97 @@ try:
 except Exception:
     _ALT_OK = False
 
-# -------------------- SUPABASE --------------------
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# -------------------- UTILS --------------------
-def ts_text(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-def _to_date_str(val):
-    if val is None or str(val).strip()=="":
-        return datetime.now().strftime("%Y-%m-%d")
-    try:
-        return pd.to_datetime(val, errors="coerce").strftime("%Y-%m-%d")
-    except Exception:
-        return datetime.now().strftime("%Y-%m-%d")
-
-def _norm_event(s): return str(s).strip() if s is not None else "-"
-
-def _norm_trans_type(s):
-    s = "" if s is None else str(s).strip().lower()
-    if s == "support": return "Support"
-    if s == "penjualan": return "Penjualan"
-    return None
-
-def normalize_out_record(base: dict) -> dict:
-    rec = {k: None for k in STD_REQ_COLS}
-    rec.update({
-        "date": _to_date_str(base.get("date")),
-        "code": base.get("code","-") or "-",
-        "item": base.get("item","-") or "-",
-        "qty": int(pd.to_numeric(base.get("qty",0), errors="coerce") or 0),
-        "unit": base.get("unit","-") or "-",
-        "event": _norm_event(base.get("event","-")),
-        "trans_type": _norm_trans_type(base.get("trans_type")),
-        "do_number": base.get("do_number","-") or "-",
-        "attachment": base.get("attachment"),
-        "user": base.get("user", st.session_state.get("username","-")),
-        "timestamp": base.get("timestamp", ts_text()),
-    })
-    return rec
-
-def normalize_return_record(base: dict) -> dict:
-    rec = {k: None for k in STD_REQ_COLS}
-    rec.update({
-        "date": _to_date_str(base.get("date")),
-        "code": base.get("code","-") or "-",
-        "item": base.get("item","-") or "-",
-        "qty": int(pd.to_numeric(base.get("qty",0), errors="coerce") or 0),
-        "unit": base.get("unit","-") or "-",
-        "event": _norm_event(base.get("event","-")),
-        "trans_type": None,
-        "do_number": "-",
-        "attachment": None,
-        "user": base.get("user", st.session_state.get("username","-")),
-        "timestamp": base.get("timestamp", ts_text()),
-    })
-    return rec
-
-def dataframe_to_excel_bytes(df: pd.DataFrame, sheet="Sheet1") -> bytes:
-    bio = BytesIO()
-    with pd.ExcelWriter(bio, engine="xlsxwriter") as w:
-        df.to_excel(w, index=False, sheet_name=sheet)
-    bio.seek(0); return bio.read()
-
-def make_master_template_bytes() -> bytes:
-    cols = ["Kode Barang", "Nama Barang", "Qty", "Satuan", "Kategori"]
-    df_tmpl = pd.DataFrame([{"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":10,"Satuan":"PCS","Kategori":"Umum"}], columns=cols)
-    return dataframe_to_excel_bytes(df_tmpl, "Template Master")
-
-def make_out_template_bytes(inv_records: list) -> bytes:
-    today = pd.Timestamp.now().strftime("%Y-%m-%d")
-    cols = ["Tanggal","Kode Barang","Nama Barang","Qty","Event","Tipe"]
-    rows=[]
-    if inv_records:
-        for r in inv_records[:2]:
-            rows.append({"Tanggal":today,"Kode Barang":r["code"],"Nama Barang":r["name"],"Qty":1,"Event":"Contoh event","Tipe":"Support"})
-    else:
-        rows.append({"Tanggal":today,"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":1,"Event":"Contoh event","Tipe":"Support"})
-    return dataframe_to_excel_bytes(pd.DataFrame(rows, columns=cols), "Template OUT")
-
-def make_in_template_bytes(inv_records: list) -> bytes:
-    today = pd.Timestamp.now().strftime("%Y-%m-%d")
-    cols = ["Tanggal","Kode Barang","Nama Barang","Qty","Unit (opsional)","Event (opsional)"]
-    rows=[]
-    if inv_records:
-        for r in inv_records[:2]:
-            rows.append({"Tanggal":today,"Kode Barang":r["code"],"Nama Barang":r["name"],"Qty":5,"Unit (opsional)":"PCS","Event (opsional)":""})
-    else:
-        rows.append({"Tanggal":today,"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":10,"Unit (opsional)":"PCS","Event (opsional)":""})
-    return dataframe_to_excel_bytes(pd.DataFrame(rows, columns=cols), "Template IN")
-
-def make_return_template_bytes(inv_records: list) -> bytes:
-    today = pd.Timestamp.now().strftime("%Y-%m-%d")
-    cols = ["Tanggal","Kode Barang","Nama Barang","Qty","Event"]
-    rows=[]
-    if inv_records:
-        for r in inv_records[:2]:
-            rows.append({"Tanggal":today,"Kode Barang":r["code"],"Nama Barang":r["name"],"Qty":1,"Event":"Contoh event dari OUT"})
-    else:
-        rows.append({"Tanggal":today,"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":1,"Event":"Contoh event"})
-    return dataframe_to_excel_bytes(pd.DataFrame(rows, columns=cols), "Template Retur")
-
-# -------------------- READS --------------------
-@st.cache_data(ttl=300)
-def _load_users() -> dict:
+# -------------------- UI HELPERS --------------------
+# Pilihan format + tombol unduh. sheets: dict, atau fungsi → dict bila lazy (dibangun hanya saat tombol
+# "Siapkan" diklik, mis. export seluruh history). Non-lazy: file dibuat per render dan langsung dihapus
+# setelah isinya diserahkan ke download_button. Lazy: file disimpan per key sampai dibuat ulang / kedaluwarsa.
+def export_download(label: str, sheets, base_name: str, key: str, lazy=False):
+    c1, c2 = st.columns([1, 2])
+    fmt = c1.selectbox("Format", export_formats(), key=f"{key}_fmt")
+    if not lazy or c2.button(f"Siapkan {label}", key=f"{key}_go"):
+        prev = st.session_state.pop(f"{key}_file", None)
+        if prev and os.path.exists(prev[0]): os.remove(prev[0])
+        try:
+            with st.spinner("Menyiapkan file…") if lazy else _nullctx():
+                st.session_state[f"{key}_file"] = (*write_report(sheets() if callable(sheets) else sheets, fmt), fmt)
+        except Exception as e:
+            st.error(f"Gagal membuat file {fmt}: {e}"); return
+    got = st.session_state.get(f"{key}_file")
+    if got and got[3] == fmt and os.path.exists(got[0]):
+        path, ext, mime, _ = got
+        if lazy: c2.caption(f"File siap: {os.path.getsize(path)/1e6:.1f} MB")
+        with open(path, "rb") as f:
+            st.download_button(f"Unduh {label}", data=f, file_name=f"{base_name}{ext}", mime=mime, key=f"{key}_dl")
+        if not lazy:
+            os.remove(path); del st.session_state[f"{key}_file"]
+
+# Jalankan stage_chunk(df) → (n_ok, errors) untuk tiap chunk sambil menampilkan progress.
+# Kolom wajib dicek di chunk pertama (raise ValueError bila kurang). Return (added, errors).
+def ingest_upload(fu, required: list, stage_chunk):
+    bar = st.progress(0.0, text="Membaca file…")
+    added, errors, seen = 0, [], 0
     try:
-        res = supabase.from_(USERS_TABLE).select("*").execute()
-        df = pd.DataFrame(res.data or [])
-        users = {}
-        if not df.empty:
-            for _, r in df.iterrows():
-                users[str(r["username"])] = {"password": str(r["password"]), "role": str(r["role"])}
-        if not users:
-            users = {
-                "admin":{"password":st.secrets.get("passwords",{}).get("admin","admin"),"role":"admin"},
-                "user":{"password":st.secrets.get("passwords",{}).get("user","user"),"role":"user"},
-            }
-        return users
-    except Exception:
-        return {
-            "admin":{"password":st.secrets.get("passwords",{}).get("admin","admin"),"role":"admin"},
-            "user":{"password":st.secrets.get("passwords",{}).get("user","user"),"role":"user"},
-        }
-
-def _safe_select(table: str) -> pd.DataFrame:
+        for df, frac in iter_upload_chunks(fu):
+            if seen == 0:
+                miss = [c for c in required if c not in df.columns]
+                if miss: raise ValueError(f"Kolom kurang: {', '.join(miss)}")
+            n, errs = stage_chunk(df)
+            added += n; errors += errs; seen += max(len(df), 1)
+            bar.progress(frac if frac is not None else 0.0, text=f"{seen:,} baris diproses…")
+    finally:
+        bar.empty()
+    return added, errors
+
+# Tabel per halaman; cols = kolom yang ditampilkan. Return potongan df (semua kolom) halaman aktif.
+def _paged_dataframe(df: pd.DataFrame, key: str, page_size=PAGE_ROWS, default_last=False, cols=None) -> pd.DataFrame:
+    n = len(df); pages = max(1, -(-n // page_size))
+    c1, c2 = st.columns([1, 3])
+    page = c1.number_input("Halaman", min_value=1, max_value=pages, step=1, key=key,
+                           value=(pages if default_last else 1))
+    c2.caption(f"Halaman {page} / {pages} · {n:,} baris")
+    part = df.iloc[(page-1)*page_size: page*page_size]
+    st.dataframe(part[cols] if cols else part, use_container_width=True, hide_index=True)
+    return part
+
+# Lampiran dibaca dari store hanya untuk baris yang dipilih
+def _attachment_button(ref, key, label="Unduh Lampiran"):
+    f = ATTACHMENTS.open(ref)
+    if f is None:
+        st.caption("File lampiran tidak ditemukan."); return
+    with f:
+        st.download_button(label, data=f.read(), file_name=ATTACHMENTS.filename(ref), mime="application/pdf", key=key)
+
+# Halaman history ber-keyset + navigasi. State (stack cursor, total) per key, reset bila filter berubah.
+def _history_pager(brand: str, key: str, page_size=PAGE_ROWS, **filters) -> pd.DataFrame:
+    sig = (brand, tuple(sorted((k, str(v)) for k, v in filters.items())))
+    s = st.session_state.get(key)
+    if s is None or s["sig"] != sig:
+        s = st.session_state[key] = {"sig": sig, "stack": [None], "total": None}
     try:
-        res = supabase.from_(table).select("*").execute()
-        return pd.DataFrame(res.data or [])
+        df, total, nxt = history_query(brand, cursor=s["stack"][-1], page_size=page_size,
+                                       with_count=(s["total"] is None), **filters)
     except Exception as e:
-        st.warning(f"Tabel '{table}' tidak bisa dibaca: {e}")
-        return pd.DataFrame([])
-
-def load_brand_data(brand: str) -> dict:
-    t = TABLES[brand]
-    df_inv  = _safe_select(t["inv"])
-    df_pend = _safe_select(t["pend"])
-    df_hist = _safe_select(t["hist"])
-
-    inv = {}
-    if not df_inv.empty:
-        for _, r in df_inv.iterrows():
-            inv[str(r.get("code","-"))] = {
-                "name": str(r.get("item","-")),
-                "qty": int(pd.to_numeric(r.get("qty",0), errors="coerce") or 0),
-                "unit": str(r.get("unit","-")) if pd.notna(r.get("unit")) else "-",
-                "category": str(r.get("category","Uncategorized")) if pd.notna(r.get("category")) else "Uncategorized",
-            }
-
-    pend=[]
-    if not df_pend.empty:
-        for _, r in df_pend.iterrows():
-            base = {k: r.get(k) for k in STD_REQ_COLS}
-            base.update({"type": r.get("type"), "id": r.get("id")})
-            rec = normalize_return_record(base) if base["type"]=="RETURN" else normalize_out_record(base)
-            rec["type"]=base["type"]; rec["id"]=base["id"]
-            pend.append(rec)
-
-    hist = df_hist.to_dict(orient="records") if not df_hist.empty else []
-    return {"users": _load_users(), "inventory": inv, "pending_requests": pend, "history": hist}
-
-def invalidate_cache(): st.cache_data.clear()
-
-# -------------------- WRITES --------------------
-def inv_insert_raw(brand, payload: dict):
-    t = TABLES[brand]
-    supabase.from_(t["inv"]).insert(payload).execute()
-    invalidate_cache()
-
-def inv_update_qty(brand, code, new_qty):
-    t = TABLES[brand]
-    supabase.from_(t["inv"]).update({"qty": int(new_qty)}).eq("code", code).execute()
-    invalidate_cache()
-
-def pending_add_many(brand, records: list):
-    if not records: return
-    t = TABLES[brand]
-    supabase.from_(t["pend"]).insert(records).execute()
-    invalidate_cache()
-
-def pending_delete_by_ids(brand, ids: list):
-    t = TABLES[brand]
-    if not ids: return
-    for chunk in [ids[i:i+1000] for i in range(0, len(ids), 1000)]:
-        supabase.from_(t["pend"]).delete().in_("id", chunk).execute()
-    invalidate_cache()
-
-def history_add(brand, rec: dict):
-    t = TABLES[brand]
-    supabase.from_(t["hist"]).insert(rec).execute()
-    invalidate_cache()
-
-def reset_brand(brand):
-    t = TABLES[brand]
-    supabase.from_(t["pend"]).delete().neq("id",-1).execute()
-    supabase.from_(t["hist"]).delete().neq("id",-1).execute()
-    supabase.from_(t["inv"]).delete().neq("code","").execute()
-    invalidate_cache()
-
-# -------------------- DASHBOARD HELPERS --------------------
-def _prepare_history_df(data: dict) -> pd.DataFrame:
-    df = pd.DataFrame(data.get("history", []))
-    if df.empty: return df
-    df["qty"] = pd.to_numeric(df.get("qty",0), errors="coerce").fillna(0).astype(int)
-    s_date = pd.to_datetime(df["date"], errors="coerce") if "date" in df.columns else pd.Series(pd.NaT, index=df.index)
-    s_ts   = pd.to_datetime(df["timestamp"], errors="coerce") if "timestamp" in df.columns else pd.Series(pd.NaT, index=df.index)
-    df["date_eff"] = s_date.fillna(s_ts).dt.floor("D")
-    act = df.get("action","").astype(str).str.upper()
-    df["type_norm"]="-"
-    df.loc[act.str.contains("APPROVE_IN"),"type_norm"]="IN"
-    df.loc[act.str.contains("APPROVE_OUT"),"type_norm"]="OUT"
-    df.loc[act.str.contains("APPROVE_RETURN"),"type_norm"]="RETURN"
-    for c in ["item","event","trans_type","unit"]:
-        if c not in df.columns: df[c]=None
-    df["event"]=df["event"].fillna("-").astype(str)
-    df["trans_type"]=df["trans_type"].fillna("-").astype(str)
-    df = df[df["type_norm"].isin(["IN","OUT","RETURN"])].copy()
-    df = df.dropna(subset=["date_eff"])
+        st.warning(f"Gagal membaca riwayat: {e}"); return pd.DataFrame(columns=HIST_COLS.split(","))
+    if total is not None: s["total"] = total
+    c1, c2, c3 = st.columns([1, 1, 3])
+    if c1.button("‹ Sebelumnya", key=f"{key}_prev", disabled=len(s["stack"]) <= 1):
+        s["stack"].pop(); st.rerun()
+    if c2.button("Berikutnya ›", key=f"{key}_next", disabled=nxt is None):
+        s["stack"].append(nxt); st.rerun()
+    n = s["total"] or 0
+    c3.caption(f"Halaman {len(s['stack'])} / {max(1, -(-n // page_size))} · {n:,} baris")
     return df
 
+# -------------------- DASHBOARD --------------------
+# Rollup per bulan → periode dipilih per bulan (bukan tanggal, yang diam-diam dibulatkan ke bulan).
+# Default 12 bulan terakhir s/d bulan berjalan → (Period awal, Period akhir)
+def _month_range_picker(df_roll: pd.DataFrame, key: str):
+    cur_m = pd.Timestamp.today().to_period("M")
+    seen = df_roll["month"].dropna() if "month" in df_roll else pd.Series(dtype="datetime64[ns]")
+    first_m = min([cur_m - 11] + ([seen.min().to_period("M")] if not seen.empty else []))
+    return st.select_slider("Periode (bulan)", options=list(pd.period_range(first_m, cur_m, freq="M")),
+                            value=(cur_m - 11, cur_m), format_func=lambda m: m.strftime("%b %Y"), key=key)
+
 def _kpi_card(title, value, sub=None):
     st.markdown(f"""<div class="kpi-card"><div class="kpi-title">{title}</div>
                     <div class="kpi-value">{value}</div>
@@ -293,25 +171,22 @@ def _kpi_card(title, value, sub=None):
 
 def render_dashboard_pro(data: dict, brand_label: str, allow_download=True):
     try:
-        df_hist = _prepare_history_df(data)
+        df_roll = brand_rollups(data)
         inv_records = [{"Kode":c,"Nama Barang":it.get("name","-"),"Current Stock":int(it.get("qty",0)),"Unit":it.get("unit","-")}
                        for c,it in data.get("inventory",{}).items()]
         df_inv = pd.DataFrame(inv_records)
         st.markdown(f"## Dashboard — {brand_label}")
-        st.caption("Metrik berbasis qty. *Sales* = OUT tipe **Penjualan**.")
+        st.caption("Metrik berbasis qty. *Sales* = OUT tipe **Penjualan**. Periode dihitung per bulan penuh.")
+        ps = prepared_history_stats(data["brand"])
+        if ps: st.caption(f"Frame riwayat: {ps['rows']:,} baris · {ps['bytes']/1e6:.1f} MB · dibangun {ps['build_ms']:.0f} ms")
         st.divider()
 
         today = pd.Timestamp.today().normalize()
-        default_start = (today - pd.DateOffset(months=11)).replace(day=1)
-        F1, F2 = st.columns(2)
-        start_date = F1.date_input("Tanggal mulai", value=default_start.date())
-        end_date   = F2.date_input("Tanggal akhir", value=today.date())
-
-        if not df_hist.empty:
-            mask = (df_hist["date_eff"]>=pd.Timestamp(start_date))&(df_hist["date_eff"]<=pd.Timestamp(end_date))
-            df_range=df_hist.loc[mask].copy()
-        else:
-            df_range=pd.DataFrame(columns=["date_eff","type_norm","qty","item","event","trans_type"])
+        m_from, m_to = _month_range_picker(df_roll, key="dash_months")
+        m_start, m_end = m_from.to_timestamp(), m_to.to_timestamp()
+        # bulan akhir yang masih berjalan → patokan reorder hari ini (bulan berjalan tidak dihitung)
+        ref_end = min(m_to.to_timestamp(how="end").normalize(), today)
+        df_range = df_roll[(df_roll["month"]>=m_start)&(df_roll["month"]<=m_end)]
 
         total_sku = int(len(df_inv)) if not df_inv.empty else 0
         total_qty = int(df_inv["Current Stock"].sum()) if not df_inv.empty else 0
@@ -321,16 +196,15 @@ def render_dashboard_pro(data: dict, brand_label: str, allow_download=True):
 
         c1,c2,c3,c4 = st.columns(4)
         _kpi_card("Total SKU", f"{total_sku:,}", f"Brand {brand_label}")
-        _kpi_card("Total Qty (Stock)", f"{total_qty:,}", f"Per {pd.Timestamp(end_date).strftime('%d %b %Y')}")
+        _kpi_card("Total Qty (Stock)", f"{total_qty:,}", f"Per {today.strftime('%d %b %Y')}")
         _kpi_card("Total IN (periode)", f"{tot_in:,}")
         _kpi_card("Total OUT / Retur", f"{tot_out:,} / {tot_ret:,}")
 
         st.divider()
 
         def month_agg(df, tipe):
-            d = df[df["type_norm"]==tipe].copy()
+            d = df[df["type_norm"]==tipe]
             if d.empty: return pd.DataFrame({"month":[], "qty":[], "Periode":[], "idx":[]})
-            d["month"]=d["date_eff"].dt.to_period("M").dt.to_timestamp()
             g=d.groupby("month", as_index=False)["qty"].sum().sort_values("month")
             g["Periode"]=g["month"].dt.strftime("%b %Y")
             g["idx"]=g["month"].dt.year.astype(int)*12+g["month"].dt.month.astype(int)
@@ -376,9 +250,7 @@ def render_dashboard_pro(data: dict, brand_label: str, allow_download=True):
 
         with t2:
             st.markdown('<div class="card"><div class="smallcap">Top 5 Event by OUT Qty</div>', unsafe_allow_html=True)
-            df_ev=df_range[(df_range["type_norm"]=="OUT") & (df_range["event"].notna())].copy()
-            df_ev=df_ev[df_ev["event"].astype(str).str.trim().ne("-")]
-            if "event" not in df_ev.columns: df_ev["event"]="-"
+            df_ev=df_range[(df_range["type_norm"]=="OUT") & (df_range["event"].astype(str).str.strip().ne("-"))]
             ev_top=(df_ev.groupby("event", as_index=False)["qty"].sum().sort_values("qty", ascending=False).head(5))
             if _ALT_OK and not ev_top.empty:
                 chart=(alt.Chart(ev_top).mark_bar(size=22)
@@ -393,40 +265,19 @@ def render_dashboard_pro(data: dict, brand_label: str, allow_download=True):
 
         st.divider()
 
-        st.subheader("Reorder Insight (berdasarkan OUT 3 bulan terakhir)")
-        st.caption("Days of Cover = stok saat ini / rata-rata OUT harian (3 bulan).")
+        st.subheader("Reorder Insight (berdasarkan OUT 3 bulan penuh terakhir)")
+        st.caption(f"Days of Cover = stok saat ini / rata-rata OUT harian. OUT dihitung dari 3 bulan kalender penuh "
+                   f"s/d {ref_end.strftime('%d %b %Y')}; bulan yang belum selesai tidak ikut.")
         tgt_days = st.slider("Target Days of Cover", min_value=30, max_value=120, step=15, value=60)
 
         if df_inv.empty:
             st.info("Inventory kosong."); 
             return
-        ref_end = pd.Timestamp(end_date)
-        last3_start = (ref_end - pd.DateOffset(months=3)).normalize() + pd.Timedelta(days=1)
-        out3 = df_hist[(df_hist["type_norm"]=="OUT") & (df_hist["date_eff"]>=last3_start) & (df_hist["date_eff"]<=ref_end)]
-        out3_item = out3.groupby("item")["qty"].sum().to_dict()
-
-        rows=[]
-        for _, r in df_inv.iterrows():
-            name=r["Nama Barang"]; stock=int(r["Current Stock"]); unit=r.get("Unit","-")
-            last3=int(out3_item.get(name,0)); avg_m=last3/3.0; avg_daily=(avg_m/30.0) if avg_m>0 else 0.0
-            doc = (stock/avg_daily) if avg_daily>0 else float("inf")
-            if doc==float("inf"): reco,urg="OK (tidak ada pemakaian)",5
-            elif doc<15: reco,urg="Order NOW (Urgent)",1
-            elif doc<30: reco,urg="Order bulan ini",2
-            elif doc<60: reco,urg="Order bulan depan",3
-            elif doc<90: reco,urg="Order 2 bulan lagi",4
-            else: reco,urg="OK (stok aman)",5
-            target_qty=int(max(0,(avg_daily*tgt_days)-stock)) if avg_daily>0 else 0
-            rows.append({"Nama Barang":name,"Unit":unit,"Current Stock":stock,"OUT 3 Bulan":last3,
-                         "Avg OUT / Bulan":round(avg_m,1),"Days of Cover":("∞" if doc==float("inf") else int(round(doc))),
-                         "Rekomendasi":reco,"Saran Order (Qty)":target_qty,"_urgency":urg})
-        df_reorder=pd.DataFrame(rows).sort_values(["_urgency","Days of Cover"], ascending=[True, True]).drop(columns=["_urgency"])
+        df_reorder = reorder_insight(data, df_roll, tgt_days, ref_end)
         st.dataframe(df_reorder, use_container_width=True, hide_index=True)
         if allow_download and not df_reorder.empty:
-            data = dataframe_to_excel_bytes(df_reorder, "Reorder Insight")
-            st.download_button("Unduh Excel Reorder Insight", data=data,
-                               file_name=f"Reorder_{brand_label.replace(' ','_')}.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            export_download("Reorder Insight", {"Reorder Insight": df_reorder},
+                            f"Reorder_{brand_label.replace(' ','_')}", key="exp_reorder")
     except Exception as e:
         st.error(f"Dashboard error: {e}")
 
@@ -453,7 +304,7 @@ if not st.session_state.logged_in:
     username = st.text_input("Username", placeholder="Masukkan username")
     password = st.text_input("Password", type="password", placeholder="Masukkan password")
     if st.button("Login"):
-        users=_load_users(); user=users.get(username)
+        users=load_users(); user=users.get(username)
         if user and user["password"]==password:
             st.session_state.logged_in=True
             st.session_state.username=username
@@ -465,6 +316,7 @@ if not st.session_state.logged_in:
     st.stop()
 
 role = st.session_state.role
+start_prefetcher()
 
 # -------------------- TOP TOOLBAR --------------------
 def global_toolbar():
@@ -478,6 +330,7 @@ def global_toolbar():
         )
         if brand_sel != st.session_state.current_brand:
             st.session_state.current_brand = brand_sel
+            st.session_state.brand_switched = True
             st.rerun()
     with c2:
         st.text_input("Cari Kode/Nama/Event…", key="global_search", placeholder="Cari cepat…")
@@ -490,8 +343,48 @@ def global_toolbar():
         )
     st.divider()
 
+# Pindah halaman dari hasil pencarian; preset = nilai awal widget di halaman tujuan (dipanggil via on_click)
+def _search_jump(menu, **preset):
+    st.session_state.menu = menu; st.session_state.global_search = ""
+    for k, v in preset.items(): st.session_state[k] = v
+
+def render_global_search(data: dict):
+    q = str(st.session_state.get("global_search", "")).strip()
+    if not q: return
+    admin = st.session_state.role == "admin"
+    t0 = time.perf_counter()
+    items, hist = global_search(data, q, user=(None if admin else st.session_state.username))
+    ms = (time.perf_counter()-t0)*1000
+    riw_menu, riw_key = ("Riwayat Lengkap", "riw_item_q") if admin else ("Lihat Riwayat", "riw_user_item_q")
+    with st.expander(f"🔎 Hasil \"{q}\": {len(items)} barang, {len(hist)} riwayat · {ms:.1f} ms", expanded=True):
+        if items.empty and hist.empty: st.caption("Tidak ada hasil."); return
+        inv = data["inventory"]
+        if not items.empty:
+            st.dataframe(pd.DataFrame({"Kode": items["code"], "Nama Barang": items["item"],
+                                       "Qty": [inv[c]["qty"] for c in items["code"]],
+                                       "Kategori": [inv[c].get("category","-") for c in items["code"]]}),
+                         use_container_width=True, hide_index=True)
+            c1, c2, c3, c4 = st.columns([3,1,1,1])
+            code = c1.selectbox("Barang", items["code"].tolist(), key="gs_item",
+                                format_func=lambda c: f"{inv[c]['name']} ({c})")
+            if admin: c2.button("Stok", key="gs_to_stok", on_click=_search_jump, args=("Lihat Stok Barang",), kwargs={"stok_q": code})
+            c3.button("Stock Card", key="gs_to_card", on_click=_search_jump, args=("Stock Card",), kwargs={"stock_card_sel": code})
+            c4.button("Riwayat", key="gs_to_riw", on_click=_search_jump, args=(riw_menu,), kwargs={riw_key: inv[code]["name"]})
+        if not hist.empty:
+            st.dataframe(hist[["date","action","code","item","event","do_number"]], use_container_width=True, hide_index=True)
+            c1, c2 = st.columns([3,1])
+            hist = hist.set_index("ref", drop=False)
+            rid = c1.selectbox("Riwayat", hist.index.tolist(), key="gs_hist",
+                               format_func=lambda i: f"{hist.at[i,'date']} · {hist.at[i,'item']} · DO {hist.at[i,'do_number']}")
+            c2.button("Buka di Riwayat", key="gs_hist_go", on_click=_search_jump, args=(riw_menu,),
+                      kwargs={riw_key: str(hist.at[rid, "item"])})
+
 global_toolbar()
-DATA = load_brand_data(st.session_state.current_brand)
+DATA = load_brand_data(st.session_state.current_brand, allow_stale=st.session_state.pop("brand_switched", False))
+if DATA.get("checked_at"):
+    st.caption(f"⏱ Data {st.session_state.current_brand.capitalize()} dari cache latar, dicek "
+               f"{int(time.time()-DATA['checked_at'])} detik lalu. Interaksi berikutnya memuat versi terbaru.")
+render_global_search(DATA)
 
 # -------------------- NOTIF --------------------
 if st.session_state.notification:
@@ -499,9 +392,54 @@ if st.session_state.notification:
     (st.success if nt["type"]=="success" else st.warning if nt["type"]=="warning" else st.error)(nt["message"])
     st.session_state.notification=None
 
+if role == "admin" and spooled_batches():
+    c1, c2 = st.columns([3,1])
+    c1.warning(f"{len(spooled_batches())} batch riwayat belum terkirim ke database.")
+    if c2.button("Kirim ulang riwayat"):
+        sent, left = replay_spool()
+        st.session_state.notification = {"type": "warning" if left else "success",
+                                         "message": f"{sent} baris riwayat terkirim." + (f" {left} batch masih gagal." if left else "")}
+        st.rerun()
+
 # -------------------- ADMIN PAGES (dari script lama) --------------------
 def page_admin_dashboard(): render_dashboard_pro(DATA, st.session_state.current_brand.capitalize(), allow_download=False)
 
+def page_admin_consolidated():
+    st.markdown("## Dashboard Konsolidasi — Semua Brand"); st.divider()
+    t0=time.perf_counter(); bundles=load_all_brands(); ms=(time.perf_counter()-t0)*1000
+    inv, roll = consolidated_frames(bundles)
+    st.caption(f"{len(bundles)} brand dimuat paralel dalam {ms:.0f} ms. Metrik berbasis qty, periode per bulan penuh.")
+
+    m_from,m_to=_month_range_picker(roll, key="cons_months")
+    m_start,m_end=m_from.to_timestamp(),m_to.to_timestamp()
+    kpi=consolidated_kpis(inv, roll, m_start, m_end)
+
+    tot=kpi.set_index("Brand").loc["TOTAL"]
+    c1,c2,c3,c4=st.columns(4)
+    with c1: _kpi_card("Total SKU", f"{tot['Total SKU']:,}", f"{len(bundles)} brand")
+    with c2: _kpi_card("Total Qty (Stock)", f"{tot['Total Qty (Stock)']:,}")
+    with c3: _kpi_card("Total IN (periode)", f"{tot['IN']:,}")
+    with c4: _kpi_card("Total OUT / Retur", f"{tot['OUT']:,} / {tot['Retur']:,}")
+    st.divider()
+    st.markdown("### KPI per Brand")
+    st.dataframe(kpi, use_container_width=True, hide_index=True)
+
+    rng=roll[(roll["month"]>=m_start)&(roll["month"]<=m_end)]
+    out_m=rng[rng["type_norm"]=="OUT"].groupby(["month","Brand"], as_index=False)["qty"].sum()
+    st.markdown("### OUT per Bulan per Brand")
+    if out_m.empty: st.info("Belum ada data.")
+    elif _ALT_OK:
+        st.altair_chart(alt.Chart(out_m).mark_bar().encode(
+            x=alt.X("yearmonth(month):O", title="Periode"), y=alt.Y("qty:Q", title="Qty"), color="Brand:N",
+            tooltip=[alt.Tooltip("month:T", title="Periode", format="%b %Y"), "Brand:N", "qty:Q"]).properties(height=320),
+            use_container_width=True)
+    else: st.bar_chart(out_m.pivot(index="month", columns="Brand", values="qty"))
+
+    mutasi=rng.groupby(["Brand","month","type_norm","code","item"], as_index=False)["qty"].sum()
+    mutasi["month"]=mutasi["month"].dt.strftime("%Y-%m")
+    export_download("Konsolidasi", {"Ringkasan": kpi, "Stok": inv, "Mutasi Bulanan": mutasi},
+                    f"Konsolidasi_{m_from.strftime('%Y%m')}-{m_to.strftime('%Y%m')}", key="exp_cons")
+
 def page_admin_lihat_stok():
     st.markdown(f"## Stok Barang - {st.session_state.current_brand.capitalize()}"); st.divider()
     inv = DATA["inventory"]
@@ -511,7 +449,7 @@ def page_admin_lihat_stok():
     cats=["Semua Kategori"]+sorted(df["Kategori"].dropna().unique().tolist())
     c1,c2 = st.columns(2)
     cat=c1.selectbox("Pilih Kategori", cats)
-    q=c2.text_input("Cari Nama/Kode")
+    q=c2.text_input("Cari Nama/Kode", key="stok_q")
     view=df.copy()
     if cat!="Semua Kategori": view=view[view["Kategori"]==cat]
     if q: view=view[ view["Nama Barang"].str.contains(q, case=False) | view["Kode"].str.contains(q, case=False) ]
@@ -519,38 +457,42 @@ def page_admin_lihat_stok():
 
 def page_admin_stock_card():
     st.markdown(f"## Stock Card - {st.session_state.current_brand.capitalize()}"); st.divider()
-    hist=DATA["history"]
-    if not hist: st.info("Belum ada riwayat."); return
-    item_names=sorted({it["name"] for it in DATA["inventory"].values()})
-    if not item_names: st.info("Belum ada master barang."); return
-    sel = st.selectbox("Pilih Barang", item_names)
+    if not DATA["history"]: st.info("Belum ada riwayat."); return
+    inv=DATA["inventory"]
+    if not inv: st.info("Belum ada master barang."); return
+    codes=sorted(inv, key=lambda c: (inv[c]["name"], c))
+    c1,c2=st.columns([2,1])
+    sel = c1.selectbox("Pilih Barang", codes, format_func=lambda c: f"{inv[c]['name']} ({c})", key="stock_card_sel")
     if not sel: return
-    filtered=[h for h in hist if h.get("item")==sel and (str(h.get("action","")).startswith("APPROVE") or str(h.get("action","")).startswith("ADD"))]
-    if not filtered: st.info("Belum ada transaksi disetujui untuk barang ini."); return
-    df=pd.DataFrame(filtered)
-    df["date_eff"]=pd.to_datetime(df["date"], errors="coerce")
-    df["ts"]=pd.to_datetime(df["timestamp"], errors="coerce")
-    df["sort_key"]=df["date_eff"].fillna(df["ts"])
-    df=df.sort_values(["sort_key","ts"]).reset_index(drop=True)
-    rows=[]; saldo=0
-    for _,h in df.iterrows():
-        act=str(h.get("action","")).upper()
-        qty=int(pd.to_numeric(h.get("qty",0), errors="coerce") or 0)
-        t_in=t_out="-"; ket="N/A"
-        if act=="ADD_ITEM":
-            t_in=qty; saldo+=qty; ket="Initial Stock"
-        elif act=="APPROVE_IN":
-            t_in=qty; saldo+=qty
-            do=h.get("do_number","-"); ket=f"Request IN by {h.get('user','-')}" + (f" (DO: {do})" if do and do!='- ' else "")
-        elif act=="APPROVE_OUT":
-            t_out=qty; saldo-=qty
-            ket=f"Request OUT ({h.get('trans_type','-')}) by {h.get('user','-')} — Event: {h.get('event','-')}"
-        elif act=="APPROVE_RETURN":
-            t_in=qty; saldo+=qty
-            ket=f"Retur by {h.get('user','-')} — Event: {h.get('event','-')}"
-        rows.append({"Tanggal": h.get("date", h.get("timestamp","")), "Keterangan":ket,
-                     "Masuk (IN)": t_in if t_in!="-" else "-", "Keluar (OUT)": t_out if t_out!="-" else "-", "Saldo Akhir": saldo})
-    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    ck=load_checkpoints(st.session_state.current_brand, code=sel)
+    last_ck=ck["as_of"].max() if not ck.empty else None
+    from_ck=c2.checkbox("Mulai dari checkpoint terakhir", value=pd.notna(last_ck), disabled=pd.isna(last_ck))
+    start=(last_ck + pd.Timedelta(days=1)) if from_ck and pd.notna(last_ck) else None
+    if start is not None: st.caption(f"Saldo awal per checkpoint {last_ck.strftime('%d %b %Y')}; transaksi sesudahnya di-replay.")
+    df=stock_card_frame(DATA, sel, start=start)
+    if df.empty: st.info("Belum ada transaksi disetujui untuk barang ini."); return
+    _paged_dataframe(df, f"stock_card_page_{sel}_{start}", default_last=True)
+
+    if st.session_state.role=="admin":
+        with st.expander("Checkpoint & Rekonsiliasi", expanded=False):
+            as_of=st.date_input("Saldo per tanggal", value=pd.Timestamp.today().date(), key="stock_as_of_date")
+            bal=stock_as_of(DATA, as_of, sel)
+            st.metric(f"Saldo {inv[sel]['name']} per {pd.Timestamp(as_of).strftime('%d %b %Y')}", f"{int(bal.get(sel,0)):,}")
+            if st.button("Perbarui Checkpoint (akhir bulan lalu)"):
+                try:
+                    n=rebuild_checkpoints(DATA)
+                    st.session_state.notification={"type":"success","message":f"{n} checkpoint diperbarui."}
+                except Exception as e:
+                    st.session_state.notification={"type":"error","message":f"Gagal menyimpan checkpoint: {e}"}
+                st.rerun()
+            # Rekonsiliasi menghitung saldo semua item → hanya saat diminta; hasil disimpan per versi data
+            if st.button("Cek Rekonsiliasi Inventory vs Ledger"):
+                st.session_state.recon=(DATA["brand"], DATA["version"], reconcile_stock(DATA))
+            rc=st.session_state.get("recon")
+            if rc and rc[:2]==(DATA["brand"], DATA["version"]):
+                diff=rc[2]
+                if diff.empty: st.success("Qty inventory cocok dengan ledger.")
+                else: st.warning(f"{len(diff)} item selisih antara inventory dan ledger."); st.dataframe(diff, use_container_width=True, hide_index=True)
 
 def page_admin_tambah_master():
     st.markdown(f"## Tambah Master Barang - {st.session_state.current_brand.capitalize()}"); st.divider()
@@ -572,6 +514,7 @@ def page_admin_tambah_master():
                                                          "unit":unit.strip() or "-","user":st.session_state.username,"event":"-",
                                                          "timestamp":ts_text(),"date":datetime.now().strftime("%Y-%m-%d"),
                                                          "code":code.strip(),"trans_type":None,"do_number":"-","attachment":None})
+            journal_flush()
             st.success(f"Barang '{name}' ditambahkan.")
             st.experimental_rerun()
     with tab2:
@@ -579,179 +522,157 @@ def page_admin_tambah_master():
         st.download_button("📥 Unduh Template Master Excel", data=make_master_template_bytes(),
                            file_name=f"Template_Master_{st.session_state.current_brand.capitalize()}.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        fu=st.file_uploader("Upload File Excel Master", type=["xlsx"])
+        fu=st.file_uploader("Upload File Excel/CSV Master", type=["xlsx","csv"])
         if fu and st.button("Tambah dari Excel (Master)"):
+            brand=st.session_state.current_brand
+            existing=set(DATA["inventory"].keys()); parts=[]
+            # Seluruh file divalidasi dulu; baru disimpan bila terbaca utuh (file rusak → tidak ada yang masuk)
+            def _stage(df):
+                valid, errs = validate_master_sheet(df, existing, row_offset=0)
+                existing.update(valid["code"]); parts.append(valid)  # kode dobel antar chunk
+                return len(valid), errs
             try:
-                df_new=pd.read_excel(fu, engine="openpyxl")
-                req=["Kode Barang","Nama Barang","Qty","Satuan","Kategori"]
-                miss=[c for c in req if c not in df_new.columns]
-                if miss: st.error(f"Kolom kurang: {', '.join(miss)}"); return
-                added, errors = 0, []
-                existing=set(DATA["inventory"].keys())
-                for i,r in df_new.iterrows():
-                    code=str(r["Kode Barang"]).strip() if pd.notna(r["Kode Barang"]) else ""
-                    name=str(r["Nama Barang"]).strip() if pd.notna(r["Nama Barang"]) else ""
-                    if not code or not name: errors.append(f"Baris {i+2}: Kode/Nama wajib."); continue
-                    if code in existing: errors.append(f"Baris {i+2}: Kode '{code}' sudah ada."); continue
-                    qty=int(pd.to_numeric(r["Qty"], errors="coerce") or 0)
-                    unit=str(r["Satuan"]).strip() if pd.notna(r["Satuan"]) else "-"
-                    cat=str(r["Kategori"]).strip() if pd.notna(r["Kategori"]) else "Uncategorized"
-                    inv_insert_raw(st.session_state.current_brand, {"code":code,"item":name,"qty":qty,"unit":unit,"category":cat})
-                    history_add(st.session_state.current_brand, {"action":"ADD_ITEM","item":name,"qty":qty,"stock":qty,"unit":unit,
-                                                                 "user":st.session_state.username,"event":"-","timestamp":ts_text(),
-                                                                 "date":datetime.now().strftime("%Y-%m-%d"),
-                                                                 "code":code,"trans_type":None,"do_number":"-","attachment":None})
-                    added+=1
-                if added: st.success(f"{added} item master ditambahkan.")
-                if errors: st.warning("Beberapa baris dilewati:\n- " + "\n- ".join(errors))
-                st.experimental_rerun()
+                n_valid, errors = ingest_upload(fu, MASTER_COLS, _stage)
             except Exception as e:
-                st.error(f"Gagal membaca Excel: {e}")
-
-def page_admin_approve():
-    st.markdown(f"## Approve / Reject Request - {st.session_state.current_brand.capitalize()}"); st.divider()
-    pend=DATA["pending_requests"]
-    if not pend: st.info("Tidak ada pending request."); return
-    df=pd.DataFrame(pend)
-    df["Lampiran"]=df["attachment"].apply(lambda x: "Ada" if x else "Tidak Ada")
-
-    if "approve_select_flags" not in st.session_state or len(st.session_state.approve_select_flags)!=len(df):
-        st.session_state.approve_select_flags=[False]*len(df)
-
-    csel1,csel2=st.columns([1,1])
-    if csel1.button("Pilih semua"): st.session_state.approve_select_flags=[True]*len(df)
-    if csel2.button("Kosongkan pilihan"): st.session_state.approve_select_flags=[False]*len(df)
+                st.error(f"Gagal membaca file, tidak ada item yang disimpan: {e}"); return
+            valid=pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+            added, err = import_master_rows(brand, valid, st.session_state.username)
+            msg=f"{added} item master ditambahkan."
+            if err: msg+=f"\n\n{n_valid-added} item valid gagal disimpan ke database: {err}"
+            if errors: msg+="\n\nBeberapa baris dilewati:" + errors_text(errors)
+            st.session_state.notification={"type":"error" if err else "warning" if errors else "success","message":msg}
+            st.experimental_rerun()
 
-    df["Pilih"]=st.session_state.approve_select_flags
-    cfg={"Pilih": st.column_config.CheckboxColumn("Pilih", default=False)}
-    for c in df.columns:
-        if c!="Pilih": cfg[c]=st.column_config.TextColumn(c, disabled=True)
-    edited=st.data_editor(df, key="editor_admin_approve", use_container_width=True, hide_index=True, column_config=cfg)
-    st.session_state.approve_select_flags=edited["Pilih"].fillna(False).tolist()
-    selected_idx=[i for i,v in enumerate(st.session_state.approve_select_flags) if v]
-
-    col1,col2=st.columns(2)
-    if col1.button("Approve Selected"):
-        if not selected_idx:
-            st.session_state.notification={"type":"warning","message":"Pilih setidaknya satu item."}; st.rerun()
-        brand=st.session_state.current_brand
-        t=TABLES[brand]
-        inv_map = load_brand_data(brand)["inventory"]  # fresh
-        approved_ids=[]
-        for i in selected_idx:
-            req=pend[i]
-            qty=int(pd.to_numeric(req["qty"], errors="coerce") or 0)
-            ttype=str(req["type"]).upper()
-
-            # cari by name
-            found_code=None
-            for code,it in inv_map.items():
-                if it.get("name")==req["item"]:
-                    found_code=code; break
-
-            # IN: buat item baru kalau tidak ada. Jika user isi code & unik → pakai code tsb.
-            if ttype=="IN" and found_code is None:
-                req_code = (req.get("code") or "").strip()
-                req_name = req.get("item")
-                if req_code and req_code not in inv_map and req_code!="-":
-                    inv_insert_raw(brand, {"code":req_code, "item":req_name, "qty":0,
-                                           "unit":req.get("unit","-"), "category":"Uncategorized"})
-                    inv_map[req_code]={"name":req_name,"qty":0,"unit":req.get("unit","-"),"category":"Uncategorized"}
-                    found_code=req_code
-                else:
-                    # fallback auto
-                    code_candidate = f"NEW-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                    inv_insert_raw(brand, {"code":code_candidate, "item":req_name, "qty":0,
-                                           "unit":req.get("unit","-"), "category":"Uncategorized"})
-                    inv_map[code_candidate]={"name":req_name,"qty":0,"unit":req.get("unit","-"),"category":"Uncategorized"}
-                    found_code=code_candidate
-
-            if found_code is None:
-                st.warning(f"Item '{req['item']}' tidak ditemukan; lewati.")
-                continue
-
-            cur=int(inv_map[found_code]["qty"])
-            if ttype=="IN":      new_qty=cur+qty
-            elif ttype=="OUT":   new_qty=cur-qty
-            elif ttype=="RETURN":new_qty=cur+qty
+# Proses pending per id (dibaca ulang dari DB), set notifikasi, reset pilihan
+def _process_pending(brand, ids, approve: bool):
+    reqs=pending_rows(brand, ids)
+    if not reqs:
+        st.session_state.notification={"type":"warning","message":"Request sudah tidak ada (mungkin sudah diproses)."}
+    elif approve:
+        try:
+            approved_ids, warns = approve_requests(brand, reqs, load_brand_data(brand), st.session_state.username)
+            if approved_ids:
+                msg=f"{len(approved_ids)} request di-approve."
+                if warns: msg+=" Dilewati: " + "; ".join(warns)
+                st.session_state.notification={"type":"success" if not warns else "warning","message":msg}
             else:
-                st.warning(f"Tipe tidak dikenali: {ttype}"); continue
-
-            inv_update_qty(brand, found_code, new_qty)
-            inv_map[found_code]["qty"]=new_qty
-
-            history_add(brand, {"action":f"APPROVE_{ttype}","item":req["item"],"qty":qty,"stock":new_qty,
-                                "unit":req.get("unit","-"),"user":req.get("user", st.session_state.username),
-                                "event":req.get("event","-"),"do_number":req.get("do_number","-"),
-                                "attachment":req.get("attachment"),"timestamp":ts_text(),"date":req.get("date"),
-                                "code":found_code,"trans_type":req.get("trans_type")})
-            approved_ids.append(req.get("id"))
+                msg="Tidak ada request valid yang diproses." + (" " + "; ".join(warns) if warns else "")
+                st.session_state.notification={"type":"warning","message":msg}
+        except Exception as e:
+            st.session_state.notification={"type":"error","message":f"Approve gagal, request dikembalikan ke pending: {e}"}
+    else:
+        rejected_ids, spooled = reject_requests(brand, reqs, st.session_state.username)
+        msg=f"{len(rejected_ids)} request di-reject."
+        if spooled: msg+=f" {spooled} baris riwayat gagal dikirim dan disimpan untuk dikirim ulang."
+        st.session_state.notification={"type":"warning" if spooled else "success","message":msg}
+    st.session_state.approve_sel=set()
+    st.session_state.appr_nonce=st.session_state.get("appr_nonce",0)+1
+    st.rerun()
 
-        if approved_ids:
-            pending_delete_by_ids(brand, approved_ids)
-            st.session_state.notification={"type":"success","message":f"{len(approved_ids)} request di-approve."}
-        else:
-            st.session_state.notification={"type":"warning","message":"Tidak ada request valid yang diproses."}
-        st.rerun()
+def page_admin_approve():
+    brand=st.session_state.current_brand
+    st.markdown(f"## Approve / Reject Request - {brand.capitalize()}"); st.divider()
+    c1,c2,c3=st.columns(3)
+    tipe=c1.selectbox("Tipe", ["Semua Tipe","IN","OUT","RETURN"], key="appr_type")
+    u=c2.selectbox("Pengaju", ["Semua Pengguna"]+sorted(DATA["users"].keys()), key="appr_user")
+    do_q=c3.text_input("Cari No. DO", key="appr_do").strip()
+    c4,c5,c6=st.columns([1,1,1])
+    start=end=None
+    if c4.checkbox("Filter tanggal", key="appr_use_date"):
+        start=c5.date_input("Dari", value=(pd.Timestamp.today()-pd.Timedelta(days=30)).date(), key="appr_start")
+        end=c6.date_input("Sampai", value=pd.Timestamp.today().date(), key="appr_end")
+    f={"type": None if tipe=="Semua Tipe" else tipe, "user": None if u=="Semua Pengguna" else u,
+       "do_q": do_q, "start": start, "end": end}
+    mode=st.radio("Tampilan", ["Per Baris","Per DO","Per Pengaju"], horizontal=True, key="appr_mode")
+
+    # Filter berubah → kembali ke halaman 1, pilihan dikosongkan
+    sig=(brand, tuple(sorted((k, str(v)) for k, v in f.items())))
+    if st.session_state.get("appr_sig")!=sig:
+        st.session_state.appr_sig=sig; st.session_state.appr_page=1; st.session_state.approve_sel=set()
+    sel=st.session_state.setdefault("approve_sel", set())
+    nonce=st.session_state.setdefault("appr_nonce", 0)
+
+    if mode=="Per Baris":
+        page=st.session_state.get("appr_page", 1)
+        rows, total = pending_page(brand, f, page)
+        pages=max(1, -(-total // PAGE_ROWS))
+        if page>pages:
+            st.session_state.appr_page=page=pages; rows, total = pending_page(brand, f, page)
+        if not total: st.info("Tidak ada pending request."); return
+        p1,p2=st.columns([1,3])
+        p1.number_input("Halaman", min_value=1, max_value=pages, step=1, key="appr_page")
+        p2.caption(f"Halaman {page} / {pages} · {total:,} request · {len(sel):,} dipilih")
 
-    if col2.button("Reject Selected"):
-        if not selected_idx:
-            st.session_state.notification={"type":"warning","message":"Pilih setidaknya satu item."}; st.rerun()
-        brand=st.session_state.current_brand
-        rejected_ids=[]
-        for i in selected_idx:
-            req=pend[i]
-            history_add(brand, {"action":f"REJECT_{str(req.get('type','-')).upper()}","item":req.get("item","-"),
-                                "qty":int(pd.to_numeric(req.get("qty",0), errors="coerce") or 0),
-                                "stock":None,"unit":req.get("unit","-"),"user":req.get("user", st.session_state.username),
-                                "event":req.get("event","-"),"do_number":req.get("do_number","-"),
-                                "attachment":req.get("attachment"),"timestamp":ts_text(),
-                                "date":req.get("date"),"code":req.get("code"),"trans_type":req.get("trans_type")})
-            rejected_ids.append(req.get("id"))
-        if rejected_ids:
-            pending_delete_by_ids(brand, rejected_ids)
-            st.session_state.notification={"type":"success","message":f"{len(rejected_ids)} request di-reject."}
-        st.rerun()
+        df=pd.DataFrame(rows)
+        df["Lampiran"]=df["attachment"].apply(lambda x: "Ada" if x else "Tidak Ada")
+        df.insert(0, "Pilih", df["id"].isin(sel))
+        b1,b2=st.columns([1,1])
+        if b1.button("Pilih semua di halaman"):
+            sel.update(df["id"].tolist()); st.session_state.appr_nonce=nonce+1; st.rerun()
+        if b2.button("Kosongkan pilihan"):
+            sel.clear(); st.session_state.appr_nonce=nonce+1; st.rerun()
+        edited=st.data_editor(df, key=f"editor_admin_approve_{nonce}_{page}", use_container_width=True, hide_index=True,
+                              column_config={"Pilih": st.column_config.CheckboxColumn("Pilih", default=False)},
+                              disabled=[c for c in df.columns if c!="Pilih"])
+        for rid, v in zip(edited["id"], edited["Pilih"].fillna(False)):
+            (sel.add if v else sel.discard)(rid)
+
+        col1,col2=st.columns(2)
+        if col1.button(f"Approve Selected ({len(sel)})"):
+            if not sel:
+                st.session_state.notification={"type":"warning","message":"Pilih setidaknya satu item."}; st.rerun()
+            _process_pending(brand, sel, approve=True)
+        if col2.button(f"Reject Selected ({len(sel)})"):
+            if not sel:
+                st.session_state.notification={"type":"warning","message":"Pilih setidaknya satu item."}; st.rerun()
+            _process_pending(brand, sel, approve=False)
+        return
+
+    by, label = ("do_number", "No. DO") if mode=="Per DO" else ("user", "Pengaju")
+    groups=pending_groups(brand, f, by)
+    if groups.empty: st.info("Tidak ada pending request."); return
+    part=_paged_dataframe(groups.rename(columns={by: label}), f"appr_groups_{by}",
+                          cols=[label,"Baris","Total Qty","Tipe","Tanggal Awal"])
+    c1,c2,c3=st.columns([2,1,1])
+    gi=c1.selectbox(f"Grup ({label})", part.index,
+                    format_func=lambda i: f"{part.at[i,label]} · {part.at[i,'Baris']} baris · qty {part.at[i,'Total Qty']:,}")
+    ids=part.at[gi,"ids"]
+    if c2.button("Approve seluruh grup"): _process_pending(brand, ids, approve=True)
+    if c3.button("Reject seluruh grup"): _process_pending(brand, ids, approve=False)
+    with st.expander(f"Isi grup ({len(ids)} baris)"):
+        st.dataframe(pd.DataFrame(pending_rows(brand, ids[:PAGE_ROWS])), use_container_width=True, hide_index=True)
+        if len(ids)>PAGE_ROWS: st.caption(f"Menampilkan {PAGE_ROWS} dari {len(ids)} baris.")
 
 def page_admin_riwayat():
-    st.markdown(f"## Riwayat Lengkap - {st.session_state.current_brand.capitalize()}"); st.divider()
-    hist=DATA["history"]
-    if not hist: st.info("Belum ada riwayat."); return
-    keys=["action","item","qty","stock","unit","user","event","do_number","attachment","timestamp","date","code","trans_type"]
-    rows=[]
-    for h in hist:
-        e={k:h.get(k) for k in keys}
-        for k, d in [("do_number","-"),("event","-"),("unit","-")]:
-            if e.get(k) is None: e[k]=d
-        rows.append(e)
-    df=pd.DataFrame(rows)
-    df["date_only"]=pd.to_datetime(df["date"].fillna(df["timestamp"]), errors="coerce").dt.date
-
-    def dl(path):
-        if path and os.path.exists(str(path)):
-            with open(path,"rb") as f: b=base64.b64encode(f.read()).decode()
-            name=os.path.basename(path)
-            return f'<a href="data:application/pdf;base64,{b}" download="{name}">Unduh</a>'
-        return "Tidak Ada"
-    df["Lampiran"]=df["attachment"].apply(dl)
+    brand=st.session_state.current_brand
+    st.markdown(f"## Riwayat Lengkap - {brand.capitalize()}"); st.divider()
+    bounds=history_date_bounds(brand)
+    if not bounds: st.info("Belum ada riwayat."); return
 
     c1,c2=st.columns(2)
-    start=c1.date_input("Tanggal Mulai", value=df["date_only"].min())
-    end  =c2.date_input("Tanggal Akhir", value=df["date_only"].max())
+    start=c1.date_input("Tanggal Mulai", value=bounds[0])
+    end  =c2.date_input("Tanggal Akhir", value=bounds[1])
     c3,c4,c5=st.columns(3)
-    users=["Semua Pengguna"]+sorted(df["user"].dropna().unique().tolist())
-    acts=["Semua Tipe"]+sorted(df["action"].dropna().unique().tolist())
+    users=["Semua Pengguna"]+sorted(DATA["users"].keys())
+    acts=["Semua Tipe"]+HIST_ACTIONS
     u=c3.selectbox("Filter Pengguna", users)
     a=c4.selectbox("Filter Tipe Aksi", acts)
-    q=c5.text_input("Cari Nama Barang")
+    q=c5.text_input("Cari Nama Barang", key="riw_item_q").strip()
 
-    view=df[(df["date_only"]>=start)&(df["date_only"]<=end)].copy()
-    if u!="Semua Pengguna": view=view[view["user"]==u]
-    if a!="Semua Tipe": view=view[view["action"]==a]
-    if q: view=view[view["item"].str.contains(q, case=False, na=False)]
+    page=_history_pager(brand, "riwayat_admin_pg", start=start, end=end,
+                        user=(None if u=="Semua Pengguna" else u), action=(None if a=="Semua Tipe" else a), item_q=q)
+    if page.empty: st.info("Tidak ada riwayat untuk filter ini."); return
+    for k in ["do_number","event","unit"]: page[k]=page[k].fillna("-")
+    page["Lampiran"]=page["attachment"].map(lambda p: ATTACHMENTS.filename(p) if p else "-")
     cols=["action","date","code","item","qty","unit","stock","trans_type","user","event","do_number","timestamp","Lampiran"]
-    cols=[c for c in cols if c in view.columns]
-    st.markdown(view[cols].to_html(escape=False, index=False), unsafe_allow_html=True)
+    st.dataframe(page[cols], use_container_width=True, hide_index=True)
+
+    with_att=page[page["attachment"].notna() & page["attachment"].astype(str).ne("")]
+    if not with_att.empty:
+        c6,c7=st.columns([3,1])
+        pick=c6.selectbox("Lampiran di halaman ini", with_att.index,
+                          format_func=lambda i: f"{with_att.at[i,'date']} · {with_att.at[i,'item']} · DO {with_att.at[i,'do_number']}")
+        with c7: _attachment_button(with_att.at[pick,"attachment"], key=f"att_dl_{with_att.at[pick,'id']}")
 
 def page_admin_export():
     st.markdown(f"## Export Laporan - {st.session_state.current_brand.capitalize()}"); st.divider()
@@ -769,21 +690,32 @@ def page_admin_export():
     st.markdown("### Preview")
     st.dataframe(view, use_container_width=True, hide_index=True)
     if not view.empty:
-        data=dataframe_to_excel_bytes(view, "Stok Barang Filtered")
-        st.download_button("Unduh Laporan Excel", data=data,
-                           file_name=f"Laporan_Inventori_{st.session_state.current_brand.capitalize()}_Filter.xlsx",
-                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        export_download("Laporan Stok", {"Stok Barang Filtered": view},
+                        f"Laporan_Inventori_{st.session_state.current_brand.capitalize()}_Filter", key="exp_stock")
     else:
         st.warning("Tidak ada data sesuai filter.")
 
+    if st.session_state.role=="admin":
+        st.markdown("### Reorder Insight Semua Brand")
+        export_download("Reorder Semua Brand", lambda: {"Reorder Insight": reorder_all_brands()},
+                        "Reorder_Semua_Brand", key="exp_reorder_all", lazy=True)
+
+        # Riwayat penuh dibaca per page langsung ke file (tidak lewat snapshot di memori)
+        brand=st.session_state.current_brand
+        st.markdown("### Export Riwayat Lengkap (Audit)")
+        filters=[]
+        c1,c2,c3=st.columns([1,1,1])
+        if c1.checkbox("Filter tanggal", key="exp_hist_use_date"):
+            filters=history_date_filters(c2.date_input("Dari", value=(pd.Timestamp.today()-pd.DateOffset(years=1)).date(), key="exp_hist_start"),
+                                         c3.date_input("Sampai", value=pd.Timestamp.today().date(), key="exp_hist_end"))
+        export_download("Riwayat Lengkap",
+                        lambda: {"Riwayat": iter_pages(TABLES[brand]["hist"], HIST_COLS, filters, order="id")},
+                        f"Riwayat_{brand.capitalize()}_{datetime.now().strftime('%Y%m%d')}", key="exp_hist", lazy=True)
+
 # -------------------- USER PAGES (dari script lama) --------------------
-def _existing_events_for_out(brand: str) -> list:
-    data = load_brand_data(brand)
-    events=set()
-    for h in data.get("history", []):
-        if str(h.get("action","")).upper()=="APPROVE_OUT":
-            ev=str(h.get("event","-")).strip()
-            if ev and ev!="-": events.add(ev)
+# Event OUT approved (katalog) + event pada request OUT yang masih pending
+def _existing_events_for_out(data: dict) -> list:
+    events=set(event_catalog(data)["by_event"])
     for p in data.get("pending_requests", []):
         if str(p.get("type","")).upper()=="OUT":
             ev=str(p.get("event","-")).strip()
@@ -827,8 +759,9 @@ def page_user_request_in():
                 qty=c2.number_input("Jumlah", min_value=1, step=1)
                 if st.button("Tambah ke Daftar IN (Existing)"):
                     brand=st.session_state.current_brand
-                    inv_by_name={it["name"]:(code,it.get("unit","-")) for code,it in load_brand_data(brand)["inventory"].items()}
-                    name=items[idx]["name"]; code,unit=inv_by_name.get(name, ("-", items[idx].get("unit","-")))
+                    fresh=load_brand_data(brand)
+                    name=items[idx]["name"]; code=inv_code_for(fresh["inv_index"], name, "-")
+                    unit=fresh["inventory"][code].get("unit","-") if code in fresh["inventory"] else items[idx].get("unit","-")
                     base={"date": datetime.now().strftime("%Y-%m-%d"), "code":code, "item":name, "qty":int(qty),
                           "unit":unit, "event":"-", "trans_type":None, "do_number":"-", "attachment":None,
                           "user": st.session_state.username, "timestamp": ts_text()}
@@ -858,49 +791,19 @@ def page_user_request_in():
                            data=make_in_template_bytes(inv_records),
                            file_name=f"Template_IN_{st.session_state.current_brand.capitalize()}.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        fu=st.file_uploader("Upload File Excel IN", type=["xlsx"], key="in_excel_uploader")
+        fu=st.file_uploader("Upload File Excel/CSV IN", type=["xlsx","csv"], key="in_excel_uploader")
         if fu and st.button("Tambah dari Excel → Daftar IN"):
+            fresh=load_brand_data(st.session_state.current_brand); staged=[]
+            def _stage(df):
+                recs, errs = stage_upload(df, "IN", fresh, st.session_state.username, row_offset=0)
+                staged.extend(recs); return len(recs), errs
             try:
-                df_new=pd.read_excel(fu, engine="openpyxl")
+                added, errors = ingest_upload(fu, UPLOAD_SPECS["IN"]["required"], _stage)
             except Exception as e:
-                st.error(f"Gagal membaca Excel: {e}"); return
-            req_cols=["Tanggal","Kode Barang","Nama Barang","Qty"]
-            miss=[c for c in req_cols if c not in df_new.columns]
-            if miss: st.error(f"Kolom berikut wajib: {', '.join(req_cols)}"); return
-            brand=st.session_state.current_brand
-            inv = load_brand_data(brand)["inventory"]
-            by_code={code:(it.get("name"), it.get("unit","-")) for code,it in inv.items()}
-            by_name={it.get("name"):(code, it.get("unit","-")) for code,it in inv.items()}
-            added, errors = 0, []
-            for ridx,row in df_new.iterrows():
-                try:
-                    dt=pd.to_datetime(row["Tanggal"], errors="coerce")
-                    date_str=dt.strftime("%Y-%m-%d") if pd.notna(dt) else datetime.now().strftime("%Y-%m-%d")
-                    code_x=str(row["Kode Barang"]).strip() if pd.notna(row["Kode Barang"]) else ""
-                    name_x=str(row["Nama Barang"]).strip() if pd.notna(row["Nama Barang"]) else ""
-                    qty_x=int(pd.to_numeric(row["Qty"], errors="coerce") or 0)
-                    unit_x=str(row["Unit (opsional)"]).strip() if "Unit (opsional)" in df_new.columns and pd.notna(row.get("Unit (opsional)")) else None
-                    event_x=str(row["Event (opsional)"]).strip() if "Event (opsional)" in df_new.columns and pd.notna(row.get("Event (opsional)")) else "-"
-                    if not name_x: errors.append(f"Baris {ridx+2}: Nama wajib."); continue
-                    if qty_x<=0: errors.append(f"Baris {ridx+2}: Qty harus > 0."); continue
-                    inv_name, inv_unit = (None, None); inv_code=None
-                    if code_x and code_x in by_code:
-                        inv_name, inv_unit = by_code[code_x]; inv_code=code_x
-                        if not unit_x: unit_x = inv_unit
-                    elif name_x and name_x in by_name:
-                        inv_code, inv_unit = by_name[name_x]; inv_name = name_x
-                        if not unit_x: unit_x = inv_unit
-                    base={"date": date_str, "code": (inv_code if inv_code else (code_x if code_x else "-")),
-                          "item": (inv_name if inv_name else name_x), "qty": qty_x, "unit": (unit_x if unit_x else "-"),
-                          "event": (event_x if event_x else "-"), "trans_type": None,
-                          "do_number": "-", "attachment": None,
-                          "user": st.session_state.username, "timestamp": ts_text()}
-                    st.session_state.req_in_items.append(normalize_out_record(base))
-                    added+=1
-                except Exception as e:
-                    errors.append(f"Baris {ridx+2}: {e}")
+                st.error(f"Gagal membaca file, tidak ada baris yang ditambahkan: {e}"); return
+            st.session_state.req_in_items.extend(staged)  # file gagal di tengah → daftar tidak berubah
             if added: st.success(f"{added} baris ditambahkan ke daftar IN.")
-            if errors: st.warning("Beberapa baris dilewati:\n- " + "\n- ".join(errors))
+            if errors: st.warning("Beberapa baris dilewati:" + errors_text(errors))
 
     if st.session_state.req_in_items:
         st.divider()
@@ -934,9 +837,7 @@ def page_user_request_in():
                 st.error("Nomor DO wajib."); return
             if not pdf:
                 st.error("PDF DO wajib."); return
-            ts = datetime.now().strftime("%Y%m%d%H%M%S")
-            path=os.path.join(UPLOADS_DIR, f"{st.session_state.username}_{ts}.pdf")
-            with open(path,"wb") as f: f.write(pdf.getbuffer())
+            path=ATTACHMENTS.put(pdf, st.session_state.username, name=pdf.name)
 
             to_insert=[]
             for i,rec in enumerate(st.session_state.req_in_items):
@@ -973,7 +874,7 @@ def page_user_request_out():
             qty=c2.number_input("Jumlah", min_value=1, max_value=max_qty, step=1)
         tipe=st.selectbox("Tipe Transaksi", TRANS_TYPES, index=0)
 
-        existing_events = _existing_events_for_out(st.session_state.current_brand)
+        existing_events = _existing_events_for_out(DATA)
         use_new = st.checkbox("Tambah Event Baru?")
         if use_new:
             event_value = st.text_input("Nama Event Baru", placeholder="Masukkan nama event")
@@ -989,8 +890,7 @@ def page_user_request_out():
             if not str(event_value).strip(): st.error("Event wajib."); return
             selected_name=items[idx]["name"]
             brand=st.session_state.current_brand
-            inv_map=load_brand_data(brand)["inventory"]
-            found_code=next((c for c,it in inv_map.items() if it.get("name")==selected_name), None)
+            found_code=inv_code_for(load_brand_data(brand)["inv_index"], selected_name)
             base={"date": datetime.now().strftime("%Y-%m-%d"), "code": found_code if found_code else "-",
                   "item": selected_name, "qty": int(qty), "unit": items[idx].get("unit","-"),
                   "event": str(event_value).strip(), "trans_type": tipe, "user": st.session_state.username}
@@ -1004,50 +904,19 @@ def page_user_request_out():
                            data=make_out_template_bytes(inv_records),
                            file_name=f"Template_OUT_{st.session_state.current_brand.capitalize()}.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        fu=st.file_uploader("Upload File Excel OUT", type=["xlsx"], key="out_excel_uploader")
+        fu=st.file_uploader("Upload File Excel/CSV OUT", type=["xlsx","csv"], key="out_excel_uploader")
         if fu and st.button("Tambah dari Excel → Daftar OUT"):
+            fresh=load_brand_data(st.session_state.current_brand); staged=[]
+            def _stage(df):
+                recs, errs = stage_upload(df, "OUT", fresh, st.session_state.username, row_offset=0)
+                staged.extend(recs); return len(recs), errs
             try:
-                df_new=pd.read_excel(fu, engine="openpyxl")
+                added, errors = ingest_upload(fu, UPLOAD_SPECS["OUT"]["required"], _stage)
             except Exception as e:
-                st.error(f"Gagal membaca Excel: {e}"); return
-            req=["Tanggal","Kode Barang","Nama Barang","Qty","Event","Tipe"]
-            miss=[c for c in req if c not in df_new.columns]
-            if miss: st.error(f"Kolom kurang: {', '.join(miss)}"); return
-
-            brand=st.session_state.current_brand
-            inv=load_brand_data(brand)["inventory"]
-            by_code={code:(it.get("name"), it.get("unit","-"), it.get("qty",0)) for code,it in inv.items()}
-            by_name={it.get("name"):(code, it.get("unit","-"), it.get("qty",0)) for code,it in inv.items()}
-
-            added, errors = 0, []
-            for ridx,row in df_new.iterrows():
-                try:
-                    dt=pd.to_datetime(row["Tanggal"], errors="coerce")
-                    date_str=dt.strftime("%Y-%m-%d") if pd.notna(dt) else datetime.now().strftime("%Y-%m-%d")
-                    code_x=str(row["Kode Barang"]).strip() if pd.notna(row["Kode Barang"]) else ""
-                    name_x=str(row["Nama Barang"]).strip() if pd.notna(row["Nama Barang"]) else ""
-                    qty_x=int(pd.to_numeric(row["Qty"], errors="coerce") or 0)
-                    event_x=str(row["Event"]).strip() if pd.notna(row["Event"]) else ""
-                    tipe_x=str(row["Tipe"]).strip().lower() if pd.notna(row["Tipe"]) else ""
-                    if not event_x: errors.append(f"Baris {ridx+2}: Event wajib."); continue
-                    if tipe_x not in ["support","penjualan"]: errors.append(f"Baris {ridx+2}: Tipe harus Support/Penjualan."); continue
-                    tipe_norm="Support" if tipe_x=="support" else "Penjualan"
-                    inv_name, inv_unit, inv_stock=(None,None,None); inv_code=None
-                    if code_x and code_x in by_code:
-                        inv_name,inv_unit,inv_stock=by_code[code_x]; inv_code=code_x
-                    elif name_x and name_x in by_name:
-                        inv_code,inv_unit,inv_stock=by_name[name_x]; inv_name=name_x
-                    else:
-                        errors.append(f"Baris {ridx+2}: Item tidak ada di inventory (OUT hanya untuk existing)."); continue
-                    if qty_x<=0: errors.append(f"Baris {ridx+2}: Qty harus > 0."); continue
-                    if inv_stock is not None and qty_x>inv_stock: errors.append(f"Baris {ridx+2}: Qty ({qty_x}) > stok ({inv_stock})."); continue
-                    base={"date": date_str, "code": inv_code, "item": inv_name, "qty": qty_x, "unit": inv_unit or "-",
-                          "event": event_x, "trans_type": tipe_norm, "user": st.session_state.username}
-                    st.session_state.req_out_items.append(normalize_out_record(base)); added+=1
-                except Exception as e:
-                    errors.append(f"Baris {ridx+2}: {e}")
+                st.error(f"Gagal membaca file, tidak ada baris yang ditambahkan: {e}"); return
+            st.session_state.req_out_items.extend(staged)  # file gagal di tengah → daftar tidak berubah
             if added: st.success(f"{added} baris ditambahkan ke daftar OUT.")
-            if errors: st.warning("Beberapa baris dilewati:\n- " + "\n- ".join(errors))
+            if errors: st.warning("Beberapa baris dilewati:" + errors_text(errors))
 
     if st.session_state.req_out_items:
         st.divider()
@@ -1087,34 +956,29 @@ def page_user_request_out():
 # ---------- RETURN ----------
 def page_user_request_return():
     st.markdown(f"## Request Retur (Multi-item) - {st.session_state.current_brand.capitalize()}"); st.divider()
-    items=list(DATA["inventory"].values())
-    if not items: st.info("Belum ada master barang."); return
+    inv=DATA["inventory"]; codes=list(inv)
+    if not codes: st.info("Belum ada master barang."); return
 
-    hist=DATA.get("history", [])
-    approved_out_map={}
-    for h in hist:
-        if h.get("action")=="APPROVE_OUT":
-            it=h.get("item"); ev=h.get("event")
-            if it and ev and ev not in ["-",None,""]:
-                approved_out_map.setdefault(it, set()).add(ev)
+    out_ev=out_events_by_code(DATA, st.session_state.req_ret_items)
 
     tab1,tab2=st.tabs(["Tambah Manual","Tambah dari Excel"])
     with tab1:
         c1,c2=st.columns(2)
-        idx=c1.selectbox("Pilih Barang", range(len(items)),
-                         format_func=lambda x: f"{items[x]['name']} (Stok Gudang: {items[x]['qty']} {items[x].get('unit','-')})")
+        code=c1.selectbox("Pilih Barang", codes,
+                          format_func=lambda c: f"{inv[c]['name']} (Stok Gudang: {inv[c]['qty']} {inv[c].get('unit','-')})")
         qty=c2.number_input("Jumlah Retur", min_value=1, step=1)
-        name=items[idx]["name"]; unit=items[idx].get("unit","-")
-        events=sorted(list(approved_out_map.get(name,set())))
+        name=inv[code]["name"]; unit=inv[code].get("unit","-")
+        sisa=out_ev.get(code,{})
+        events=sorted(sisa)
         if not events:
-            st.warning("Belum ada event OUT disetujui untuk item ini."); ev_choice=None
+            st.warning("Belum ada event OUT disetujui dengan sisa retur untuk item ini."); ev_choice=None
         else:
-            ev_choice=st.selectbox("Pilih Event (dari OUT yang disetujui)", events)
+            ev_choice=st.selectbox("Pilih Event (dari OUT yang disetujui)", events,
+                                   format_func=lambda e: f"{e} (sisa retur: {sisa[e]} {unit})")
+            if qty>sisa[ev_choice]: st.warning(f"Qty retur melebihi sisa OUT event ini ({sisa[ev_choice]} {unit}).")
         if st.button("Tambah ke Daftar Retur"):
             if not ev_choice: st.error("Pilih event terlebih dahulu."); return
-            brand=st.session_state.current_brand
-            inv=load_brand_data(brand)["inventory"]
-            code=next((c for c,it in inv.items() if it.get("name")==name), "-")
+            if qty>sisa[ev_choice]: st.error(f"Qty retur melebihi sisa OUT event ini ({sisa[ev_choice]} {unit})."); return
             base={"date": datetime.now().strftime("%Y-%m-%d"), "code": code, "item": name, "qty": int(qty),
                   "unit": unit, "event": ev_choice, "user": st.session_state.username}
             st.session_state.req_ret_items.append(normalize_return_record(base))
@@ -1127,56 +991,20 @@ def page_user_request_return():
                            data=make_return_template_bytes(inv_records),
                            file_name=f"Template_Retur_{st.session_state.current_brand.capitalize()}.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        fu=st.file_uploader("Upload File Excel Retur", type=["xlsx"], key="ret_excel_uploader")
+        fu=st.file_uploader("Upload File Excel/CSV Retur", type=["xlsx","csv"], key="ret_excel_uploader")
         if fu and st.button("Tambah dari Excel → Daftar Retur"):
+            fresh=load_brand_data(st.session_state.current_brand); staged=[]
+            def _stage(df):  # sisa retur dihitung ulang per chunk (daftar staged + chunk sebelumnya ikut mengurangi)
+                left=out_events_by_code(fresh, st.session_state.req_ret_items + staged)
+                recs, errs = stage_upload(df, "RETURN", fresh, st.session_state.username, out_events=left, row_offset=0)
+                staged.extend(recs); return len(recs), errs
             try:
-                df_new=pd.read_excel(fu, engine="openpyxl")
+                added, errors = ingest_upload(fu, UPLOAD_SPECS["RETURN"]["required"], _stage)
             except Exception as e:
-                st.error(f"Gagal membaca Excel: {e}"); return
-            req=["Tanggal","Kode Barang","Nama Barang","Qty","Event"]
-            miss=[c for c in req if c not in df_new.columns]
-            if miss: st.error(f"Kolom kurang: {', '.join(miss)}"); return
-
-            brand=st.session_state.current_brand
-            inv=load_brand_data(brand)["inventory"]
-            by_code={code:(it.get("name"), it.get("unit","-")) for code,it in inv.items()}
-            by_name={it.get("name"):(code, it.get("unit","-")) for code,it in inv.items()}
-
-            approved_out_map={}
-            for h in load_brand_data(brand)["history"]:
-                if h.get("action")=="APPROVE_OUT":
-                    it=h.get("item"); ev=h.get("event")
-                    if it and ev and ev not in ["-",None,""]:
-                        approved_out_map.setdefault(it, set()).add(ev)
-
-            added, errors = 0, []
-            for ridx,row in df_new.iterrows():
-                try:
-                    dt=pd.to_datetime(row["Tanggal"], errors="coerce")
-                    date_str=dt.strftime("%Y-%m-%d") if pd.notna(dt) else datetime.now().strftime("%Y-%m-%d")
-                    code_x=str(row["Kode Barang"]).strip() if pd.notna(row["Kode Barang"]) else ""
-                    name_x=str(row["Nama Barang"]).strip() if pd.notna(row["Nama Barang"]) else ""
-                    qty_x=int(pd.to_numeric(row["Qty"], errors="coerce") or 0)
-                    event_x=str(row["Event"]).strip() if pd.notna(row["Event"]) else ""
-                    if qty_x<=0: errors.append(f"Baris {ridx+2}: Qty harus > 0."); continue
-                    if not event_x: errors.append(f"Baris {ridx+2}: Event wajib."); continue
-                    inv_name,inv_unit=(None,None); inv_code=None
-                    if code_x and code_x in by_code: inv_name,inv_unit=by_code[code_x]; inv_code=code_x
-                    elif name_x and name_x in by_name: inv_code,inv_unit=by_name[name_x]; inv_name=name_x
-                    else: errors.append(f"Baris {ridx+2}: Item tidak ditemukan."); continue
-                    valid=approved_out_map.get(inv_name,set())
-                    exists=any(e.strip().lower()==event_x.strip().lower() for e in valid)
-                    if not exists:
-                        if not valid: errors.append(f"Baris {ridx+2}: Belum ada OUT approved untuk '{inv_name}'."); continue
-                        else: errors.append(f"Baris {ridx+2}: Event '{event_x}' tidak cocok. Tersedia: {', '.join(sorted(valid))}."); continue
-                    base={"date": date_str, "code": inv_code if inv_code else "-", "item": inv_name,
-                          "qty": qty_x, "unit": inv_unit if inv_unit else "-", "event": event_x,
-                          "user": st.session_state.username}
-                    st.session_state.req_ret_items.append(normalize_return_record(base)); added+=1
-                except Exception as e:
-                    errors.append(f"Baris {ridx+2}: {e}")
+                st.error(f"Gagal membaca file, tidak ada baris yang ditambahkan: {e}"); return
+            st.session_state.req_ret_items.extend(staged)  # file gagal di tengah → daftar tidak berubah
             if added: st.success(f"{added} baris ditambahkan ke daftar Retur.")
-            if errors: st.warning("Beberapa baris gagal:\n- " + "\n- ".join(errors))
+            if errors: st.warning("Beberapa baris gagal:" + errors_text(errors))
 
     if st.session_state.req_ret_items:
         st.divider()
@@ -1214,36 +1042,32 @@ def page_user_request_return():
                 st.rerun()
 
 def page_user_riwayat():
-    st.markdown(f"## Riwayat Saya - {st.session_state.current_brand.capitalize()}"); st.divider()
-    hist=DATA.get("history", [])
-    rows=[]
-    for h in hist:
-        if h.get("user")!=st.session_state.username: continue
-        act=str(h.get("action","")).upper()
-        if act.startswith("APPROVE_"): status="APPROVED"; ttype=act.split("_",1)[-1]
-        elif act.startswith("REJECT_"): status="REJECTED"; ttype=act.split("_",1)[-1]
-        elif act.startswith("ADD_"): status="-"; ttype="ADD"
-        else: status="-"; ttype="-"
-        rows.append({"Status":status,"Type":ttype,"Date":h.get("date"),"Code":h.get("code","-"),
-                     "Item":h.get("item","-"),"Qty":h.get("qty","-"),"Unit":h.get("unit","-"),
-                     "Trans. Tipe":h.get("trans_type","-"),"Event":h.get("event","-"),
-                     "DO":h.get("do_number","-"),"Timestamp":h.get("timestamp","-")})
-    pend=DATA.get("pending_requests", [])
-    for p in pend:
-        if p.get("user")!=st.session_state.username: continue
-        rows.append({"Status":"PENDING","Type":p.get("type","-"),"Date":p.get("date"),"Code":p.get("code","-"),
-                    "Item":p.get("item","-"),"Qty":p.get("qty","-"),"Unit":p.get("unit","-"),
-                    "Trans. Tipe":p.get("trans_type","-"),"Event":p.get("event","-"),
-                    "DO":p.get("do_number","-"),"Timestamp":p.get("timestamp","-")})
-    if rows:
-        df=pd.DataFrame(rows)
-        try:
-            df["ts"]=pd.to_datetime(df["Timestamp"], errors="coerce")
-            df=df.sort_values("ts", ascending=False).drop(columns=["ts"])
-        except Exception: pass
-        st.dataframe(df, use_container_width=True, hide_index=True)
-    else:
-        st.info("Anda belum memiliki riwayat transaksi.")
+    brand=st.session_state.current_brand; me=st.session_state.username
+    st.markdown(f"## Riwayat Saya - {brand.capitalize()}"); st.divider()
+    cols=["Status","Type","Date","Code","Item","Qty","Unit","Trans. Tipe","Event","DO","Timestamp"]
+    ren={"date":"Date","code":"Code","item":"Item","qty":"Qty","unit":"Unit","trans_type":"Trans. Tipe",
+         "event":"Event","do_number":"DO","timestamp":"Timestamp"}
+
+    pend=[p for p in DATA.get("pending_requests", []) if p.get("user")==me]
+    if pend:
+        st.markdown("#### Menunggu Approval")
+        dp=pd.DataFrame(pend).rename(columns=ren).assign(Status="PENDING")
+        dp["Type"]=dp["type"].fillna("-")
+        dp=dp.reindex(columns=cols).fillna("-").sort_values("Timestamp", ascending=False)
+        st.dataframe(dp, use_container_width=True, hide_index=True)
+        st.markdown("#### Riwayat")
+
+    q=st.text_input("Cari Nama Barang", key="riw_user_item_q").strip()
+    page=_history_pager(brand, "riwayat_user_pg", user=me, item_q=q)
+    if page.empty:
+        if not pend: st.info("Anda belum memiliki riwayat transaksi.")
+        return
+    act=page["action"].astype(str).str.upper()
+    appr, rej=act.str.startswith("APPROVE_"), act.str.startswith("REJECT_")
+    page["Status"]=np.select([appr, rej], ["APPROVED","REJECTED"], "-")
+    page["Type"]=np.select([appr|rej, act.str.startswith("ADD_")], [act.str.split("_", n=1).str[-1], "ADD"], "-")
+    df=page.rename(columns=ren).reindex(columns=cols).fillna("-")
+    st.dataframe(df, use_container_width=True, hide_index=True)
 
 # -------------------- SIDEBAR (Accordion collapsed) --------------------
 with st.sidebar:
@@ -1270,6 +1094,11 @@ with st.sidebar:
                  type=("primary" if active else "secondary"),
                  use_container_width=True):
         st.session_state.menu = "Dashboard"; st.rerun()
+    if role == "admin":
+        act = (st.session_state.menu == "Dashboard Konsolidasi")
+        if st.button(("🏢 " if act else "") + "Dashboard Konsolidasi",
+                     type=("primary" if act else "secondary"), use_container_width=True):
+            st.session_state.menu = "Dashboard Konsolidasi"; st.rerun()
 
     # Inventory
     def nav(label, icon=""):
@@ -1305,6 +1134,7 @@ with st.sidebar:
 def route(menu, role):
     if role == "admin":
         if   menu=="Dashboard":                page_admin_dashboard()
+        elif menu=="Dashboard Konsolidasi":    page_admin_consolidated()
         elif menu=="Lihat Stok Barang":        page_admin_lihat_stok()
         elif menu=="Stock Card":               page_admin_stock_card()
         elif menu=="Tambah Master Barang":     page_admin_tambah_master()
@@ -1323,3 +1153,4 @@ def route(menu, role):
         else: page_user_dashboard()
 
 route(st.session_state.menu, role)
+journal_flush()
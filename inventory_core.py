@@ -0,0 +1,1731 @@
+# inventory_core.py — data & engine Supabase Inventory tanpa UI: baca/tulis tabel, approval, upload,
+# rollup, stock card, reorder, export. Dipakai app.py (UI Streamlit) dan script terjadwal (reorder_report.py).
+# Aman di-import di luar `streamlit run`: tidak ada perintah UI di level modul; st.cache_data /
+# st.cache_resource tetap jalan (in-memory) tanpa runtime Streamlit.
+# Secrets: SUPABASE_URL, SUPABASE_KEY dari environment, fallback ke st.secrets
+
+import os
+import re
+import csv
+import gzip
+import json
+import hashlib
+import uuid
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+import time
+from bisect import bisect_left
+from io import BytesIO, TextIOWrapper
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from openpyxl import load_workbook
+from supabase import create_client, Client
+
+# -------------------- CONFIG --------------------
+UPLOADS_DIR = "uploads"
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+SPOOL_DIR = "spool"  # batch history yang gagal dikirim, menunggu replay
+os.makedirs(SPOOL_DIR, exist_ok=True)
+
+BRANDS = ["gulavit","takokak"]
+TABLES = {
+    "gulavit": {"inv":"inventory_gulavit","pend":"pending_gulavit","hist":"history_gulavit","ckpt":"stock_checkpoints_gulavit"},
+    "takokak": {"inv":"inventory_takokak","pend":"pending_takokak","hist":"history_takokak","ckpt":"stock_checkpoints_takokak"},
+}
+USERS_TABLE = "users_gulavit"
+SNAPSHOT_TTL = 600  # detik; snapshot juga di-refetch begitu versi tabel berubah
+PAGE_SIZE = 1000    # samakan dengan max-rows PostgREST (default Supabase 1000)
+FETCH_WORKERS = 4
+WRITE_BATCH = 500   # baris per bulk insert/upsert
+CAS_RETRIES = 5     # percobaan compare-and-swap stok bila RPC delta belum tersedia
+CLAIM_TTL = 600     # detik; klaim pending lebih lama dari ini dianggap worker mati, boleh diklaim ulang
+WRITE_RETRIES = 3   # percobaan insert history per chunk (backoff 0.5s, 1s, ...)
+UPLOAD_CHUNK = 2000 # baris per chunk saat membaca upload Excel/CSV
+FETCH_TIMEOUTS = {"inv": 20, "pend": 20, "hist": 60, "version": 10}  # detik per tabel saat load snapshot
+PREFETCH_INTERVAL = 60  # detik antar cek versi semua brand di background
+PREFETCH_IDLE = 900     # polling berhenti bila tidak ada sesi aktif selama ini (detik)
+ATTACH_CHUNK = 1 << 20  # byte per tulis saat menyimpan lampiran
+ATTACH_GZIP = False     # kompres blob lampiran (PDF umumnya sudah terkompresi)
+
+TRANS_TYPES = ["Support", "Penjualan"]
+STD_REQ_COLS = ["date","code","item","qty","unit","event","trans_type","do_number","attachment","user","timestamp"]
+INV_COLS  = "code,item,qty,unit,category"
+PEND_COLS = ",".join(["id","type"]+STD_REQ_COLS)
+HIST_COLS = "id,action,item,qty,stock,unit,user,event,do_number,attachment,timestamp,date,code,trans_type"
+
+# Optional Parquet (pyarrow ikut terpasang bersama streamlit)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _PARQUET_OK = True
+except Exception:
+    _PARQUET_OK = False
+
+# Optional file lock antar proses (POSIX)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Konteks script Streamlit untuk worker thread (cache_data & st.* dari thread pool)
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except Exception:
+    add_script_run_ctx = get_script_run_ctx = None
+
+# Thread prefetch / script terjadwal tidak punya konteks → ctx None tanpa warning, pool biasa
+def _ctx_pool(workers: int) -> ThreadPoolExecutor:
+    ctx = get_script_run_ctx(suppress_warning=True) if get_script_run_ctx else None
+    init = (lambda: add_script_run_ctx(threading.current_thread(), ctx)) if ctx else None
+    return ThreadPoolExecutor(max_workers=max(1, workers), initializer=init)
+
+# -------------------- SUPABASE --------------------
+# Environment dulu (script terjadwal / cron), lalu st.secrets (.streamlit/secrets.toml)
+def _secret(name: str) -> str:
+    return os.environ.get(name) or st.secrets[name]
+
+SUPABASE_URL = _secret("SUPABASE_URL")
+SUPABASE_KEY = _secret("SUPABASE_KEY")
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# -------------------- UTILS --------------------
+def ts_text(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _to_date_str(val):
+    if val is None or str(val).strip()=="":
+        return datetime.now().strftime("%Y-%m-%d")
+    try:
+        return pd.to_datetime(val, errors="coerce").strftime("%Y-%m-%d")
+    except Exception:
+        return datetime.now().strftime("%Y-%m-%d")
+
+def _norm_event(s): return str(s).strip() if s is not None else "-"
+
+def _norm_trans_type(s):
+    s = "" if s is None else str(s).strip().lower()
+    if s == "support": return "Support"
+    if s == "penjualan": return "Penjualan"
+    return None
+
+def normalize_out_record(base: dict) -> dict:
+    rec = {k: None for k in STD_REQ_COLS}
+    rec.update({
+        "date": _to_date_str(base.get("date")),
+        "code": base.get("code","-") or "-",
+        "item": base.get("item","-") or "-",
+        "qty": int(pd.to_numeric(base.get("qty",0), errors="coerce") or 0),
+        "unit": base.get("unit","-") or "-",
+        "event": _norm_event(base.get("event","-")),
+        "trans_type": _norm_trans_type(base.get("trans_type")),
+        "do_number": base.get("do_number","-") or "-",
+        "attachment": base.get("attachment"),
+        "user": base.get("user", st.session_state.get("username","-")),
+        "timestamp": base.get("timestamp", ts_text()),
+    })
+    return rec
+
+def normalize_return_record(base: dict) -> dict:
+    rec = {k: None for k in STD_REQ_COLS}
+    rec.update({
+        "date": _to_date_str(base.get("date")),
+        "code": base.get("code","-") or "-",
+        "item": base.get("item","-") or "-",
+        "qty": int(pd.to_numeric(base.get("qty",0), errors="coerce") or 0),
+        "unit": base.get("unit","-") or "-",
+        "event": _norm_event(base.get("event","-")),
+        "trans_type": None,
+        "do_number": "-",
+        "attachment": None,
+        "user": base.get("user", st.session_state.get("username","-")),
+        "timestamp": base.get("timestamp", ts_text()),
+    })
+    return rec
+
+def dataframe_to_excel_bytes(df: pd.DataFrame, sheet="Sheet1") -> bytes:
+    bio = BytesIO()
+    with pd.ExcelWriter(bio, engine="xlsxwriter") as w:
+        df.to_excel(w, index=False, sheet_name=sheet)
+    bio.seek(0); return bio.read()
+
+
+def make_master_template_bytes() -> bytes:
+    cols = ["Kode Barang", "Nama Barang", "Qty", "Satuan", "Kategori"]
+    df_tmpl = pd.DataFrame([{"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":10,"Satuan":"PCS","Kategori":"Umum"}], columns=cols)
+    return dataframe_to_excel_bytes(df_tmpl, "Template Master")
+
+def make_out_template_bytes(inv_records: list) -> bytes:
+    today = pd.Timestamp.now().strftime("%Y-%m-%d")
+    cols = ["Tanggal","Kode Barang","Nama Barang","Qty","Event","Tipe"]
+    rows=[]
+    if inv_records:
+        for r in inv_records[:2]:
+            rows.append({"Tanggal":today,"Kode Barang":r["code"],"Nama Barang":r["name"],"Qty":1,"Event":"Contoh event","Tipe":"Support"})
+    else:
+        rows.append({"Tanggal":today,"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":1,"Event":"Contoh event","Tipe":"Support"})
+    return dataframe_to_excel_bytes(pd.DataFrame(rows, columns=cols), "Template OUT")
+
+def make_in_template_bytes(inv_records: list) -> bytes:
+    today = pd.Timestamp.now().strftime("%Y-%m-%d")
+    cols = ["Tanggal","Kode Barang","Nama Barang","Qty","Unit (opsional)","Event (opsional)"]
+    rows=[]
+    if inv_records:
+        for r in inv_records[:2]:
+            rows.append({"Tanggal":today,"Kode Barang":r["code"],"Nama Barang":r["name"],"Qty":5,"Unit (opsional)":"PCS","Event (opsional)":""})
+    else:
+        rows.append({"Tanggal":today,"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":10,"Unit (opsional)":"PCS","Event (opsional)":""})
+    return dataframe_to_excel_bytes(pd.DataFrame(rows, columns=cols), "Template IN")
+
+def make_return_template_bytes(inv_records: list) -> bytes:
+    today = pd.Timestamp.now().strftime("%Y-%m-%d")
+    cols = ["Tanggal","Kode Barang","Nama Barang","Qty","Event"]
+    rows=[]
+    if inv_records:
+        for r in inv_records[:2]:
+            rows.append({"Tanggal":today,"Kode Barang":r["code"],"Nama Barang":r["name"],"Qty":1,"Event":"Contoh event dari OUT"})
+    else:
+        rows.append({"Tanggal":today,"Kode Barang":"ITM-0001","Nama Barang":"Contoh Produk","Qty":1,"Event":"Contoh event"})
+    return dataframe_to_excel_bytes(pd.DataFrame(rows, columns=cols), "Template Retur")
+
+# -------------------- EXPORT --------------------
+# Laporan ditulis langsung ke file sementara, sheet demi sheet dan chunk demi chunk. Excel memakai mode
+# constant_memory xlsxwriter (baris di-flush berurutan), jadi memori ≈ satu chunk. Nilai tiap sheet:
+# DataFrame atau iterable DataFrame (mis. iter_pages). CSV/Parquet multi-sheet → .zip berisi file per sheet.
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "inventory_exports")
+EXPORT_TTL = 3600  # detik; file export lebih tua dari ini dihapus
+XLSX_MAX_ROWS = 1_048_576  # termasuk header; sisa baris lanjut ke sheet "<nama> (2)", dst.
+EXPORT_FORMATS = {"Excel": (".xlsx", XLSX_MIME), "CSV": (".csv", "text/csv"),
+                  "Parquet": (".parquet", "application/vnd.apache.parquet")}
+
+def export_formats() -> list:
+    return [f for f in EXPORT_FORMATS if f != "Parquet" or _PARQUET_OK]
+
+def _as_chunks(src):
+    if isinstance(src, pd.DataFrame): yield src
+    else: yield from src
+
+def _xlsx_rows(df: pd.DataFrame):
+    df = df.copy()
+    for c in df.columns[[pd.api.types.is_datetime64_any_dtype(t) for t in df.dtypes]]:
+        df[c] = df[c].dt.strftime("%Y-%m-%d")
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def _write_xlsx(path: str, sheets: dict):
+    import xlsxwriter
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True})
+    bold = wb.add_format({"bold": True})
+    for name, src in sheets.items():
+        ws, cols, r, part = None, None, 0, 1
+        for df in _as_chunks(src):
+            if cols is None: cols = list(df.columns)
+            if ws is None:
+                ws = wb.add_worksheet(name[:31]); ws.write_row(0, 0, cols, bold); r = 1
+            for row in _xlsx_rows(df.reindex(columns=cols)):
+                if r == XLSX_MAX_ROWS:
+                    part += 1; ws = wb.add_worksheet(f"{name[:25]} ({part})"); ws.write_row(0, 0, cols, bold); r = 1
+                ws.write_row(r, 0, row); r += 1
+        if ws is None: wb.add_worksheet(name[:31])
+    wb.close()
+
+def _write_csv(fh, src):
+    cols = None
+    for df in _as_chunks(src):
+        df.reindex(columns=cols or list(df.columns)).to_csv(fh, index=False, header=cols is None)
+        cols = cols or list(df.columns)
+
+# Kolom object yang tetap campuran tipe (mis. angka + "∞") → string; kosong tetap null
+def _parquet_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.convert_dtypes()
+    for c in df.columns[df.dtypes == object]:
+        df[c] = df[c].map(lambda v: None if v is None or (isinstance(v, float) and v != v) else str(v))
+    return df
+
+# Tipe kolom laporan yang pasti (riwayat dibaca per page lewat iter_pages); kolom lain ditebak dari data
+PARQUET_TYPES = {"id": "int64", "qty": "int64", "stock": "int64"}
+
+# Skema ditetapkan sebelum menulis: kolom di PARQUET_TYPES pakai tipe tsb, kolom lain ditebak dari chunk
+# yang di-buffer sampai tiap kolom punya nilai (tetap kosong di semua chunk → string). Bila masih ada chunk
+# sesudahnya, kolom integer hasil tebakan dilebarkan ke float64 supaya nilai seperti 2.5 tetap muat.
+def _write_parquet(target, src):
+    chunks = iter(_as_chunks(src)); buf = []; cols = None; rest = True
+    for df in chunks:
+        if cols is None: cols = list(df.columns); unknown = {c for c in cols if c not in PARQUET_TYPES}
+        buf.append(df.reindex(columns=cols))
+        unknown -= {c for c in unknown if buf[-1][c].notna().any()}
+        if not unknown: break
+    else:
+        rest = False
+    if cols is None: return
+    guess = pa.Table.from_pandas(_parquet_frame(pd.concat(buf, ignore_index=True)), preserve_index=False).schema
+    def field(f):
+        if f.name in PARQUET_TYPES: return f.with_type(pa.type_for_alias(PARQUET_TYPES[f.name]))
+        if pa.types.is_null(f.type): return f.with_type(pa.string())
+        if rest and pa.types.is_integer(f.type): return f.with_type(pa.float64())
+        return f
+    schema = pa.schema([field(f) for f in guess])
+    def table(df): return pa.Table.from_pandas(_parquet_frame(df.reindex(columns=cols)), preserve_index=False).cast(schema)
+    with pq.ParquetWriter(target, schema) as writer:
+        for df in buf: writer.write_table(table(df))
+        for df in chunks: writer.write_table(table(df))
+
+# File export yang tertinggal (sesi berakhir sebelum dibuat ulang) dihapus saat export berikutnya
+def _sweep_exports(max_age=EXPORT_TTL):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    now = time.time()
+    for f in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, f)
+        try:
+            if now - os.path.getmtime(path) > max_age: os.remove(path)
+        except OSError: pass
+
+# Tulis laporan → (path file sementara, ekstensi, mime). Pemanggil yang menghapus file.
+def write_report(sheets: dict, fmt="Excel") -> tuple:
+    ext, mime = EXPORT_FORMATS[fmt]
+    zipped = fmt != "Excel" and len(sheets) > 1
+    if zipped: ext, mime = ".zip", "application/zip"
+    _sweep_exports()
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=ext, dir=EXPORT_DIR); os.close(fd)
+    try:
+        if fmt == "Excel":
+            _write_xlsx(path, sheets)
+        elif zipped:
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for name, src in sheets.items():
+                    with zf.open(f"{name}{EXPORT_FORMATS[fmt][0]}", "w") as raw:
+                        if fmt == "CSV":
+                            with TextIOWrapper(raw, encoding="utf-8-sig", newline="") as fh: _write_csv(fh, src)
+                        else:
+                            _write_parquet(raw, src)
+        else:
+            src = next(iter(sheets.values()))
+            if fmt == "CSV":
+                with open(path, "w", encoding="utf-8-sig", newline="") as fh: _write_csv(fh, src)
+            else:
+                _write_parquet(path, src)
+    except Exception:
+        os.remove(path); raise
+    return path, ext, mime
+
+
+# -------------------- ATTACHMENTS --------------------
+# Lampiran disimpan per isi (sha256): blobs/<2 hex>/<hash>[.gz], disimpan sekali walau di-upload berulang.
+# Ref di DB = "cas://<hash>"; path lama (uploads/<user>_<ts>.pdf) tetap bisa dibuka.
+# index.json: hash → {size, stored, gz, name, user, created} (user = pengunggah pertama).
+class LocalAttachmentStore:
+    PREFIX = "cas://"
+
+    def __init__(self, root: str, compress=False):
+        self.root = root; self.compress = compress
+        self.index_path = os.path.join(root, "index.json")
+        self.lock_path = os.path.join(root, "index.lock")
+        self._lock = threading.Lock(); self._idx = {}; self._mtime = None
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+
+    # Read-modify-write index: lock thread + flock file (aman antar sesi maupun antar proses)
+    @contextmanager
+    def _index_locked(self):
+        with self._lock, open(self.lock_path, "a") as lf:
+            if fcntl: fcntl.flock(lf, fcntl.LOCK_EX)
+            try: yield
+            finally:
+                if fcntl: fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _blob_path(self, digest: str, gz: bool) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], digest + (".gz" if gz else ""))
+
+    # Index dibaca ulang hanya bila file berubah (mtime); fresh=True selalu baca dari disk
+    def _read_index(self, fresh=False) -> dict:
+        try:
+            mtime = os.path.getmtime(self.index_path)
+            if fresh or mtime != self._mtime:
+                with open(self.index_path, encoding="utf-8") as f: self._idx = json.load(f)
+                self._mtime = mtime
+        except (FileNotFoundError, ValueError): return {}
+        return dict(self._idx)
+
+    def _write_index(self, idx: dict):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(idx, f)
+        os.replace(tmp, self.index_path)
+
+    # Stream fileobj ke file sementara sambil di-hash; blob yang sudah ada cukup dipakai ulang
+    def put(self, fileobj, user: str, name=None) -> str:
+        fileobj.seek(0)
+        h = hashlib.sha256(); size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                out = gzip.GzipFile(fileobj=raw, mode="wb") if self.compress else raw
+                for chunk in iter(lambda: fileobj.read(ATTACH_CHUNK), b""):
+                    h.update(chunk); size += len(chunk); out.write(chunk)
+                if self.compress: out.close()
+            digest = h.hexdigest()
+            with self._index_locked():
+                idx = self._read_index(fresh=True); meta = idx.get(digest)
+                if meta and os.path.exists(self._blob_path(digest, meta["gz"])):
+                    os.remove(tmp)
+                else:
+                    dst = self._blob_path(digest, self.compress)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    os.replace(tmp, dst)
+                    idx[digest] = {"size": size, "stored": os.path.getsize(dst), "gz": self.compress,
+                                   "name": name, "user": user, "created": ts_text()}
+                    self._write_index(idx)
+            return self.PREFIX + digest
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+
+    def meta(self, ref):
+        ref = str(ref or "")
+        if not ref.startswith(self.PREFIX): return None
+        return self._read_index().get(ref[len(self.PREFIX):])
+
+    # File-like (mode biner) untuk ref cas:// maupun path lama; None bila tidak ada
+    def open(self, ref):
+        ref = str(ref or "")
+        if ref.startswith(self.PREFIX):
+            digest = ref[len(self.PREFIX):]; m = self._read_index().get(digest)
+            # tanpa metadata (index rusak/tertinggal) → coba kedua bentuk blob
+            for gz in ([m.get("gz", False)] if m else [False, True]):
+                path = self._blob_path(digest, gz)
+                if os.path.exists(path): return gzip.open(path, "rb") if gz else open(path, "rb")
+            return None
+        return open(ref, "rb") if ref and os.path.exists(ref) else None
+
+    def filename(self, ref) -> str:
+        ref = str(ref or "")
+        if ref.startswith(self.PREFIX):
+            m = self.meta(ref) or {}
+            return m.get("name") or f"{ref[len(self.PREFIX):][:12]}.pdf"
+        return os.path.basename(ref)
+
+# Satu instance per proses (lock & cache index dipakai bersama semua sesi)
+@st.cache_resource
+def attachment_store() -> LocalAttachmentStore:
+    return LocalAttachmentStore(UPLOADS_DIR, compress=ATTACH_GZIP)
+
+ATTACHMENTS = attachment_store()
+
+# -------------------- READS --------------------
+@st.cache_data(ttl=300)
+def load_users() -> dict:
+    try:
+        res = supabase.from_(USERS_TABLE).select("*").execute()
+        df = pd.DataFrame(res.data or [])
+        users = {}
+        if not df.empty:
+            for _, r in df.iterrows():
+                users[str(r["username"])] = {"password": str(r["password"]), "role": str(r["role"])}
+        if not users:
+            users = {
+                "admin":{"password":st.secrets.get("passwords",{}).get("admin","admin"),"role":"admin"},
+                "user":{"password":st.secrets.get("passwords",{}).get("user","user"),"role":"user"},
+            }
+        return users
+    except Exception:
+        return {
+            "admin":{"password":st.secrets.get("passwords",{}).get("admin","admin"),"role":"admin"},
+            "user":{"password":st.secrets.get("passwords",{}).get("user","user"),"role":"user"},
+        }
+
+def _select_query(table: str, columns="*", filters=None, order=None, count=None):
+    q = supabase.from_(table).select(columns, count=count)
+    for op, *args in (filters or []):  # mis. ("eq","user","budi"), ("gte","date","2024-01-01"), ("or_", expr)
+        q = getattr(q, op)(*args)
+    if order: q = q.order(order)
+    return q
+
+def _fetch_page(table, columns, filters, order, start, page_size) -> pd.DataFrame:
+    res = _select_query(table, columns, filters, order).range(start, start+page_size-1).execute()
+    return pd.DataFrame(res.data or [])
+
+# Baca tabel per range (PAGE_SIZE = batas baris PostgREST), tiap page langsung jadi DataFrame.
+# parallel=True: page pertama minta count, sisa page diambil bersamaan lalu di-yield berurutan.
+def iter_pages(table: str, columns="*", filters=None, order=None, page_size=PAGE_SIZE, parallel=False):
+    res = _select_query(table, columns, filters, order, count=("exact" if parallel else None)).range(0, page_size-1).execute()
+    first = pd.DataFrame(res.data or []); n = len(first)
+    yield first
+    if n < page_size: return
+    if parallel and res.count:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+            futs = [ex.submit(_fetch_page, table, columns, filters, order, s, page_size)
+                    for s in range(page_size, res.count, page_size)]
+            for f in futs: yield f.result()
+        return
+    start = page_size
+    while True:
+        page = _fetch_page(table, columns, filters, order, start, page_size)
+        yield page
+        if len(page) < page_size: return
+        start += page_size
+
+def _read_table(table: str, columns="*", filters=None, order=None, parallel=False) -> pd.DataFrame:
+    frames = [f for f in iter_pages(table, columns, filters, order, parallel=parallel) if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame([])
+
+# Jalankan beberapa baca bersamaan: jobs = {nama: (fn, args, timeout detik)} → ({nama: hasil}, {nama: error}).
+# Job yang gagal / lewat timeout tidak menggagalkan yang lain; warning diserahkan ke pemanggil (main thread).
+def _run_concurrent(jobs: dict) -> tuple:
+    ex = _ctx_pool(len(jobs)); t0 = time.monotonic()
+    futs = {k: ex.submit(fn, *args) for k, (fn, args, _) in jobs.items()}
+    out, errs = {}, {}
+    for k, f in futs.items():
+        limit = jobs[k][2]
+        try: out[k] = f.result(timeout=max(0.0, t0 + limit - time.monotonic()))
+        except FuturesTimeout: errs[k] = TimeoutError(f"timeout setelah {limit} detik")
+        except Exception as e: errs[k] = e
+    ex.shutdown(wait=False, cancel_futures=True)
+    return out, errs
+
+# Versi data murah per tabel: (jumlah baris, id terbesar). Update qty inventory selalu
+# disertai baris history baru, jadi versi history ikut menangkap perubahan stok.
+def _table_version(table: str, key: str = None) -> tuple:
+    try:
+        q = supabase.from_(table).select(key or "*", count="exact")
+        if key: q = q.order(key, desc=True)
+        res = q.limit(1).execute()
+        top = (res.data or [{}])[0].get(key) if key else None
+        return (res.count, top)
+    except Exception:
+        return (None, ts_text())  # versi tidak diketahui → paksa fetch ulang
+
+def _brand_version(brand: str) -> tuple:
+    t, lim = TABLES[brand], FETCH_TIMEOUTS["version"]
+    res, _ = _run_concurrent({"inv": (_table_version, (t["inv"],), lim), "pend": (_table_version, (t["pend"], "id"), lim),
+                              "hist": (_table_version, (t["hist"], "id"), lim)})
+    return tuple(res.get(k, (None, ts_text())) for k in ("inv", "pend", "hist"))
+
+# Index inventory per snapshot: nama → code (persis) dan kunci nama ternormalisasi (spasi rapat,
+# casefold) → code. Kalau ada nama ganda, code pertama yang menang (sama seperti scan linear lama).
+def _name_key(s) -> str: return " ".join(str(s or "").split()).casefold()
+
+def build_inv_index(inv: dict) -> dict:
+    by_name, by_key = {}, {}
+    for code, it in inv.items():
+        by_name.setdefault(it.get("name"), code)
+        by_key.setdefault(_name_key(it.get("name")), code)
+    return {"by_name": by_name, "by_key": by_key}
+
+def inv_code_for(index: dict, name, default=None):
+    code = index["by_name"].get(name)
+    if code is None: code = index["by_key"].get(_name_key(name))
+    return default if code is None else code
+
+# Snapshot disusun dari 3 part yang di-cache terpisah. SNAPSHOT_PARTS: part → tabel dependensinya
+# (qty inventory selalu berubah bersama history, jadi part inventory ikut versi history).
+# Kunci cache part = versi DB + counter lokal tabel-tabel tsb; write hanya menaikkan counter tabel yang disentuh.
+SNAPSHOT_PARTS = {"inv": ("inv", "hist"), "pend": ("pend",), "hist": ("hist",)}
+
+@st.cache_resource
+def _local_versions() -> dict:
+    return {"lock": threading.Lock(), "v": {}}
+
+def local_version(brand: str, kind: str) -> int:
+    return _local_versions()["v"].get((brand, kind), 0)
+
+def _read_part(brand: str, kind: str, version: tuple = None):
+    t = TABLES[brand]
+    if kind == "inv":
+        df_inv = _read_table(t["inv"], INV_COLS, None, "code")
+        inv = {}
+        if not df_inv.empty:
+            for _, r in df_inv.iterrows():
+                inv[str(r.get("code","-"))] = {
+                    "name": str(r.get("item","-")),
+                    "qty": int(pd.to_numeric(r.get("qty",0), errors="coerce") or 0),
+                    "unit": str(r.get("unit","-")) if pd.notna(r.get("unit")) else "-",
+                    "category": str(r.get("category","Uncategorized")) if pd.notna(r.get("category")) else "Uncategorized",
+                }
+        return inv
+    if kind == "pend":
+        return _pending_records(_read_table(t["pend"], PEND_COLS, None, "id"))
+    return _read_history(brand, version)
+
+# History append-only → disimpan per brand di memori proses dan hanya baris id > watermark yang diambil.
+# Jumlah baris dicocokkan dengan count dari versi DB: beda (commit masuk tidak urut id, baris dihapus/reset)
+# → baca ulang penuh. List yang dikembalikan tidak pernah dimutasi (snapshot lama tetap konsisten).
+# Lock per brand hanya menjaga entri store; fetch di luar lock lalu compare-and-swap: entri hanya diganti
+# bila masih entri yang jadi dasar fetch (atau watermark-nya lebih rendah), supaya brand lain / thread lain
+# tidak antre di belakang satu baca history.
+@st.cache_resource
+def _history_store() -> dict:
+    return {"locks": {b: threading.Lock() for b in BRANDS}, "brands": {}}
+
+def _read_history(brand: str, version: tuple = None) -> list:
+    store, table = _history_store(), TABLES[brand]["hist"]
+    hv = version[2] if version else None
+    known = hv is not None and hv[0] is not None
+    with store["locks"][brand]:
+        cur = store["brands"].get(brand)
+    if cur and known and cur["version"] == hv: return cur["rows"]
+    rows = None
+    if cur:
+        df = _read_table(table, HIST_COLS, [("gt", "id", cur["wm"])], "id")
+        rows = cur["rows"] + (df.to_dict(orient="records") if not df.empty else [])
+        if known and len(rows) != hv[0]: rows = None
+    if rows is None:
+        df = _read_table(table, HIST_COLS, None, "id", True)
+        rows = df.to_dict(orient="records") if not df.empty else []
+    wm = max((h.get("id") or 0 for h in rows), default=0)
+    with store["locks"][brand]:
+        now = store["brands"].get(brand)
+        if now is cur or now is None or now["wm"] < wm:
+            store["brands"][brand] = {"version": hv, "rows": rows, "wm": wm}
+    return rows
+
+def _pending_records(df_pend: pd.DataFrame) -> list:
+    pend = []
+    if not df_pend.empty:
+        for _, r in df_pend.iterrows():
+            base = {k: r.get(k) for k in STD_REQ_COLS}
+            base.update({"type": r.get("type"), "id": r.get("id")})
+            rec = normalize_return_record(base) if base["type"]=="RETURN" else normalize_out_record(base)
+            rec["type"]=base["type"]; rec["id"]=base["id"]
+            pend.append(rec)
+    return pend
+
+# deps hanya dipakai sebagai kunci cache. Error tidak di-cache → dicoba lagi di rerun berikutnya.
+# History tidak lewat cache ini (store inkremental sendiri, lihat _read_history).
+@st.cache_data(ttl=SNAPSHOT_TTL, max_entries=len(BRANDS)*len(SNAPSHOT_PARTS)*4, show_spinner=False)
+def _cached_part(brand: str, kind: str, deps: tuple):
+    return _read_part(brand, kind)
+
+def _part_deps(brand: str, kind: str, version: tuple) -> tuple:
+    pos = {"inv": 0, "pend": 1, "hist": 2}
+    return tuple((k, version[pos[k]], local_version(brand, k)) for k in SNAPSHOT_PARTS[kind])
+
+# Snapshot → (snapshot, {nama tabel: error}); part dibaca paralel. cached=False (thread background):
+# baca langsung tanpa cache Streamlit dan tanpa st.*.
+def _build_brand_snapshot(brand: str, version: tuple, cached=False) -> tuple:
+    jobs = {k: ((_cached_part, (brand, k, _part_deps(brand, k, version))) if cached and k != "hist"
+                else (_read_part, (brand, k, version))) + (FETCH_TIMEOUTS[k],) for k in SNAPSHOT_PARTS}
+    res, errs = _run_concurrent(jobs)
+    inv, pend, hist = res.get("inv", {}), res.get("pend", []), res.get("hist", [])
+    # Part yang gagal diganti kosong → versinya diganti sentinel unik supaya store berkunci versi
+    # (prepared_history, search_index, ...) tidak menyimpan data kosong di bawah versi asli
+    pos = {"inv": 0, "pend": 1, "hist": 2}
+    version = tuple((None, f"gagal-{uuid.uuid4().hex}") if any(pos[k] == i for k in errs) else v
+                    for i, v in enumerate(version))
+    snap = {"brand": brand, "inventory": inv, "inv_index": build_inv_index(inv), "pending_requests": pend,
+            "history": hist, "version": version}
+    return snap, {TABLES[brand][k]: e for k, e in errs.items()}
+
+def _load_brand_snapshot(brand: str, version: tuple) -> dict:
+    snap, errs = _build_brand_snapshot(brand, version, cached=True)
+    for table, e in errs.items(): st.warning(f"Tabel '{table}' tidak bisa dibaca: {e}")
+    return snap
+
+# Prefetch: thread background (satu per proses) menjaga snapshot semua brand tetap hangat di memori.
+# Tiap PREFETCH_INTERVAL cek versi; snapshot hanya dibangun ulang bila versi berubah dan semua tabel terbaca.
+# "checked" = kapan snapshot terakhir dipastikan masih sama dengan DB.
+@st.cache_resource
+def _prefetch_store() -> dict:
+    return {"lock": threading.Lock(), "brands": {}, "thread": None, "seen": 0.0}
+
+def _prefetch_once(store: dict):
+    for b in BRANDS:
+        v = _brand_version(b)
+        if any(part[0] is None for part in v): continue  # versi tidak diketahui (DB error)
+        cur = store["brands"].get(b)
+        if cur and cur["version"] == v:
+            cur["checked"] = time.time(); continue
+        snap, errs = _build_brand_snapshot(b, v)
+        if errs: continue
+        with store["lock"]:
+            store["brands"][b] = {"version": v, "data": snap, "checked": time.time()}
+
+def _prefetch_loop(store: dict):
+    while time.time() - store["seen"] < PREFETCH_IDLE:
+        try: _prefetch_once(store)
+        except Exception: pass
+        time.sleep(PREFETCH_INTERVAL)
+    with store["lock"]: store["thread"] = None
+
+# Dipanggil tiap rerun sesi yang sudah login: tandai ada pemakai aktif, hidupkan thread bila belum jalan
+def start_prefetcher():
+    store = _prefetch_store()
+    with store["lock"]:
+        store["seen"] = time.time()
+        if store["thread"] is None or not store["thread"].is_alive():
+            store["thread"] = threading.Thread(target=_prefetch_loop, args=(store,), name="brand-prefetch", daemon=True)
+            store["thread"].start()
+
+# Snapshot brand dengan versi terkini (tanpa users). Versi sama dengan prefetch → diambil dari memori.
+def brand_snapshot(brand: str) -> dict:
+    pre = _prefetch_store()["brands"].get(brand)
+    v = _brand_version(brand)
+    return pre["data"] if pre and pre["version"] == v else _load_brand_snapshot(brand, v)
+
+# Users dibaca sambil cek versi + snapshot (versi & tabel snapshot sendiri sudah paralel).
+# allow_stale=True (pindah brand): pakai snapshot prefetch tanpa cek versi; "checked_at" ikut dikembalikan
+# untuk indikator umur data.
+def load_brand_data(brand: str, allow_stale=False) -> dict:
+    pre = _prefetch_store()["brands"].get(brand)
+    with _ctx_pool(1) as ex:
+        users = ex.submit(load_users)
+        if allow_stale and pre:
+            return {"users": users.result(), **pre["data"], "checked_at": pre["checked"]}
+        snap = brand_snapshot(brand)
+        return {"users": users.result(), **snap}
+
+# Naikkan counter lokal tabel yang baru ditulis (kind: inv/pend/hist/ckpt); cache tabel lain tetap hangat.
+# Snapshot prefetch brand tsb dibuang supaya tidak dipakai sebelum dicek ulang.
+def invalidate_tables(brand: str, *kinds):
+    lv = _local_versions()
+    with lv["lock"]:
+        for k in kinds: lv["v"][(brand, k)] = lv["v"].get((brand, k), 0) + 1
+    if set(kinds) & set(SNAPSHOT_PARTS):
+        pre = _prefetch_store()
+        with pre["lock"]: pre["brands"].pop(brand, None)
+
+# Refresh manual: buang semua cache data
+def invalidate_cache():
+    st.cache_data.clear()
+    hs = _history_store()
+    for b in BRANDS:
+        with hs["locks"][b]: hs["brands"].pop(b, None)
+    for b in BRANDS: invalidate_tables(b, "inv", "pend", "hist", "ckpt")
+
+# -------------------- WRITES --------------------
+def _chunks(lst: list, n: int):
+    for i in range(0, len(lst), n): yield lst[i:i+n]
+
+def inv_insert_raw(brand, payload: dict):
+    t = TABLES[brand]
+    supabase.from_(t["inv"]).insert(payload).execute()
+    invalidate_tables(brand, "inv")
+
+def pending_add_many(brand, records: list):
+    if not records: return
+    t = TABLES[brand]
+    supabase.from_(t["pend"]).insert(records).execute()
+    invalidate_tables(brand, "pend")
+
+# Klaim pending sebelum diproses: set claimed_by (token acak) pada id yang belum diklaim atau klaimnya
+# kedaluwarsa (> CLAIM_TTL), kembalikan (token, baris yang didapat panggilan ini). Baris tetap di tabel
+# sampai pending_finish (semua tulis berhasil); gagal → pending_release. Dua admin memproses id yang sama
+# bersamaan → tiap baris hanya didapat satu admin. Butuh sql/pending_claim.sql.
+def pending_claim(brand, ids: list) -> tuple:
+    t = TABLES[brand]; token = uuid.uuid4().hex; got = []
+    now = datetime.now(timezone.utc)
+    stale = (now - timedelta(seconds=CLAIM_TTL)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    try:
+        for chunk in _chunks(ids, 200):
+            got += (supabase.from_(t["pend"]).update({"claimed_by": token, "claimed_at": now.isoformat()})
+                    .in_("id", chunk).or_(f"claimed_by.is.null,claimed_at.lt.{stale}").execute().data or [])
+    except Exception as e:
+        if "claimed_by" in str(e) or "claimed_at" in str(e):
+            raise RuntimeError(f"Tabel '{t['pend']}' belum punya kolom klaim; jalankan sql/pending_claim.sql") from e
+        if got: pending_release(brand, token)
+        raise
+    return token, got
+
+# Hapus baris yang sudah selesai diproses (hanya yang masih diklaim token ini)
+def pending_finish(brand, token, ids: list):
+    for chunk in _chunks(ids, 200):
+        supabase.from_(TABLES[brand]["pend"]).delete().in_("id", chunk).eq("claimed_by", token).execute()
+    if ids: invalidate_tables(brand, "pend")
+
+# Lepas klaim token ini (ids=None → semua) agar request kembali bisa diproses
+def pending_release(brand, token, ids=None):
+    for chunk in ([None] if ids is None else _chunks(ids, 200)):
+        q = supabase.from_(TABLES[brand]["pend"]).update({"claimed_by": None, "claimed_at": None}).eq("claimed_by", token)
+        (q if chunk is None else q.in_("id", chunk)).execute()
+
+# idem_key history yang sudah ada di tabel (set kosong bila kolom idem_key belum dipasang)
+def history_keys_present(brand, keys: list) -> set:
+    out = set()
+    try:
+        for chunk in _chunks(keys, 200):
+            res = supabase.from_(TABLES[brand]["hist"]).select("idem_key").in_("idem_key", chunk).execute()
+            out |= {r.get("idem_key") for r in (res.data or [])}
+    except Exception as e:
+        if not _idem_missing(e): raise
+    return out
+
+# Write-behind: history_add hanya mencatat ke journal sesi; journal_flush() mengirim semuanya
+# sebagai bulk insert per chunk (panggil sebelum st.rerun). Sisa journal juga di-flush di akhir script.
+def history_add(brand, rec: dict):
+    st.session_state.setdefault("hist_journal", {}).setdefault(brand, []).append(rec)
+
+def journal_flush() -> tuple:
+    journal = st.session_state.get("hist_journal") or {}
+    st.session_state.hist_journal = {}
+    done = spooled = 0
+    for brand, recs in journal.items():
+        ok, bad = _history_insert_batches(brand, recs)
+        done += ok; spooled += bad
+    return done, spooled
+
+# Delta stok atomik (qty = qty + delta) untuk banyak code sekaligus. Utama via RPC
+# apply_stock_deltas; bila fungsi belum dipasang → compare-and-swap per code (update ... where qty=lama)
+# dengan retry. Fallback tidak atomik: bila satu code gagal, delta code lain yang sudah masuk dibalik
+# lalu error dilempar ulang. Return {code: qty_baru} untuk code yang ada di tabel.
+def inv_apply_deltas(brand, deltas: dict, invalidate=True) -> dict:
+    if not deltas: return {}
+    t = TABLES[brand]
+    codes = sorted(deltas)
+    try:
+        res = supabase.rpc("apply_stock_deltas", {"p_table": t["inv"], "p_codes": codes,
+                                                  "p_deltas": [int(deltas[c]) for c in codes]}).execute()
+        out = {str(r["code"]): int(r["qty"]) for r in (res.data or [])}
+    except Exception as e:
+        msg = str(e)  # hanya fungsi yang belum dipasang; error lain bisa berarti delta sudah masuk
+        if "PGRST202" not in msg and not re.search(r"function \S*apply_stock_deltas\S* does not exist", msg): raise
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+            futs = {c: ex.submit(_cas_apply_delta, t["inv"], c, int(deltas[c])) for c in codes}
+        got, errs = {}, []
+        for c, f in futs.items():
+            try: got[c] = f.result()
+            except Exception as err: errs.append(err)
+        out = {c: q for c, q in got.items() if q is not None}
+        if errs:
+            for c in out: _cas_apply_delta(t["inv"], c, -int(deltas[c]))
+            invalidate_tables(brand, "inv")
+            raise errs[0]
+    if invalidate: invalidate_tables(brand, "inv")
+    return out
+
+def _cas_apply_delta(table, code, delta, retries=CAS_RETRIES):
+    for _ in range(retries):
+        res = supabase.from_(table).select("qty").eq("code", code).limit(1).execute()
+        if not res.data: return None
+        cur = int(pd.to_numeric(res.data[0].get("qty"), errors="coerce") or 0)
+        upd = supabase.from_(table).update({"qty": cur+delta}).eq("code", code).eq("qty", cur).execute()
+        if upd.data: return cur+delta
+    raise RuntimeError(f"Update stok '{code}' gagal setelah {retries} percobaan (bentrok dengan approver lain).")
+
+# Bulk writes: satu request per chunk; invalidate=False bila caller invalidate sekali di akhir
+def inv_insert_many(brand, rows: list, invalidate=True):
+    if not rows: return
+    t = TABLES[brand]
+    for chunk in _chunks(rows, WRITE_BATCH):
+        supabase.from_(t["inv"]).insert(chunk).execute()
+    if invalidate: invalidate_tables(brand, "inv")
+
+def history_add_many(brand, recs: list, invalidate=True) -> int:
+    if not recs: return 0
+    _, spooled = _history_insert_batches(brand, recs, invalidate)
+    return spooled
+
+# Tiap baris membawa idem_key (diberi sekali oleh _history_insert_batches, ikut tersimpan di spool);
+# upsert ignore_duplicates → retry setelah request yang sebenarnya sudah masuk tidak membuat baris ganda.
+# sql/history_idem_key.sql belum dipasang (kolom tidak ada / tanpa unique index) → tabel dicatat dan
+# insert biasa tanpa idem_key dipakai (seperti fallback RPC di inv_apply_deltas), dengan warning sekali.
+@st.cache_resource
+def _idem_fallback() -> set:
+    return set()
+
+def _idem_missing(err) -> bool:
+    msg = str(err)
+    return ("idem_key" in msg and ("PGRST204" in msg or "does not exist" in msg or "Could not find" in msg)) \
+        or "42P10" in msg or "no unique or exclusion constraint" in msg
+
+def _insert_with_retry(table: str, chunk: list, retries=WRITE_RETRIES):
+    plain = _idem_fallback()
+    for attempt in range(retries):
+        try:
+            if table not in plain:
+                try:
+                    return supabase.from_(table).upsert(chunk, on_conflict="idem_key", ignore_duplicates=True).execute()
+                except Exception as e:
+                    if not _idem_missing(e): raise
+                    plain.add(table)
+                    st.warning(f"Tabel '{table}' belum punya idem_key (jalankan sql/history_idem_key.sql); "
+                               "riwayat ditulis tanpa perlindungan duplikat.")
+            return supabase.from_(table).insert([{k: v for k, v in r.items() if k != "idem_key"} for r in chunk]).execute()
+        except Exception:
+            if attempt == retries-1: raise
+            time.sleep(0.5 * 2**attempt)
+
+# Insert history per chunk dengan retry; chunk yang tetap gagal disimpan ke SPOOL_DIR → (terkirim, di-spool)
+def _history_insert_batches(brand, recs: list, invalidate=True) -> tuple:
+    t = TABLES[brand]; done = spooled = 0
+    recs = [r if r.get("idem_key") else {**r, "idem_key": uuid.uuid4().hex} for r in recs]
+    for n, chunk in enumerate(_chunks(recs, WRITE_BATCH)):
+        try:
+            _insert_with_retry(t["hist"], chunk); done += len(chunk)
+        except Exception as e:
+            _spool_batch(brand, chunk, e, n); spooled += len(chunk)
+    if invalidate and done: invalidate_tables(brand, "hist")
+    return done, spooled
+
+def _spool_batch(brand, chunk: list, err, n=0):
+    path = os.path.join(SPOOL_DIR, f"history_{brand}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{n}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"brand": brand, "error": str(err), "rows": chunk}, f, default=str)
+
+def spooled_batches() -> list:
+    return sorted(os.path.join(SPOOL_DIR, f) for f in os.listdir(SPOOL_DIR) if f.endswith(".json"))
+
+# Kirim ulang batch di spool; file dihapus bila berhasil → (baris terkirim, file tersisa)
+def replay_spool() -> tuple:
+    sent = 0
+    for path in spooled_batches():
+        with open(path, encoding="utf-8") as f: batch = json.load(f)
+        if not all(r.get("idem_key") for r in batch["rows"]):  # spool lama tanpa kunci → beri & simpan dulu
+            batch["rows"] = [r if r.get("idem_key") else {**r, "idem_key": uuid.uuid4().hex} for r in batch["rows"]]
+            with open(path, "w", encoding="utf-8") as f: json.dump(batch, f, default=str)
+        try:
+            _insert_with_retry(TABLES[batch["brand"]]["hist"], batch["rows"])
+        except Exception:
+            continue
+        os.remove(path); sent += len(batch["rows"])
+        invalidate_tables(batch["brand"], "hist")
+    return sent, len(spooled_batches())
+
+# -------------------- APPROVAL ENGINE --------------------
+STOCK_SIGN = {"IN": 1, "OUT": -1, "RETURN": 1}
+
+# Klaim pending lebih dulu (hanya baris yang didapat klaim ini yang diproses), hitung semua delta qty
+# per code di memori, lalu: insert item baru, 1 delta stok atomik, 1 insert history, hapus pending, 1x invalidate.
+# History tiap request memakai idem_key "pend-<id>": request yang history-nya sudah ada (proses sebelumnya
+# mati sebelum pending dihapus, klaim lalu kedaluwarsa) tidak di-apply lagi, cukup dihapus dari pending.
+# Baris yang dilewati dilepas klaimnya; bila insert item / update stok gagal, semua klaim dilepas.
+# Snapshot data hanya dipakai untuk resolve nama → code; qty akhir berasal dari database.
+# Return (approved_ids, warnings).
+def approve_requests(brand: str, reqs: list, data: dict, username: str):
+    index = data["inv_index"]
+    known = set(data["inventory"])
+    new_rows, deltas, steps, added = {}, {}, [], {}
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    hist_rows, approved_ids, warns = [], [], []
+    token, claimed = pending_claim(brand, [r.get("id") for r in reqs])
+    mine = {c.get("id") for c in claimed}
+    if len(mine) < len(reqs): warns.append(f"{len(reqs)-len(mine)} request sudah diproses admin lain")
+    try:
+        seen = {k[5:] for k in history_keys_present(brand, [f"pend-{i}" for i in mine])}
+    except Exception:
+        pending_release(brand, token); raise
+    done_before = [i for i in mine if str(i) in seen]
+    if done_before: warns.append(f"{len(done_before)} request sudah tercatat di riwayat; hanya dihapus dari pending")
+    reqs = [r for r in reqs if r.get("id") in mine and str(r.get("id")) not in seen]
+
+    for req in reqs:
+        qty = int(pd.to_numeric(req.get("qty", 0), errors="coerce") or 0)
+        ttype = str(req.get("type")).upper()
+        if ttype not in STOCK_SIGN:
+            warns.append(f"Tipe tidak dikenali: {ttype}"); continue
+        found_code = inv_code_for(index, req.get("item")) or added.get(_name_key(req.get("item")))
+
+        # IN: buat item baru kalau tidak ada. Jika user isi code & unik → pakai code tsb.
+        if ttype == "IN" and found_code is None:
+            req_code = (req.get("code") or "").strip()
+            req_name = req.get("item")
+            if req_code and req_code not in known and req_code != "-":
+                found_code = req_code
+            else:
+                found_code = f"NEW-{stamp}-{uuid.uuid4().hex[:6].upper()}"  # unik antar batch & approver
+            new_rows[found_code] = {"code": found_code, "item": req_name, "qty": 0,
+                                    "unit": req.get("unit", "-"), "category": "Uncategorized"}
+            known.add(found_code); added[_name_key(req_name)] = found_code
+
+        if found_code is None:
+            warns.append(f"Item '{req.get('item')}' tidak ditemukan; lewati."); continue
+
+        d = STOCK_SIGN[ttype] * qty
+        deltas[found_code] = deltas.get(found_code, 0) + d
+        steps.append((found_code, deltas[found_code]))
+        hist_rows.append({"action": f"APPROVE_{ttype}", "item": req.get("item"), "qty": qty, "stock": None,
+                          "unit": req.get("unit", "-"), "user": req.get("user", username),
+                          "event": req.get("event", "-"), "do_number": req.get("do_number", "-"),
+                          "attachment": req.get("attachment"), "timestamp": ts_text(), "date": req.get("date"),
+                          "code": found_code, "trans_type": req.get("trans_type"), "idem_key": f"pend-{req.get('id')}"})
+        approved_ids.append(req.get("id"))
+
+    if approved_ids:
+        try:  # code bentrok (sudah dibuat approver lain) → insert gagal, tidak digabung diam-diam
+            inv_insert_many(brand, list(new_rows.values()), invalidate=False)
+            final = inv_apply_deltas(brand, deltas, invalidate=False)
+        except Exception:
+            pending_release(brand, token); invalidate_tables(brand, "inv")
+            raise
+        # stock per baris = qty akhir dikurangi delta baris-baris sesudahnya (urutan dalam batch)
+        for rec, (code, cum) in zip(hist_rows, steps):
+            if code in final: rec["stock"] = final[code] - (deltas[code] - cum)
+        spooled = history_add_many(brand, hist_rows, invalidate=False)
+        if spooled: warns.append(f"{spooled} baris riwayat gagal dikirim dan disimpan untuk dikirim ulang")
+        invalidate_tables(brand, "inv", "hist")
+    pending_finish(brand, token, approved_ids + done_before)
+    done = set(approved_ids) | set(done_before)
+    pending_release(brand, token, [i for i in mine if i not in done])
+    return approved_ids, warns
+
+# Reject: klaim pending, history REJECT_* lewat journal (1 bulk insert, idem_key "pend-<id>"), lalu hapus
+# pending → (rejected_ids, baris di-spool). Baris yang di-spool tetap dihapus: spool dikirim ulang nanti.
+def reject_requests(brand, reqs: list, username: str) -> tuple:
+    token, claimed = pending_claim(brand, [r.get("id") for r in reqs])
+    mine = {c.get("id") for c in claimed}
+    ids = []
+    for req in [r for r in reqs if r.get("id") in mine]:
+        history_add(brand, {"action":f"REJECT_{str(req.get('type','-')).upper()}","item":req.get("item","-"),
+                            "qty":int(pd.to_numeric(req.get("qty",0), errors="coerce") or 0),
+                            "stock":None,"unit":req.get("unit","-"),"user":req.get("user", username),
+                            "event":req.get("event","-"),"do_number":req.get("do_number","-"),
+                            "attachment":req.get("attachment"),"timestamp":ts_text(),
+                            "date":req.get("date"),"code":req.get("code"),"trans_type":req.get("trans_type"),
+                            "idem_key":f"pend-{req.get('id')}"})
+        ids.append(req.get("id"))
+    if not ids: return [], 0
+    try:
+        _, spooled = journal_flush()
+    except Exception:
+        pending_release(brand, token); raise
+    pending_finish(brand, token, ids)
+    return ids, spooled
+
+# -------------------- MASTER IMPORT --------------------
+MASTER_COLS = ["Kode Barang","Nama Barang","Qty","Satuan","Kategori"]
+
+def _clean_str(s: pd.Series) -> pd.Series:
+    return s.where(s.notna(), "").astype(str).str.strip()
+
+# Validasi seluruh sheet master sekaligus (kolom per kolom). Return (df_valid, errors);
+# nomor baris = index + row_offset (index 0-based dari read_excel → +2; chunk streaming → +0).
+def validate_master_sheet(df: pd.DataFrame, existing: set, row_offset=2):
+    code, name = _clean_str(df["Kode Barang"]), _clean_str(df["Nama Barang"])
+    unit, cat = _clean_str(df["Satuan"]), _clean_str(df["Kategori"])
+    qty = pd.to_numeric(df["Qty"], errors="coerce")
+    err = pd.Series("", index=df.index, dtype=object)
+    err = err.mask(code.eq("") | name.eq(""), "Kode/Nama wajib.")
+    err = err.mask(err.eq("") & code.isin(existing), "Kode '" + code + "' sudah ada.")
+    err = err.mask(err.eq("") & code.duplicated(), "Kode '" + code + "' dobel di file.")
+    err = err.mask(err.eq("") & qty.lt(0), "Qty tidak boleh negatif.")
+    ok = err.eq("")
+    valid = pd.DataFrame({"code": code, "item": name, "qty": qty.fillna(0).astype(int),
+                          "unit": unit.mask(unit.eq(""), "-"), "category": cat.mask(cat.eq(""), "Uncategorized")})[ok]
+    errors = [f"Baris {i+row_offset}: {m}" for i, m in err[~ok].items()]
+    return valid, errors
+
+# Insert master + history ADD_ITEM per chunk WRITE_BATCH, invalidate sekali.
+# Return (item tersimpan, error atau None); chunk sesudah chunk yang gagal tidak dikirim.
+def import_master_rows(brand, valid: pd.DataFrame, username: str, invalidate=True) -> tuple:
+    if valid.empty: return 0, None
+    rows = valid.to_dict(orient="records")
+    now_ts, today = ts_text(), datetime.now().strftime("%Y-%m-%d")
+    hist = [{"action":"ADD_ITEM","item":r["item"],"qty":r["qty"],"stock":r["qty"],"unit":r["unit"],
+             "user":username,"event":"-","timestamp":now_ts,"date":today,
+             "code":r["code"],"trans_type":None,"do_number":"-","attachment":None} for r in rows]
+    added = 0
+    try:
+        for inv_chunk, hist_chunk in zip(_chunks(rows, WRITE_BATCH), _chunks(hist, WRITE_BATCH)):
+            inv_insert_many(brand, inv_chunk, invalidate=False)
+            history_add_many(brand, hist_chunk, invalidate=False)
+            added += len(inv_chunk)
+    except Exception as e:
+        return added, e
+    finally:
+        if invalidate: invalidate_tables(brand, "inv", "hist")
+    return added, None
+
+# -------------------- UPLOAD INGESTION --------------------
+def _csv_sep(fu) -> str:
+    sample = fu.read(4096); fu.seek(0)
+    if isinstance(sample, bytes): sample = sample.decode("utf-8", errors="ignore")
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+    except csv.Error:
+        return ","
+
+# Baca upload (xlsx read-only / csv) per chunk tanpa memuat seluruh workbook.
+# Yield (df_chunk, progress 0..1 atau None); index df_chunk = nomor baris di file (header = baris 1).
+def iter_upload_chunks(fu, chunk_rows=UPLOAD_CHUNK):
+    size = getattr(fu, "size", 0) or 0
+    if str(getattr(fu, "name", "")).lower().endswith(".csv"):
+        start = 2
+        for df in pd.read_csv(fu, sep=_csv_sep(fu), chunksize=chunk_rows, dtype=str, skipinitialspace=True):
+            df.columns = [str(c).strip() for c in df.columns]
+            df.index = range(start, start+len(df)); start += len(df)
+            yield df, (min(fu.tell()/size, 1.0) if size else None)
+        return
+    wb = load_workbook(fu, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else f"Unnamed: {i}" for i, h in enumerate(next(rows, ()))]
+        n, total = len(header), (ws.max_row or 0)
+        buf, idx = [], []
+        for rno, row in enumerate(rows, start=2):
+            if all(v is None for v in row): continue
+            buf.append(tuple(row[:n]) + (None,)*(n-len(row))); idx.append(rno)
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=header, index=idx), (min(rno/total, 1.0) if total else None)
+                buf, idx = [], []
+        yield pd.DataFrame(buf, columns=header, index=idx), 1.0
+    finally:
+        wb.close()
+
+
+def errors_text(errors: list, limit=200) -> str:
+    txt = "\n- " + "\n- ".join(errors[:limit])
+    if len(errors) > limit: txt += f"\n- … dan {len(errors)-limit:,} baris lainnya"
+    return txt
+
+# -------------------- UPLOAD VALIDATION (IN/OUT/RETURN) --------------------
+# Spec deklaratif per jenis request: kolom Excel → field, kolom wajib, urutan cek (cek pertama yang
+# gagal jadi pesan error baris tsb). Pesan None = pesan dibangun per baris.
+UPLOAD_SPECS = {
+    "IN": {
+        "cols": {"date":"Tanggal","code":"Kode Barang","item":"Nama Barang","qty":"Qty",
+                 "unit":"Unit (opsional)","event":"Event (opsional)"},
+        "required": ["Tanggal","Kode Barang","Nama Barang","Qty"],
+        "checks": [("name","Nama wajib."), ("qty","Qty harus > 0.")],
+        "record": "out",
+    },
+    "OUT": {
+        "cols": {"date":"Tanggal","code":"Kode Barang","item":"Nama Barang","qty":"Qty","event":"Event","trans_type":"Tipe"},
+        "required": ["Tanggal","Kode Barang","Nama Barang","Qty","Event","Tipe"],
+        "checks": [("event","Event wajib."), ("trans_type","Tipe harus Support/Penjualan."),
+                   ("exists","Item tidak ada di inventory (OUT hanya untuk existing)."),
+                   ("qty","Qty harus > 0."), ("stock",None)],
+        "record": "out",
+    },
+    "RETURN": {
+        "cols": {"date":"Tanggal","code":"Kode Barang","item":"Nama Barang","qty":"Qty","event":"Event"},
+        "required": ["Tanggal","Kode Barang","Nama Barang","Qty","Event"],
+        "checks": [("qty","Qty harus > 0."), ("event","Event wajib."), ("exists","Item tidak ditemukan."), ("out_event",None),
+                   ("returnable",None)],
+        "record": "return",
+    },
+}
+
+def _to_dates(s: pd.Series) -> pd.Series:
+    try:
+        return pd.to_datetime(s, errors="coerce", format="mixed")
+    except (TypeError, ValueError):  # pandas < 2.0
+        return pd.to_datetime(s, errors="coerce")
+
+# Validasi + normalisasi satu sheet upload sekaligus (kolom per kolom) → (records, errors).
+# out_events: {code: {event: sisa retur}} (out_events_by_code) untuk cek RETURN; qty retur
+# dijumlah berurutan per (item, event) di dalam sheet.
+def stage_upload(df: pd.DataFrame, kind: str, data: dict, username: str, out_events=None, row_offset=2):
+    spec = UPLOAD_SPECS[kind]
+    blank = pd.Series("", index=df.index, dtype=object)
+    f = {k: (_clean_str(df[c]) if c in df.columns else blank) for k, c in spec["cols"].items()}
+    inv = data["inventory"]; index = data["inv_index"]
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    date = _to_dates(df[spec["cols"]["date"]]).dt.strftime("%Y-%m-%d").fillna(today)
+    qty = pd.to_numeric(df[spec["cols"]["qty"]], errors="coerce").fillna(0).astype(int)
+    by_name = f["item"].map(index["by_name"])
+    by_name = by_name.fillna(f["item"].map(_name_key).map(index["by_key"]))
+    code = f["code"].where(f["code"].isin(inv.keys()) & f["code"].ne(""), by_name.where(f["item"].ne("")))
+    found = code.notna()
+    inv_name = code.map({c: it.get("name") for c, it in inv.items()})
+    inv_unit = code.map({c: it.get("unit","-") for c, it in inv.items()})
+    stock = code.map({c: int(it.get("qty", 0)) for c, it in inv.items()}).fillna(0).astype(int)
+    ttype = f.get("trans_type", blank).str.lower()
+
+    out_events = out_events or {}
+    if kind == "RETURN":
+        left = {f"{c}\x1f{str(e).strip().casefold()}": q for c, evs in out_events.items() for e, q in evs.items()}
+        canon = {f"{c}\x1f{str(e).strip().casefold()}": e for c, evs in out_events.items() for e in evs}
+        ev_key = code.fillna("").astype(str) + "\x1f" + f["event"].str.casefold()
+        f["event"] = ev_key.map(canon).fillna(f["event"])  # simpan dengan penulisan event OUT-nya
+        sisa = ev_key.map(left).fillna(0).astype(int)
+        ev_ok = ev_key.isin(left.keys())
+        used = qty.clip(lower=0).groupby(ev_key).cumsum()
+
+    fails = {
+        "name": lambda: f["item"].eq(""),
+        "event": lambda: f["event"].eq(""),
+        "trans_type": lambda: ~ttype.isin(["support","penjualan"]),
+        "exists": lambda: ~found,
+        "qty": lambda: qty.le(0),
+        "stock": lambda: found & qty.gt(stock),
+        "out_event": lambda: ~ev_ok,
+        "returnable": lambda: used.gt(sisa),
+    }
+    err = pd.Series("", index=df.index, dtype=object)
+    for check, msg in spec["checks"]:
+        m = err.eq("") & fails[check]()
+        if not m.any(): continue
+        if check == "stock":
+            msg = "Qty (" + qty.astype(str) + ") > stok (" + stock.astype(str) + ")."
+        elif check == "out_event":
+            msg = pd.Series({i: (f"Event '{f['event'][i]}' tidak cocok. Tersedia: {', '.join(sorted(out_events[code[i]]))}."
+                                 if out_events.get(code[i]) else f"Belum ada OUT approved (sisa retur) untuk '{inv_name[i]}'.")
+                             for i in m[m].index}, dtype=object)
+        elif check == "returnable":
+            msg = "Qty (" + qty.astype(str) + ") > sisa retur event ini (" + (sisa - used + qty).astype(str) + ")."
+        err = err.mask(m, msg)
+
+    ok = err.eq("")
+    unit = f.get("unit", blank)
+    out = pd.DataFrame({
+        "date": date,
+        "code": code.fillna(f["code"].mask(f["code"].eq(""), "-")) if kind == "IN" else code,
+        "item": inv_name.fillna(f["item"]),
+        "qty": qty,
+        "unit": unit.mask(unit.eq(""), inv_unit).fillna("-").replace("", "-"),
+        "event": f["event"].mask(f["event"].eq(""), "-"),
+        "trans_type": ttype.map({"support":"Support","penjualan":"Penjualan"}) if spec["record"] == "out" else None,
+    })[ok]
+    out["do_number"] = "-"; out["attachment"] = None
+    out["user"] = username; out["timestamp"] = ts_text()
+    out = out.astype(object).where(out.notna(), None)
+    records = out[STD_REQ_COLS].to_dict(orient="records")
+    errors = [f"Baris {i+row_offset}: {m}" for i, m in err[~ok].items()]
+    return records, errors
+
+def reset_brand(brand):
+    t = TABLES[brand]
+    supabase.from_(t["pend"]).delete().neq("id",-1).execute()
+    supabase.from_(t["hist"]).delete().neq("id",-1).execute()
+    supabase.from_(t["inv"]).delete().neq("code","").execute()
+    invalidate_tables(brand, "inv", "pend", "hist")
+
+# -------------------- DASHBOARD HELPERS --------------------
+TYPE_NORMS = ["ADD","IN","OUT","RETURN"]
+
+# Frame history bertipe: hanya ADD_ITEM + APPROVE_IN/OUT/RETURN yang bertanggal.
+# date_eff datetime64 (hari), type_norm/event/trans_type categorical, qty int32.
+def _prepare_history_df(data: dict) -> pd.DataFrame:
+    df = pd.DataFrame(data.get("history", []))
+    if df.empty: return df
+    for c in ["id","action","code","item","event","trans_type","unit","date","timestamp"]:
+        if c not in df.columns: df[c]=None
+    df["qty"] = pd.to_numeric(df["qty"] if "qty" in df.columns else 0, errors="coerce").fillna(0).astype("int32")
+    s_date = pd.to_datetime(df["date"], errors="coerce")
+    s_ts   = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["date_eff"] = s_date.fillna(s_ts).dt.floor("D")
+    df["ts"] = s_ts
+    act = df["action"].astype(str).str.upper()
+    tn = act.str.extract(r"APPROVE_(IN|OUT|RETURN)", expand=False).mask(act.eq("ADD_ITEM"), "ADD")
+    df["type_norm"] = pd.Categorical(tn, categories=TYPE_NORMS)
+    df["event"] = df["event"].fillna("-").astype(str).astype("category")
+    df["trans_type"] = df["trans_type"].fillna("-").astype(str).astype("category")
+    df = df[df["type_norm"].notna() & df["date_eff"].notna()].reset_index(drop=True)
+    return df
+
+# Frame history siap pakai, dibangun sekali per (brand, versi history) dan dipakai bersama
+# (rollup, stock card). Jangan dimutasi oleh pemakai.
+@st.cache_resource
+def _prepared_store() -> dict:
+    return {"lock": threading.RLock(), "brands": {}}
+
+def prepared_history(data: dict) -> dict:
+    store = _prepared_store(); hv = data["version"][2]
+    with store["lock"]:
+        cur = store["brands"].get(data["brand"])
+        if cur is None or cur["version"] != hv:
+            t0 = time.perf_counter()
+            df = _prepare_history_df(data)
+            cur = {"version": hv, "df": df, "rows": len(df),
+                   "bytes": int(df.memory_usage(deep=True).sum()) if not df.empty else 0,
+                   "build_ms": (time.perf_counter()-t0)*1000}
+            store["brands"][data["brand"]] = cur
+        return cur
+
+def prepared_history_stats(brand: str):
+    cur = _prepared_store()["brands"].get(brand)
+    return None if cur is None else {k: cur[k] for k in ("rows","bytes","build_ms")}
+
+# Rollup qty per bulan × tipe × item × event × trans_type, dirawat inkremental per brand:
+# hanya baris history yang id-nya belum pernah di-fold yang ditambahkan ke agregat.
+ROLLUP_KEYS = ["month","type_norm","code","item","event","trans_type"]
+
+# Baris history yang belum di-fold. Dicek per id, bukan watermark: commit bisa masuk tidak urut id
+# (mis. id 3 baru terlihat setelah id 4). None → ada baris lama yang hilang (reset/hapus) → bangun ulang.
+def _unfolded_rows(cur: dict, hist: list):
+    if cur["hist"] is hist: return []
+    new = [h for h in hist if h.get("id") not in cur["ids"]]
+    return None if len(hist) - len(new) != len(cur["ids"]) else new
+
+@st.cache_resource
+def _rollup_store() -> dict:
+    return {"lock": threading.Lock(), "brands": {}}
+
+def _rollup_frame(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty: return pd.DataFrame(columns=ROLLUP_KEYS+["qty"])
+    df = df.assign(month=df["date_eff"].dt.to_period("M").dt.to_timestamp(),
+                   code=df["code"].fillna("-").astype(str), item=df["item"].fillna("-").astype(str),
+                   qty=df["qty"].astype("int64"))
+    g = df.groupby(ROLLUP_KEYS, as_index=False, observed=True)["qty"].sum()
+    return g.astype({"type_norm": str, "event": str, "trans_type": str})
+
+def brand_rollups(data: dict) -> pd.DataFrame:
+    hist = data.get("history", [])
+    store = _rollup_store()
+    with store["lock"]:
+        cur = store["brands"].get(data["brand"])
+        new = _unfolded_rows(cur, hist) if cur else None
+        if new is None:  # awal / ada baris hilang → bangun dari frame siap pakai
+            cur = {"ids": {h.get("id") for h in hist}, "hist": hist, "agg": _rollup_frame(prepared_history(data)["df"])}
+        elif new:
+            parts = [p for p in (cur["agg"], _rollup_frame(_prepare_history_df({"history": new}))) if not p.empty]
+            agg = pd.concat(parts, ignore_index=True).groupby(ROLLUP_KEYS, as_index=False)["qty"].sum() if parts else cur["agg"]
+            cur = {"ids": cur["ids"] | {h.get("id") for h in new}, "hist": hist, "agg": agg}
+        else:
+            cur = {**cur, "hist": hist}
+        store["brands"][data["brand"]] = cur
+        return cur["agg"]
+
+# -------------------- EVENT CATALOG --------------------
+# Katalog event dari APPROVE_OUT/APPROVE_RETURN, di-fold inkremental per brand seperti rollup (per id):
+# (code, event casefold) → [qty OUT, qty RETURN, label]. Label = penulisan event pada OUT pertama, jadi
+# "Bazar"/"bazar" satu event. Baris lama tanpa code valid di-resolve lewat nama item.
+# Form OUT/RETURN membaca katalog ini, bukan scan history.
+@st.cache_resource
+def _event_store() -> dict:
+    return {"lock": threading.Lock(), "brands": {}}
+
+def _fold_events(pairs: dict, rows, data: dict):
+    inv, index = data.get("inventory", {}), data.get("inv_index")
+    for h in rows:
+        act = str(h.get("action","")).upper()
+        if act not in ("APPROVE_OUT", "APPROVE_RETURN"): continue
+        ev = str(h.get("event") or "").strip()
+        if ev in ("", "-"): continue
+        code = h.get("code")
+        if code not in inv and index: code = inv_code_for(index, h.get("item"), code)
+        if not code or code == "-": continue
+        try: q = int(h.get("qty") or 0)
+        except (TypeError, ValueError): q = 0
+        p = pairs.setdefault((str(code), ev.casefold()), [0, 0, ev])
+        if act == "APPROVE_OUT":
+            if p[0] == 0: p[2] = ev
+            p[0] += q
+        else:
+            p[1] += q
+
+def event_catalog(data: dict) -> dict:
+    hist = data.get("history", [])
+    store = _event_store()
+    with store["lock"]:
+        cur = store["brands"].get(data["brand"])
+        new = _unfolded_rows(cur, hist) if cur else None
+        if new is None: cur, new = {"ids": set(), "pairs": {}}, hist
+        if new or "by_code" not in cur:
+            pairs = {k: v[:] for k, v in cur["pairs"].items()}
+            _fold_events(pairs, new, data)
+            by_code, by_event = {}, {}
+            for (code, _), (o, r, label) in pairs.items():
+                if o <= 0: continue
+                by_code.setdefault(code, {})[label] = o - r
+                by_event.setdefault(label, set()).add(code)
+            cur = {"ids": cur["ids"] | {h.get("id") for h in new}, "pairs": pairs, "by_code": by_code, "by_event": by_event}
+        store["brands"][data["brand"]] = {**cur, "hist": hist}
+        return store["brands"][data["brand"]]
+
+# Sisa retur {code: {event: qty}} = OUT approved − RETURN approved − RETURN pending − extra
+# (mis. daftar retur yang sedang di-stage). Hanya event dengan sisa > 0; event dicocokkan via casefold.
+# Bentuk out_events untuk stage_upload RETURN dan pilihan event di form retur.
+def out_events_by_code(data: dict, extra=()) -> dict:
+    left = {c: dict(evs) for c, evs in event_catalog(data)["by_code"].items()}
+    taken = [p for p in data.get("pending_requests", []) if str(p.get("type","")).upper() == "RETURN"] + list(extra)
+    for r in taken:
+        code = r.get("code")
+        if code not in data.get("inventory", {}): code = inv_code_for(data["inv_index"], r.get("item"), code)
+        evs = left.get(code)
+        if not evs: continue
+        ev = str(r.get("event") or "").strip().casefold()
+        key = next((e for e in evs if e.casefold() == ev), None)
+        if key is not None: evs[key] -= int(pd.to_numeric(r.get("qty", 0), errors="coerce") or 0)
+    left = {c: {e: q for e, q in evs.items() if q > 0} for c, evs in left.items()}
+    return {c: evs for c, evs in left.items() if evs}
+
+# -------------------- STOCK CARD --------------------
+STOCK_SIGN_NORM = {"ADD": 1, "IN": 1, "OUT": -1, "RETURN": 1}
+PAGE_ROWS = 100
+
+# Index per item atas frame history siap pakai: code → posisi baris urut (date_eff, ts).
+# Baris lama tanpa code valid di-resolve lewat nama. Dibangun sekali per versi history.
+def _history_keys(data: dict) -> pd.Series:
+    ph = prepared_history(data)
+    if "card_key" not in ph:
+        df = ph["df"]
+        if df.empty:
+            ph["card_key"] = pd.Series(dtype=object)
+        else:
+            inv, idx = data["inventory"], data["inv_index"]
+            by_name = df["item"].map(idx["by_name"]).fillna(df["item"].map(_name_key).map(idx["by_key"]))
+            ph["card_key"] = df["code"].where(df["code"].isin(inv.keys()), by_name).fillna(df["code"])
+    return ph["card_key"]
+
+def stock_card_index(data: dict) -> dict:
+    ph = prepared_history(data)
+    with _prepared_store()["lock"]:
+        if "card_index" not in ph:
+            df = ph["df"]
+            if df.empty:
+                ph["card_index"] = {}
+            else:
+                key = _history_keys(data)
+                order = df.assign(_key=key).sort_values(["_key","date_eff","ts"], na_position="last", kind="stable")
+                pos = order.index.to_numpy()
+                ph["card_index"] = {k: pos[v] for k, v in pd.Series(pos).groupby(order["_key"].to_numpy()).indices.items()}
+        return ph["card_index"]
+
+# Kartu stok satu item: saldo berjalan = opening + cumsum(qty bertanda).
+# start: tampilkan mulai tanggal ini; saldo awal diambil dari stock_as_of (checkpoint + replay).
+def stock_card_frame(data: dict, code: str, start=None) -> pd.DataFrame:
+    pos = stock_card_index(data).get(code)
+    if pos is None or len(pos) == 0: return pd.DataFrame()
+    h = prepared_history(data)["df"].iloc[pos]
+    opening = 0
+    if start is not None:
+        start = pd.Timestamp(start)
+        opening = int(stock_as_of(data, start - pd.Timedelta(days=1), code).get(code, 0))
+        h = h.iloc[h["date_eff"].searchsorted(start):]
+        if h.empty: return pd.DataFrame()
+    tn = h["type_norm"].astype(str)
+    sign = tn.map(STOCK_SIGN_NORM).fillna(0).astype("int64")
+    signed = h["qty"].astype("int64") * sign
+    user = h["user"].fillna("-").astype(str) if "user" in h.columns else pd.Series("-", index=h.index)
+    do = h["do_number"].fillna("-").astype(str).str.strip() if "do_number" in h.columns else pd.Series("-", index=h.index)
+    ev, tt = h["event"].astype(str), h["trans_type"].astype(str)
+    ket = np.select([tn.eq("ADD"), tn.eq("IN"), tn.eq("OUT"), tn.eq("RETURN")],
+                    ["Initial Stock",
+                     "Request IN by " + user + np.where(do.isin(["","-"]), "", " (DO: " + do + ")"),
+                     "Request OUT (" + tt + ") by " + user + " — Event: " + ev,
+                     "Retur by " + user + " — Event: " + ev], default="N/A")
+    qty = h["qty"].astype(str)
+    return pd.DataFrame({"Tanggal": h["date"].fillna(h["timestamp"]).to_numpy(), "Keterangan": ket,
+                         "Masuk (IN)": np.where(sign > 0, qty, "-"), "Keluar (OUT)": np.where(sign < 0, qty, "-"),
+                         "Saldo Akhir": opening + signed.cumsum().to_numpy()})
+
+# -------------------- STOCK CHECKPOINTS --------------------
+# Checkpoint (code, as_of, qty, hist_id) = saldo code di akhir hari as_of, mencakup baris history
+# dengan id <= hist_id dan date_eff <= as_of. Saldo tanggal X = checkpoint terdekat <= X ditambah
+# replay baris dengan date_eff <= X yang belum tercakup (date_eff > as_of ATAU id > hist_id,
+# sehingga transaksi backdate yang di-approve belakangan tetap terhitung).
+CKPT_COLS = ["code","as_of","qty","hist_id"]
+
+# Versi tabel checkpoint, di-cache per TTL (checkpoint jarang berubah; write lokal menaikkan local_version).
+# Tabel belum dibuat → (None, None): kunci cache tetap stabil dan tidak ada request gagal tiap render.
+@st.cache_data(ttl=SNAPSHOT_TTL, max_entries=len(BRANDS)*4, show_spinner=False)
+def _ckpt_version(brand: str, lv: int) -> tuple:
+    try:
+        res = supabase.from_(TABLES[brand]["ckpt"]).select("as_of", count="exact").order("as_of", desc=True).limit(1).execute()
+        return (res.count, (res.data or [{}])[0].get("as_of"))
+    except Exception:
+        return (None, None)
+
+# Hanya batch checkpoint terbaru <= as_of (satu rebuild = satu batch untuk semua code), opsional satu code
+@st.cache_data(ttl=SNAPSHOT_TTL, max_entries=len(BRANDS)*32, show_spinner=False)
+def _load_checkpoints(brand: str, version: tuple, as_of: str, code=None) -> pd.DataFrame:
+    empty = pd.DataFrame(columns=CKPT_COLS)
+    if version[0][0] is None: return empty  # tabel opsional: tanpa tabel → replay dari awal
+    t = TABLES[brand]["ckpt"]
+    q = supabase.from_(t).select("as_of").lte("as_of", as_of)
+    if code is not None: q = q.eq("code", code)
+    top = q.order("as_of", desc=True).limit(1).execute().data
+    if not top: return empty
+    filters = [("eq", "as_of", top[0]["as_of"])] + ([("eq", "code", code)] if code is not None else [])
+    frames = [f for f in iter_pages(t, ",".join(CKPT_COLS), filters, order="code") if not f.empty]
+    if not frames: return empty
+    df = pd.concat(frames, ignore_index=True)
+    df["as_of"] = pd.to_datetime(df["as_of"], errors="coerce")
+    df["qty"] = pd.to_numeric(df["qty"], errors="coerce").fillna(0).astype("int64")
+    df["hist_id"] = pd.to_numeric(df["hist_id"], errors="coerce").fillna(0).astype("int64")
+    return df.dropna(subset=["as_of"])
+
+def load_checkpoints(brand: str, as_of=None, code=None) -> pd.DataFrame:
+    lv = local_version(brand, "ckpt")
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).strftime("%Y-%m-%d")
+    try:  # error tidak di-cache → dicoba lagi di render berikutnya
+        return _load_checkpoints(brand, (_ckpt_version(brand, lv), lv), as_of, code)
+    except Exception as e:
+        st.warning(f"Checkpoint tidak bisa dibaca, saldo dihitung dari awal: {e}")
+        return pd.DataFrame(columns=CKPT_COLS)
+
+# Posisi baris frame history urut date_eff dan urut id, dibangun sekali per versi history
+def _ledger_order(data: dict) -> tuple:
+    ph = prepared_history(data)
+    with _prepared_store()["lock"]:
+        if "ledger_order" not in ph:
+            d, i = ph["df"]["date_eff"].to_numpy(), ph["df"]["id"].to_numpy()
+            od, oi = np.argsort(d, kind="stable"), np.argsort(i, kind="stable")
+            ph["ledger_order"] = (od, d[od], oi, i[oi])
+        return ph["ledger_order"]
+
+# Saldo per akhir hari as_of → Series code → qty. code: hanya satu item (baris dari stock_card_index).
+# Semua code: replay dibatasi ke baris dengan date_eff di (as_of checkpoint tertua, as_of]
+# ditambah baris id > hist_id terkecil; filter per code di bawah membuang yang sudah tercakup checkpoint.
+def stock_as_of(data: dict, as_of, code=None) -> pd.Series:
+    as_of = pd.Timestamp(as_of).normalize()
+    df = prepared_history(data)["df"]
+    if df.empty: return pd.Series(dtype="int64")
+    base = load_checkpoints(data["brand"], as_of, code).set_index("code")
+    if code is not None:
+        pos = stock_card_index(data).get(code, np.empty(0, dtype=np.int64))
+        pos = pos[:df["date_eff"].to_numpy()[pos].searchsorted(as_of.to_datetime64(), side="right")]
+    else:
+        od, d, oi, i = _ledger_order(data)
+        hi = d.searchsorted(as_of.to_datetime64(), side="right")
+        if base.empty: pos = od[:hi]
+        else:
+            lo = d.searchsorted(base["as_of"].min().to_datetime64(), side="right")
+            pos = np.union1d(od[lo:hi], oi[i.searchsorted(base["hist_id"].min(), side="right"):])
+    h = df.iloc[pos]
+    mov = pd.DataFrame({"code": _history_keys(data).to_numpy()[pos] if code is None else code,
+                        "date_eff": h["date_eff"].to_numpy(), "id": h["id"].to_numpy(),
+                        "signed": h["qty"].astype("int64").to_numpy() * h["type_norm"].astype(str).map(STOCK_SIGN_NORM).fillna(0).astype("int64").to_numpy()})
+    mov = mov[mov["date_eff"] <= as_of]
+    b_date = pd.to_datetime(mov["code"].map(base["as_of"])); b_id = mov["code"].map(base["hist_id"])
+    mov = mov[b_date.isna() | (mov["date_eff"] > b_date) | (mov["id"] > b_id)]
+    out = mov.groupby("code")["signed"].sum()
+    return out.add(base["qty"], fill_value=0).astype("int64")
+
+# Bangun checkpoint baru di cutoff (default: akhir bulan lalu) dari checkpoint sebelumnya + replay
+def rebuild_checkpoints(data: dict, cutoff=None) -> int:
+    cutoff = pd.Timestamp(cutoff) if cutoff is not None else pd.Timestamp.today().to_period("M").to_timestamp() - pd.Timedelta(days=1)
+    df = prepared_history(data)["df"]
+    if df.empty: return 0
+    bal = stock_as_of(data, cutoff)
+    hist_id = int(df["id"].max())
+    rows = [{"code": str(c), "as_of": cutoff.strftime("%Y-%m-%d"), "qty": int(q), "hist_id": hist_id} for c, q in bal.items()]
+    t = TABLES[data["brand"]]
+    for chunk in _chunks(rows, WRITE_BATCH):
+        supabase.from_(t["ckpt"]).upsert(chunk, on_conflict="code,as_of").execute()
+    invalidate_tables(data["brand"], "ckpt")
+    return len(rows)
+
+# Rekonsiliasi: qty inventory vs saldo hasil ledger (checkpoint + replay) per hari ini
+def reconcile_stock(data: dict) -> pd.DataFrame:
+    ledger = stock_as_of(data, pd.Timestamp.today())
+    inv = data["inventory"]
+    df = pd.DataFrame({"Kode": list(inv), "Nama Barang": [it.get("name","-") for it in inv.values()],
+                       "Qty Inventory": [int(it.get("qty",0)) for it in inv.values()]})
+    df["Saldo Ledger"] = df["Kode"].map(ledger).fillna(0).astype(int)
+    df["Selisih"] = df["Qty Inventory"] - df["Saldo Ledger"]
+    return df[df["Selisih"] != 0].reset_index(drop=True)
+
+
+
+# -------------------- HISTORY QUERIES --------------------
+HIST_ACTIONS = ["ADD_ITEM","APPROVE_IN","APPROVE_OUT","APPROVE_RETURN","REJECT_IN","REJECT_OUT","REJECT_RETURN"]
+
+# Filter tanggal history = coalesce(date, timestamp): baris tanpa date (data lama) disaring lewat timestamp,
+# sama seperti Stock Card. timestamp berupa teks "YYYY-MM-DD HH:MM:SS" → batas akhir pakai < hari berikutnya.
+def history_date_filters(start=None, end=None) -> list:
+    if not start and not end: return []
+    by_date, by_ts = [], ["date.is.null"]
+    if start:
+        by_date.append(f"date.gte.{start}"); by_ts.append(f"timestamp.gte.{start}")
+    if end:
+        by_date.append(f"date.lte.{end}")
+        by_ts.append(f"timestamp.lt.{(pd.Timestamp(end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')}")
+    return [("or_", f"and({','.join(by_date)}),and({','.join(by_ts)})")]
+
+# Satu halaman history (terbaru dulu = id menurun), filter dijalankan di DB. cursor = id baris terakhir
+# halaman sebelumnya (keyset pada id saja: unik & tidak pernah null). Return (df, total|None, cursor_berikutnya|None).
+def history_query(brand: str, start=None, end=None, user=None, action=None, item_q=None, cursor=None,
+                  page_size=PAGE_ROWS, with_count=False, columns=HIST_COLS):
+    filters = history_date_filters(start, end)
+    if user: filters.append(("eq", "user", user))
+    if action: filters.append(("eq", "action", action))
+    if item_q: filters.append(("ilike", "item", f"%{item_q}%"))
+    q = _select_query(TABLES[brand]["hist"], columns, filters, count=("exact" if with_count else None))
+    if cursor is not None: q = q.lt("id", cursor)
+    res = q.order("id", desc=True).limit(page_size).execute()
+    df = pd.DataFrame(res.data or [], columns=columns.split(","))
+    nxt = int(df["id"].iat[-1]) if len(df) == page_size else None
+    return df, (res.count if with_count else None), nxt
+
+# Tanggal history paling awal/akhir (coalesce(date, timestamp)) → (min, max) atau None bila kosong
+def history_date_bounds(brand: str):
+    def one(col, desc):
+        q = supabase.from_(TABLES[brand]["hist"]).select(col).not_.is_(col, "null")
+        if col == "timestamp": q = q.is_("date", "null")
+        res = q.order(col, desc=desc).limit(1).execute()
+        return pd.to_datetime(str(res.data[0][col])[:10], errors="coerce").date() if res.data else None
+    lo = [d for d in (one("date", False), one("timestamp", False)) if d]
+    hi = [d for d in (one("date", True), one("timestamp", True)) if d]
+    return (min(lo), max(hi)) if lo and hi else None
+
+
+# -------------------- PENDING QUERIES --------------------
+# Filter antrian approval → filter PostgREST. f: dict type/user/do_q/start/end (kosong = semua).
+def _pending_filters(f: dict) -> list:
+    out = []
+    if f.get("type"): out.append(("eq", "type", f["type"]))
+    if f.get("user"): out.append(("eq", "user", f["user"]))
+    if f.get("do_q"): out.append(("ilike", "do_number", f"%{f['do_q']}%"))
+    if f.get("start"): out.append(("gte", "date", str(f["start"])))
+    if f.get("end"): out.append(("lte", "date", str(f["end"])))
+    return out
+
+# Satu halaman pending (urut id) → (records, total)
+def pending_page(brand: str, f: dict, page=1, page_size=PAGE_ROWS) -> tuple:
+    start = (page-1)*page_size
+    res = (_select_query(TABLES[brand]["pend"], PEND_COLS, _pending_filters(f), order="id", count="exact")
+           .range(start, start+page_size-1).execute())
+    return _pending_records(pd.DataFrame(res.data or [])), (res.count or 0)
+
+# Ringkasan grup (by = "do_number"/"user"): hanya kolom ringan yang dibaca; "ids" = id pending anggota grup
+def pending_groups(brand: str, f: dict, by: str) -> pd.DataFrame:
+    df = _read_table(TABLES[brand]["pend"], f"id,{by},type,qty,date", _pending_filters(f), "id")
+    if df.empty: return pd.DataFrame(columns=[by, "Baris", "Total Qty", "Tipe", "Tanggal Awal", "ids"])
+    df[by] = df[by].fillna("-").astype(str)
+    df["qty"] = pd.to_numeric(df["qty"], errors="coerce").fillna(0).astype(int)
+    return (df.groupby(by, as_index=False)
+              .agg(**{"Baris": ("id", "size"), "Total Qty": ("qty", "sum"),
+                      "Tipe": ("type", lambda x: ", ".join(sorted(set(map(str, x))))), "Tanggal Awal": ("date", "min"),
+                      "ids": ("id", list)})
+              .sort_values("Tanggal Awal", na_position="last").reset_index(drop=True))
+
+# Baris pending lengkap untuk daftar id (dibaca ulang dari DB sebelum diproses)
+def pending_rows(brand: str, ids) -> list:
+    out = []
+    for chunk in _chunks(sorted(ids), 200):
+        out += _pending_records(_read_table(TABLES[brand]["pend"], PEND_COLS, [("in_", "id", chunk)], "id"))
+    return out
+
+# -------------------- GLOBAL SEARCH --------------------
+# Inverted index token → posting (np.int32 doc id) per (brand, versi inventory + history). Dokumen = master barang
+# (kode, nama, kategori) + baris history (kode, item, event, DO). Token query dicocokkan sebagai prefix
+# lewat bisect di daftar token terurut; beberapa token = irisan posting.
+SEARCH_LIMIT = 50
+_TOKEN_RX = r"[0-9a-z]+"
+
+@st.cache_resource
+def _search_store() -> dict:
+    return {"lock": threading.Lock(), "brands": {}}
+
+def _build_search_index(data: dict) -> dict:
+    inv = data["inventory"]
+    items = pd.DataFrame({"kind": "item", "ref": list(inv.keys()), "code": list(inv.keys()),
+                          "item": [it["name"] for it in inv.values()],
+                          "text": [f"{c} {it['name']} {it.get('category','')}" for c, it in inv.items()]})
+    h = pd.DataFrame(data["history"], columns=["id","code","item","event","do_number","action","date","user"])
+    hist = pd.DataFrame({"kind": "hist", "ref": h["id"], "code": h["code"], "item": h["item"],
+                         "event": h["event"], "do_number": h["do_number"], "action": h["action"], "date": h["date"],
+                         "user": h["user"],
+                         "text": h["code"].fillna("").astype(str) + " " + h["item"].fillna("").astype(str) + " "
+                                 + h["event"].fillna("").astype(str) + " " + h["do_number"].fillna("").astype(str)})
+    docs = pd.concat([items, hist], ignore_index=True)
+    tok = docs["text"].str.lower().str.findall(_TOKEN_RX).explode().dropna()
+    pairs = pd.DataFrame({"t": tok.values, "d": tok.index.astype("int32")}).drop_duplicates().sort_values(["t","d"])
+    t, d = pairs["t"].to_numpy(), pairs["d"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, t[1:] != t[:-1]]) if len(t) else np.empty(0, dtype=int)
+    return {"docs": docs.drop(columns="text"), "n_items": len(items), "users": docs["user"].to_numpy(),
+            "terms": t[starts].tolist(), "postings": np.split(d, starts[1:])}
+
+# Index hanya bergantung pada inventory + history → perubahan pending (tiap request diajukan) tidak memicu rebuild
+def search_index(data: dict) -> dict:
+    store = _search_store(); v = (data["version"][0], data["version"][2])
+    with store["lock"]:
+        cur = store["brands"].get(data["brand"])
+        if cur is None or cur["version"] != v:
+            cur = {"version": v, **_build_search_index(data)}
+            store["brands"][data["brand"]] = cur
+        return cur
+
+# Cari di index → (hasil master barang, hasil history terbaru dulu), masing-masing maks limit baris.
+# user diisi → hasil history dibatasi baris milik user tsb.
+def global_search(data: dict, query: str, limit=SEARCH_LIMIT, user=None):
+    idx = search_index(data); terms = idx["terms"]; hits = None
+    for t in re.findall(_TOKEN_RX, str(query).lower()):
+        lo, hi = bisect_left(terms, t), bisect_left(terms, t + "\uffff")
+        ids = np.unique(np.concatenate(idx["postings"][lo:hi])) if hi > lo else np.empty(0, dtype="int32")
+        hits = ids if hits is None else np.intersect1d(hits, ids, assume_unique=True)
+        if not len(hits): break
+    docs = idx["docs"]
+    if hits is None or not len(hits): return docs.iloc[0:0], docs.iloc[0:0]
+    # doc id: master dulu, lalu history urut id (snapshot) → dibalik = terbaru dulu
+    hist_ids = hits[hits >= idx["n_items"]][::-1]
+    if user: hist_ids = hist_ids[idx["users"][hist_ids] == user]
+    items = docs.iloc[hits[hits < idx["n_items"]]].sort_values("item").head(limit)
+    return items, docs.iloc[hist_ids[:limit]]
+
+# -------------------- REORDER ENGINE --------------------
+# Ambang Days of Cover → (rekomendasi, urgensi); di atas ambang terakhir = stok aman
+REORDER_BUCKETS = [(15,"Order NOW (Urgent)",1), (30,"Order bulan ini",2), (60,"Order bulan depan",3), (90,"Order 2 bulan lagi",4)]
+
+# n bulan penuh terakhir s/d ref_end (bulan berjalan ikut bila ref_end = akhir bulan) → (bulan_awal, bulan_akhir)
+def _last_full_months(ref_end, n=3):
+    ref_end = pd.Timestamp(ref_end)
+    last = ref_end.to_period("M") if ref_end.is_month_end else ref_end.to_period("M") - 1
+    return (last-(n-1)).to_timestamp(), last.to_timestamp()
+
+# Reorder Insight seluruh SKU sekaligus (kolom per kolom), OUT dijumlah per code. Tidak bergantung UI:
+# cukup snapshot (load_brand_data) + rollup (brand_rollups).
+# Jendela OUT = `months` bulan kalender penuh terakhir s/d ref_end (default hari ini, lihat _last_full_months),
+# bukan rolling N hari: rollup per bulan, dan bulan berjalan yang belum selesai akan menurunkan rata-rata.
+# Rata-rata harian = total OUT / months / 30.
+def reorder_insight(data: dict, df_roll: pd.DataFrame, tgt_days=60, ref_end=None, months=3) -> pd.DataFrame:
+    inv = data.get("inventory", {})
+    df = pd.DataFrame({"Kode": list(inv.keys()),
+                       "Nama Barang": [it.get("name","-") for it in inv.values()],
+                       "Unit": [it.get("unit","-") for it in inv.values()],
+                       "Current Stock": [int(it.get("qty",0)) for it in inv.values()]})
+    if df.empty: return df
+    m0, m1 = _last_full_months(ref_end if ref_end is not None else pd.Timestamp.today(), months)
+    out = df_roll[(df_roll["type_norm"]=="OUT") & (df_roll["month"]>=m0) & (df_roll["month"]<=m1)]
+    # baris lama tanpa code yang valid → resolve lewat nama
+    code = out["code"].where(out["code"].isin(inv.keys()),
+                             out["item"].map(lambda n: inv_code_for(data["inv_index"], n)))
+    out_by_code = out["qty"].groupby(code).sum()
+
+    last = df["Kode"].map(out_by_code).fillna(0).astype(int)
+    avg_m = last / float(months)
+    avg_daily = avg_m / 30.0
+    stock = df["Current Stock"]
+    doc = np.where(avg_daily > 0, stock / avg_daily.where(avg_daily > 0, 1), np.inf)
+    conds = [doc < lim for lim, _, _ in REORDER_BUCKETS]
+    reco = np.select(conds, [r for _, r, _ in REORDER_BUCKETS], default="OK (stok aman)")
+    urg = np.select(conds, [u for _, _, u in REORDER_BUCKETS], default=5)
+    reco = np.where(np.isinf(doc), "OK (tidak ada pemakaian)", reco)
+
+    df["OUT 3 Bulan"] = last
+    df["Avg OUT / Bulan"] = avg_m.round(1)
+    df["_doc"] = doc; df["_urgency"] = urg
+    df["Rekomendasi"] = reco
+    df["Saran Order (Qty)"] = np.where(avg_daily > 0, np.maximum(0, avg_daily*tgt_days - stock), 0).astype(int)
+    df = df.sort_values(["_urgency","_doc"], kind="stable")
+    df.insert(df.columns.get_loc("Avg OUT / Bulan")+1, "Days of Cover",
+              [("∞" if np.isinf(d) else int(round(d))) for d in df["_doc"]])
+    return df.drop(columns=["_doc","_urgency"]).reset_index(drop=True)
+
+def reorder_all_brands(tgt_days=60, ref_end=None) -> pd.DataFrame:
+    frames = []
+    for b, (data, roll) in load_all_brands().items():
+        df = reorder_insight(data, roll, tgt_days, ref_end)
+        if not df.empty: frames.append(df.assign(Brand=b.capitalize()))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+# -------------------- CONSOLIDATED (SEMUA BRAND) --------------------
+def _brand_bundle(brand: str) -> tuple:
+    data = brand_snapshot(brand)
+    return data, brand_rollups(data)
+
+# Snapshot + rollup semua brand dimuat bersamaan → {brand: (data, rollup)}; total ≈ brand paling lambat
+def load_all_brands(brands=None) -> dict:
+    brands = list(brands or BRANDS)
+    with _ctx_pool(len(brands)) as ex:
+        return dict(zip(brands, ex.map(_brand_bundle, brands)))
+
+# Gabung jadi frame ber-tag Brand → (stok, rollup bulanan)
+def consolidated_frames(bundles: dict) -> tuple:
+    inv, roll = [], []
+    for b, (data, r) in bundles.items():
+        inv.append(pd.DataFrame([{"Brand": b.capitalize(), "Kode": c, "Nama Barang": it.get("name","-"), "Qty": int(it.get("qty",0)),
+                                  "Satuan": it.get("unit","-"), "Kategori": it.get("category","Uncategorized")}
+                                 for c, it in data.get("inventory",{}).items()],
+                                columns=["Brand","Kode","Nama Barang","Qty","Satuan","Kategori"]))
+        if not r.empty: roll.append(r.assign(Brand=b.capitalize(), type_norm=r["type_norm"].astype(str)))
+    inv = pd.concat(inv, ignore_index=True) if inv else pd.DataFrame(columns=["Brand","Kode","Nama Barang","Qty","Satuan","Kategori"])
+    roll = pd.concat(roll, ignore_index=True) if roll else pd.DataFrame(columns=ROLLUP_KEYS+["qty","Brand"])
+    return inv, roll
+
+# KPI per brand + baris TOTAL untuk periode bulan [m_start, m_end]
+def consolidated_kpis(inv: pd.DataFrame, roll: pd.DataFrame, m_start, m_end) -> pd.DataFrame:
+    brands = [b.capitalize() for b in BRANDS]
+    rng = roll[(roll["month"]>=m_start)&(roll["month"]<=m_end)]
+    mov = (rng.pivot_table(index="Brand", columns="type_norm", values="qty", aggfunc="sum")
+           .reindex(index=brands, columns=["IN","OUT","RETURN"]).fillna(0).astype(int))
+    out = pd.DataFrame({"Total SKU": inv.groupby("Brand").size(), "Total Qty (Stock)": inv.groupby("Brand")["Qty"].sum()}
+                       ).reindex(brands).fillna(0).astype(int).join(mov.rename(columns={"RETURN":"Retur"}))
+    out.loc["TOTAL"] = out.sum()
+    return out.reset_index(names="Brand")
+
+
+
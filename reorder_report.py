@@ -0,0 +1,32 @@
+# reorder_report.py — Reorder Insight semua brand tanpa UI, untuk dijadwalkan (mis. cron tiap malam):
+#   0 1 * * *  cd /path/inventory && SUPABASE_URL=... SUPABASE_KEY=... python reorder_report.py --out reports
+# File ditulis ke --out sebagai Reorder_Semua_Brand_<YYYYMMDD>.<ext>; path file dicetak ke stdout.
+
+import os
+import sys
+import shutil
+import argparse
+from datetime import datetime
+
+from inventory_core import export_formats, reorder_all_brands, write_report
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Export Reorder Insight semua brand")
+    p.add_argument("--out", default="reports", help="folder tujuan (default: reports)")
+    p.add_argument("--format", default="Excel", choices=export_formats())
+    p.add_argument("--days", type=int, default=60, help="target Days of Cover (default: 60)")
+    args = p.parse_args(argv)
+
+    df = reorder_all_brands(args.days)
+    if df.empty:
+        print("Inventory kosong di semua brand; tidak ada file dibuat.", file=sys.stderr)
+        return 1
+    path, ext, _ = write_report({"Reorder Insight": df}, args.format)
+    os.makedirs(args.out, exist_ok=True)
+    dest = os.path.join(args.out, f"Reorder_Semua_Brand_{datetime.now().strftime('%Y%m%d')}{ext}")
+    shutil.move(path, dest)
+    print(dest)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+-- Delta stok atomik untuk approval: qty = qty + delta bagi banyak code dalam satu transaksi.
+-- Dipanggil dari app.py via supabase.rpc("apply_stock_deltas", ...).
+-- Baris dikunci urut code lebih dulu supaya dua approver yang menyentuh code sama tidak deadlock.
+create or replace function apply_stock_deltas(p_table text, p_codes text[], p_deltas int[])
+returns table(code text, qty int)
+language plpgsql
+as $$
+begin
+  if p_table not like 'inventory\_%' then
+    raise exception 'apply_stock_deltas: tabel % tidak diizinkan', p_table;
+  end if;
+  execute format('select 1 from %I where code = any($1) order by code for update', p_table)
+    using p_codes;
+  return query execute format(
+    'update %I as t set qty = t.qty + d.delta
+       from unnest($1::text[], $2::int[]) as d(code, delta)
+      where t.code = d.code
+      returning t.code::text, t.qty::int', p_table)
+    using p_codes, p_deltas;
+end;
+$$;
+
+grant execute on function apply_stock_deltas(text, text[], int[]) to anon, authenticated;
@@ -0,0 +1,9 @@
+-- Kunci idempotensi untuk insert history. app.py memberi tiap baris history idem_key (uuid dari klien)
+-- dan mengirim lewat upsert on_conflict=idem_key + ignore_duplicates, sehingga retry / kirim ulang spool
+-- setelah request yang sebenarnya sudah masuk tidak membuat baris ganda.
+-- Baris lama boleh null (unique index mengizinkan banyak null).
+alter table history_gulavit add column if not exists idem_key text;
+alter table history_takokak add column if not exists idem_key text;
+
+create unique index if not exists history_gulavit_idem_key on history_gulavit (idem_key);
+create unique index if not exists history_takokak_idem_key on history_takokak (idem_key);
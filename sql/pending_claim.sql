@@ -0,0 +1,8 @@
+-- Klaim pending saat approve/reject. app.py tidak lagi menghapus pending sebelum stok & history ditulis:
+-- baris diklaim dulu (claimed_by = token acak, claimed_at = waktu klaim), dihapus setelah semua tulis
+-- berhasil, dan klaimnya dilepas (claimed_by = null) bila proses gagal. Worker yang mati di tengah jalan
+-- meninggalkan klaim yang kedaluwarsa setelah CLAIM_TTL detik sehingga request bisa diproses ulang.
+alter table pending_gulavit add column if not exists claimed_by text;
+alter table pending_gulavit add column if not exists claimed_at timestamptz;
+alter table pending_takokak add column if not exists claimed_by text;
+alter table pending_takokak add column if not exists claimed_at timestamptz;
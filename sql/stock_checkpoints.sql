@@ -0,0 +1,20 @@
+-- Checkpoint saldo stok per item (opsional). Satu baris = saldo code per akhir hari as_of,
+-- mencakup semua baris history dengan id <= hist_id dan date <= as_of.
+-- Diisi/diperbarui dari app.py (Stock Card → "Perbarui Checkpoint").
+create table if not exists stock_checkpoints_gulavit (
+  code       text        not null,
+  as_of      date        not null,
+  qty        integer     not null,
+  hist_id    bigint      not null,
+  created_at timestamptz not null default now(),
+  primary key (code, as_of)
+);
+
+create table if not exists stock_checkpoints_takokak (
+  code       text        not null,
+  as_of      date        not null,
+  qty        integer     not null,
+  hist_id    bigint      not null,
+  created_at timestamptz not null default now(),
+  primary key (code, as_of)
+);
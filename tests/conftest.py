@@ -0,0 +1,144 @@
+# Fixture test inventory_core: klien Supabase palsu di memori (subset query builder PostgREST yang dipakai
+# inventory_core) dan cache Streamlit yang dikosongkan tiap test. inventory_core baru di-import di fixture,
+# jadi modul test yang butuh streamlit/supabase bisa melewati dirinya sendiri bila belum terpasang.
+
+import os
+import re
+import sys
+import tempfile
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+os.chdir(tempfile.mkdtemp(prefix="inventory_tests_"))  # spool/ dan uploads/ dibuat relatif cwd saat import
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.op, self.payload, self.conds, self.orders = "select", None, [], []
+        self.cols, self.count, self.rng, self.lim = "*", None, None, None
+        self.on_conflict, self.ignore_dup = None, False
+
+    def select(self, cols="*", count=None):
+        self.cols, self.count = cols, count; return self
+
+    def _where(self, fn):
+        self.conds.append(fn); return self
+
+    def eq(self, c, v): return self._where(lambda r: r.get(c) == v)
+    def neq(self, c, v): return self._where(lambda r: r.get(c) != v)
+    def gt(self, c, v): return self._where(lambda r: r.get(c) is not None and str(r[c]) > str(v))
+    def gte(self, c, v): return self._where(lambda r: r.get(c) is not None and str(r[c]) >= str(v))
+    def lt(self, c, v): return self._where(lambda r: r.get(c) is not None and r[c] < v)
+    def lte(self, c, v): return self._where(lambda r: r.get(c) is not None and str(r[c]) <= str(v))
+    def in_(self, c, vs): return self._where(lambda r: r.get(c) in list(vs))
+    def is_(self, c, v): return self._where(lambda r: r.get(c) is None)
+
+    def ilike(self, c, pat):
+        rx = re.compile("^" + re.escape(pat).replace("%", ".*") + "$", re.I)
+        return self._where(lambda r: r.get(c) is not None and bool(rx.match(str(r[c]))))
+
+    @property
+    def not_(self):
+        q = self
+        return types.SimpleNamespace(is_=lambda c, v: q._where(lambda r: r.get(c) is not None))
+
+    def or_(self, expr):
+        m = re.fullmatch(r"claimed_by\.is\.null,claimed_at\.lt\.(\S+)", expr)
+        if not m: raise NotImplementedError(expr)
+        cut = m.group(1)[:19]
+        return self._where(lambda r: r.get("claimed_by") is None or str(r.get("claimed_at") or "")[:19] < cut)
+
+    def order(self, c, desc=False):
+        self.orders.append((c, desc)); return self
+
+    def range(self, a, b):
+        self.rng = (a, b); return self
+
+    def limit(self, n):
+        self.lim = n; return self
+
+    def insert(self, p):
+        self.op, self.payload = "insert", p; return self
+
+    def upsert(self, p, on_conflict=None, ignore_duplicates=False):
+        self.op, self.payload, self.on_conflict, self.ignore_dup = "upsert", p, on_conflict, ignore_duplicates
+        return self
+
+    def update(self, p):
+        self.op, self.payload = "update", p; return self
+
+    def delete(self):
+        self.op = "delete"; return self
+
+    def execute(self):
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.op in ("insert", "upsert"):
+            out = []
+            for r in (self.payload if isinstance(self.payload, list) else [self.payload]):
+                r = dict(r)
+                if self.op == "upsert":
+                    keys = self.on_conflict.split(",")
+                    hit = next((x for x in rows if all(x.get(k) == r.get(k) for k in keys)), None)
+                    if hit is not None:
+                        if not self.ignore_dup: hit.update(r)
+                        continue
+                if "id" not in r and not self.table.startswith("inventory"):
+                    self.db.next_id += 1; r["id"] = self.db.next_id
+                rows.append(r); out.append(dict(r))
+            return types.SimpleNamespace(data=out, count=None)
+        hit = [r for r in rows if all(f(r) for f in self.conds)]
+        if self.op == "update":
+            for r in hit: r.update(self.payload)
+            return types.SimpleNamespace(data=[dict(r) for r in hit], count=None)
+        if self.op == "delete":
+            self.db.tables[self.table] = [r for r in rows if not any(r is h for h in hit)]
+            return types.SimpleNamespace(data=[dict(r) for r in hit], count=None)
+        for c, desc in reversed(self.orders):
+            hit = sorted(hit, key=lambda r: (r.get(c) is None, r.get(c)), reverse=desc)
+        n = len(hit)
+        if self.rng: hit = hit[self.rng[0]:self.rng[1]+1]
+        if self.lim is not None: hit = hit[:self.lim]
+        if self.cols != "*":
+            cols = [c.strip() for c in self.cols.split(",")]
+            hit = [{c: r.get(c) for c in cols} for r in hit]
+        return types.SimpleNamespace(data=[dict(r) for r in hit], count=n if self.count else None)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables, self.next_id, self.rpcs = {}, 1000, {"apply_stock_deltas": self._apply_stock_deltas}
+
+    def from_(self, table):
+        return FakeQuery(self, table)
+
+    table = from_
+
+    def rpc(self, name, params):
+        return types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=self.rpcs[name](**params)))
+
+    # Padanan sql/apply_stock_deltas.sql
+    def _apply_stock_deltas(self, p_table, p_codes, p_deltas):
+        out = []
+        for code, d in zip(p_codes, p_deltas):
+            for r in self.tables.get(p_table, []):
+                if r["code"] == code:
+                    r["qty"] += d; out.append({"code": code, "qty": r["qty"]})
+        return out
+
+
+@pytest.fixture
+def db(monkeypatch):
+    import streamlit as st
+    import inventory_core as core
+    fake = FakeSupabase()
+    monkeypatch.setattr(core, "supabase", fake)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    yield fake
+    st.cache_data.clear()
+    st.cache_resource.clear()
@@ -0,0 +1,249 @@
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+st = pytest.importorskip("streamlit")
+pytest.importorskip("supabase")
+import inventory_core as core  # noqa: E402
+
+BRAND = core.BRANDS[0]
+T = core.TABLES[BRAND]
+INV = {"A": {"name": "Apel", "qty": 10, "unit": "pcs", "category": "Buah"},
+       "B": {"name": "Bola", "qty": 5, "unit": "pcs", "category": "Mainan"}}
+
+
+# Snapshot brand seperti hasil load_brand_data; versi history ikut isi supaya store per versi dibangun ulang
+def make_data(inventory: dict, history: list, pending=()) -> dict:
+    inv = {c: dict(it) for c, it in inventory.items()}
+    return {"brand": BRAND, "inventory": inv, "inv_index": core.build_inv_index(inv),
+            "pending_requests": list(pending), "history": history,
+            "version": ((len(inv), None), (len(pending), None),
+                        (len(history), max([h["id"] for h in history], default=None)))}
+
+
+def _seed_inventory(db, inv=INV):
+    db.tables[T["inv"]] = [{"code": c, "item": it["name"], "qty": it["qty"], "unit": it["unit"],
+                            "category": it["category"]} for c, it in inv.items()]
+
+
+def _req(id_, type_, item, qty, **kw):
+    return {"id": id_, "type": type_, "item": item, "qty": qty, "unit": "pcs", "event": "-", "date": "2024-03-01",
+            "code": None, "trans_type": None, "do_number": "-", "attachment": None, "user": "budi", **kw}
+
+
+def _qty(db):
+    return {r["code"]: r["qty"] for r in db.tables[T["inv"]]}
+
+
+# -------------------- APPROVAL --------------------
+def test_approve_applies_deltas_history_and_removes_pending(db):
+    _seed_inventory(db)
+    reqs = [_req(1, "OUT", "Apel", 3), _req(2, "IN", "apel ", 2), _req(3, "IN", "Baru", 4, code="C9"),
+            _req(4, "OUT", "Tidak Ada", 1)]
+    db.tables[T["pend"]] = [dict(r) for r in reqs]
+
+    ids, warns = core.approve_requests(BRAND, reqs, make_data(INV, []), "admin")
+
+    assert ids == [1, 2, 3]
+    assert _qty(db) == {"A": 9, "B": 5, "C9": 4}
+    hist = {h["idem_key"]: h for h in db.tables[T["hist"]]}
+    assert [hist[f"pend-{i}"]["stock"] for i in ids] == [7, 9, 4]
+    # baris yang dilewati kembali ke antrian tanpa klaim
+    assert [(r["id"], r.get("claimed_by")) for r in db.tables[T["pend"]]] == [(4, None)]
+    assert any("Tidak Ada" in w for w in warns)
+
+
+def test_approve_failure_releases_claim_and_keeps_stock(db):
+    _seed_inventory(db)
+    reqs = [_req(1, "OUT", "Apel", 3), _req(2, "OUT", "Bola", 1)]
+    db.tables[T["pend"]] = [dict(r) for r in reqs]
+
+    def down(**kw): raise RuntimeError("connection reset")
+    db.rpcs["apply_stock_deltas"] = down
+
+    with pytest.raises(RuntimeError):
+        core.approve_requests(BRAND, reqs, make_data(INV, []), "admin")
+
+    assert _qty(db) == {"A": 10, "B": 5}
+    assert T["hist"] not in db.tables or not db.tables[T["hist"]]
+    assert [(r["id"], r.get("claimed_by")) for r in db.tables[T["pend"]]] == [(1, None), (2, None)]
+
+
+def test_approve_skips_requests_claimed_by_someone_else(db):
+    _seed_inventory(db)
+    reqs = [_req(1, "OUT", "Apel", 3), _req(2, "OUT", "Bola", 1)]
+    db.tables[T["pend"]] = [dict(r) for r in reqs]
+    token, got = core.pending_claim(BRAND, [2])
+    assert [r["id"] for r in got] == [2]
+
+    ids, warns = core.approve_requests(BRAND, reqs, make_data(INV, []), "admin")
+
+    assert ids == [1]
+    assert _qty(db) == {"A": 7, "B": 5}
+    assert [(r["id"], r["claimed_by"]) for r in db.tables[T["pend"]]] == [(2, token)]
+
+
+def test_approve_after_expired_claim_does_not_apply_twice(db):
+    _seed_inventory(db)
+    req = _req(1, "OUT", "Apel", 3)
+    db.tables[T["pend"]] = [dict(req, claimed_by="worker-mati", claimed_at="2000-01-01T00:00:00+00:00")]
+    db.tables[T["hist"]] = [{"id": 50, "action": "APPROVE_OUT", "item": "Apel", "qty": 3, "idem_key": "pend-1"}]
+
+    ids, warns = core.approve_requests(BRAND, [req], make_data(INV, []), "admin")
+
+    assert ids == []
+    assert _qty(db) == {"A": 10, "B": 5}
+    assert db.tables[T["pend"]] == []
+
+
+# -------------------- STOCK AS OF --------------------
+SIGN = {"ADD_ITEM": 1, "APPROVE_IN": 1, "APPROVE_OUT": -1, "APPROVE_RETURN": 1}
+
+
+def _hist(id_, action, code, qty, date=None, ts=None, item=None):
+    return {"id": id_, "action": action, "code": code, "item": item or code, "qty": qty, "date": date,
+            "timestamp": ts or f"{date} 09:00:00", "event": "-", "trans_type": None, "user": "budi", "unit": "pcs"}
+
+
+def _replay(history, as_of):
+    out = {}
+    for h in history:
+        if pd.Timestamp(h["date"] or h["timestamp"]).normalize() <= as_of:
+            out[h["code"]] = out.get(h["code"], 0) + SIGN[h["action"]] * h["qty"]
+    return {c: q for c, q in out.items() if q}
+
+
+def _nonzero(s):
+    return {c: int(q) for c, q in s.items() if q}
+
+
+def test_stock_as_of_with_checkpoint_matches_full_replay(db):
+    hist = [_hist(1, "ADD_ITEM", "A", 10, "2024-01-02"), _hist(2, "ADD_ITEM", "B", 5, "2024-01-02"),
+            _hist(3, "APPROVE_OUT", "A", 4, "2024-01-20"), _hist(4, "APPROVE_IN", "B", 7, "2024-02-03"),
+            _hist(5, "APPROVE_RETURN", "A", 1, None, ts="2024-02-15 10:00:00"),
+            _hist(6, "APPROVE_OUT", "B", 2, "2024-03-04")]
+    assert core.rebuild_checkpoints(make_data(INV, hist), cutoff="2024-02-29") == 2
+
+    # di-approve sesudah checkpoint dibuat: satu backdate ke sebelum cutoff, satu sesudahnya
+    hist = hist + [_hist(7, "APPROVE_OUT", "A", 2, "2024-02-10"), _hist(8, "APPROVE_IN", "A", 3, "2024-03-10")]
+    data = make_data(INV, hist)
+    for as_of in ["2024-01-31", "2024-02-12", "2024-02-29", "2024-03-05", "2024-12-31"]:
+        ts = pd.Timestamp(as_of)
+        assert _nonzero(core.stock_as_of(data, ts)) == _replay(hist, ts), as_of
+        assert _nonzero(core.stock_as_of(data, ts, code="A")) == {k: v for k, v in _replay(hist, ts).items() if k == "A"}
+
+
+def test_stock_as_of_resolves_legacy_rows_by_name(db):
+    hist = [_hist(1, "ADD_ITEM", None, 10, "2024-01-02", item="Apel"), _hist(2, "APPROVE_OUT", "A", 3, "2024-01-05")]
+    assert _nonzero(core.stock_as_of(make_data(INV, hist), "2024-01-31")) == {"A": 7}
+
+
+# -------------------- ROLLUP --------------------
+def _sorted(df):
+    return df.sort_values(core.ROLLUP_KEYS).reset_index(drop=True)[core.ROLLUP_KEYS + ["qty"]]
+
+
+def test_rollup_incremental_fold_matches_rebuild(db, monkeypatch):
+    hist = [_hist(1, "APPROVE_OUT", "A", 2, "2024-01-05"), _hist(2, "APPROVE_IN", "B", 3, "2024-01-06"),
+            _hist(4, "APPROVE_OUT", "A", 1, "2024-02-01")]
+    core.brand_rollups(make_data(INV, hist))
+
+    # id 3 baru terlihat setelah id 4 (commit tidak urut id); fold tidak boleh membangun ulang
+    hist2 = hist + [_hist(3, "APPROVE_OUT", "A", 5, "2024-01-07"), _hist(5, "APPROVE_OUT", "B", 1, "2024-02-02")]
+    built = []
+    real = core.prepared_history
+    monkeypatch.setattr(core, "prepared_history", lambda data: built.append(1) or real(data))
+    folded = core.brand_rollups(make_data(INV, hist2))
+    assert built == []
+
+    st.cache_resource.clear()
+    fresh = core.brand_rollups(make_data(INV, hist2))
+    pd.testing.assert_frame_equal(_sorted(folded), _sorted(fresh), check_dtype=False)
+    jan_out = fresh[(fresh["type_norm"] == "OUT") & (fresh["month"] == pd.Timestamp("2024-01-01"))]
+    assert int(jan_out["qty"].sum()) == 7
+
+
+def test_rollup_rebuilds_when_rows_disappear(db):
+    hist = [_hist(1, "APPROVE_OUT", "A", 2, "2024-01-05"), _hist(2, "APPROVE_OUT", "A", 3, "2024-01-06")]
+    core.brand_rollups(make_data(INV, hist))
+    roll = core.brand_rollups(make_data(INV, hist[1:]))
+    assert int(roll["qty"].sum()) == 3
+
+
+# -------------------- EVENT CATALOG --------------------
+def _ev(id_, action, code, qty, event, item=None):
+    return dict(_hist(id_, action, code, qty, "2024-03-01", item=item), event=event)
+
+
+def test_event_catalog_outstanding_quantities(db):
+    hist = [_ev(1, "APPROVE_OUT", "A", 10, "Bazar"), _ev(2, "APPROVE_RETURN", "A", 3, "bazar"),
+            _ev(3, "APPROVE_OUT", "A", 4, "Expo"), _ev(4, "APPROVE_RETURN", "A", 4, "EXPO"),
+            _ev(5, "APPROVE_OUT", None, 6, "Fair", item="bola")]
+    pending = [{"id": 9, "type": "RETURN", "code": "A", "item": "Apel", "qty": 2, "event": "BAZAR"}]
+    data = make_data(INV, hist, pending)
+
+    assert core.event_catalog(data)["by_code"] == {"A": {"Bazar": 7, "Expo": 0}, "B": {"Fair": 6}}
+    assert core.out_events_by_code(data) == {"A": {"Bazar": 5}, "B": {"Fair": 6}}
+    assert core.out_events_by_code(data, [{"code": "B", "event": " fair", "qty": 6}]) == {"A": {"Bazar": 5}}
+
+    # baris baru di-fold ke katalog yang sudah ada
+    data2 = make_data(INV, hist + [_ev(6, "APPROVE_OUT", "A", 2, "expo")], pending)
+    assert core.out_events_by_code(data2) == {"A": {"Bazar": 5, "Expo": 2}, "B": {"Fair": 6}}
+
+
+# -------------------- EXPORT --------------------
+def _read_back(path, fmt):
+    if fmt == "Excel": return pd.read_excel(path)
+    if fmt == "CSV": return pd.read_csv(path, encoding="utf-8-sig")
+    return pd.read_parquet(path)
+
+
+@pytest.mark.parametrize("fmt", core.export_formats())
+def test_export_readback(fmt):
+    df = pd.DataFrame({"Kode": ["A", "B"], "Qty": [10, 5], "Days of Cover": [12, "∞"]})
+    path, ext, _ = core.write_report({"Stok": df}, fmt)
+    try:
+        assert ext == core.EXPORT_FORMATS[fmt][0]
+        back = _read_back(path, fmt)
+        assert list(back.columns) == list(df.columns)
+        assert back["Kode"].tolist() == ["A", "B"]
+        assert back["Qty"].astype(int).tolist() == [10, 5]
+        assert back["Days of Cover"].astype(str).tolist() == ["12", "∞"]
+    finally:
+        os.remove(path)
+
+
+def test_export_chunked_sheets_zip_and_xlsx():
+    chunks = lambda: iter([pd.DataFrame({"id": [1, 2], "item": ["a", "b"]}), pd.DataFrame({"id": [3], "item": ["c"]})])
+    path, ext, _ = core.write_report({"Riwayat": chunks(), "Stok": pd.DataFrame({"Kode": ["A"]})}, "CSV")
+    try:
+        assert ext == ".zip"
+        with zipfile.ZipFile(path) as zf:
+            assert sorted(zf.namelist()) == ["Riwayat.csv", "Stok.csv"]
+            with zf.open("Riwayat.csv") as fh:
+                assert pd.read_csv(fh, encoding="utf-8-sig")["id"].tolist() == [1, 2, 3]
+    finally:
+        os.remove(path)
+    path, _, _ = core.write_report({"Riwayat": chunks()}, "Excel")
+    try:
+        assert pd.read_excel(path)["item"].tolist() == ["a", "b", "c"]
+    finally:
+        os.remove(path)
+
+
+@pytest.mark.skipif("Parquet" not in core.export_formats(), reason="pyarrow tidak terpasang")
+def test_export_parquet_keeps_numbers_after_empty_first_chunk():
+    chunks = iter([pd.DataFrame({"id": [1, 2], "qty": [None, None], "v": [None, None]}),
+                   pd.DataFrame({"id": [3], "qty": [5], "v": [5]}),
+                   pd.DataFrame({"id": [4], "qty": [None], "v": [2.5]})])
+    path, _, _ = core.write_report({"Riwayat": chunks}, "Parquet")
+    try:
+        back = pd.read_parquet(path)
+        assert back["id"].tolist() == [1, 2, 3, 4]
+        assert pd.api.types.is_numeric_dtype(back["qty"]) and pd.api.types.is_numeric_dtype(back["v"])
+        np.testing.assert_array_equal(back["v"].to_numpy(dtype=float), [np.nan, np.nan, 5.0, 2.5])
+    finally:
+        os.remove(path)